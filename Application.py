@@ -6,7 +6,7 @@ from Ev import *
 if __name__ == "__main__":
     WHITEBBET_DEFAULT_MAC = "00:01:01:63:77:33"
     parser = argparse.ArgumentParser(description='Codico Whitebeet reference implementation.')
-    parser.add_argument('interface_type', type=str, choices=('eth', 'spi'), help='Type of the interface through which the Whitebeet is connected. ("eth" or "spi").')
+    parser.add_argument('interface_type', type=str, choices=('eth', 'spi', 'loopback'), help='Type of the interface through which the Whitebeet is connected. ("eth", "spi" or "loopback" for the emulator).')
     parser.add_argument('-i', '--interface', type=str, required=True, help='This is the name of the interface where the Whitebeet is connected to (i.e. for eth "eth0" or spi "0").')
     parser.add_argument('-m', '--mac', type=str, help='This is the MAC address of the ethernet interface of the Whitebeet (i.e. "{}").'.format(WHITEBBET_DEFAULT_MAC))
     parser.add_argument('-r', '--role', type=str, choices=('EVSE', 'EV'), required=True, help='This is the role of the Whitebeet. "EV" for EV mode and "EVSE" for EVSE mode')
@@ -15,9 +15,15 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # If no MAC address was given set it to the default MAC address of the Whitebeet
-    if args.interface_type == "eth" and args.mac is None:
+    if args.interface_type in ("eth", "loopback") and args.mac is None:
         args.mac = WHITEBBET_DEFAULT_MAC
 
+    # On the loopback interface the Whitebeet is emulated
+    if args.interface_type == "loopback":
+        from WhitebeetEmulator import WhitebeetEmulator
+        emulator = WhitebeetEmulator(args.interface)
+        emulator.start()
+
     print('Welcome to Codico Whitebeet {} reference implementation'.format(args.role))
 
     # role is EV
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+from FramingInterface import *
+
+class AsyncFramingInterface(FramingInterface):
+    """
+    Asyncio variant of the framing interface. A reader thread waits on the SUT adapter and hands
+    every received frame over to the event loop. There the frame either completes a waiting
+    receive call or is stored in the backlog.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.waiters = []
+        self.notification_waiters = []
+        self.receive_thread = None
+        self.receiving = False
+
+    def start_receiving(self, loop):
+        """
+        Starts the reader thread. Received frames are dispatched on the given event loop.
+        """
+        self.loop = loop
+        self.receiving = True
+        self.receive_thread = threading.Thread(target=self._process_receive, daemon=True)
+        self.receive_thread.start()
+
+    def stop_receiving(self):
+        """
+        Stops the reader thread.
+        """
+        self.receiving = False
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+            self.receive_thread = None
+
+    def _process_receive(self):
+        while self.receiving:
+            frame = self.sut_adapter.wait_for_frame(time.time() + 0.5)
+            if frame is not None:
+                if self.recorder is not None:
+                    self.recorder.record(RECORD_RX, frame.raw)
+                try:
+                    self.loop.call_soon_threadsafe(self._dispatch_frame, frame)
+                except RuntimeError:
+                    # event loop was closed
+                    break
+
+    def _dispatch_frame(self, frame):
+        if self._is_late_frame(frame):
+            return
+        if self.notification_dispatcher.dispatch(frame):
+            for subscription, future in self.notification_waiters:
+                if not future.done() and subscription.frames:
+                    future.set_result(None)
+            return
+        for waiter in self.waiters:
+            frame_filter, future = waiter
+            if not future.done() and frame_filter.accepts(frame):
+                self.waiters.remove(waiter)
+                future.set_result(frame)
+                return
+        self.frame_backlog.append(frame)
+
+    async def receive_next_frame_async(self, break_on_data=False,
+                                       break_on_notification=False,
+                                       timeout=5,
+                                       noisy_timeout=True,
+                                       filter_mod=None,
+                                       filter_sub=None,
+                                       filter_req_id=None):
+        """
+        Awaitable version of receive_next_frame. A timeout of None waits forever.
+        """
+        frame_filter = FrameFilter(filter_mod, filter_sub, filter_req_id,
+                                   break_on_data, break_on_notification)
+
+        frame = self.frame_backlog.pop(frame_filter)
+        if frame is not None:
+            return self._accept_frame(frame, frame_filter)
+
+        waiter = (frame_filter, self.loop.create_future())
+        self.waiters.append(waiter)
+        try:
+            frame = await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            # the frame may have been dispatched to the backlog after the timeout cancelled the waiter
+            frame = self.frame_backlog.pop(frame_filter)
+            if frame is not None:
+                return self._accept_frame(frame, frame_filter)
+            if noisy_timeout:
+                raise AssertionError("Frame reception timed out")
+            else:
+                return None
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+        return self._accept_frame(frame, frame_filter)
+
+    async def receive_notification_async(self, subscription, timeout=5):
+        """
+        Awaitable version of receive_notification. A timeout of None waits forever.
+        """
+        while not subscription.frames:
+            waiter = (subscription, self.loop.create_future())
+            self.notification_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.notification_waiters.remove(waiter)
+        return subscription.frames.popleft()
+
+    async def notifications(self, filter_mod, filter_sub):
+        """
+        Asynchronous iterator over the notifications of the given module and sub IDs.
+        """
+        subscription = self.subscribe(filter_mod, filter_sub)
+        try:
+            while True:
+                yield await self.receive_notification_async(subscription, timeout=None)
+        finally:
+            self.unsubscribe(subscription)
+
+    def shut_down_interface(self):
+        self.stop_receiving()
+        super().shut_down_interface()
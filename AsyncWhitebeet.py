@@ -0,0 +1,241 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from Whitebeet import *
+from AsyncFramingInterface import *
+
+class _PendingTransfer(BaseException):
+    """
+    Raised by the I/O primitives of AsyncWhitebeet when a command needs a frame that was not
+    received yet.
+    """
+
+    def __init__(self, receive, *args):
+        self.receive = receive
+        self.receive_args = args
+
+class AsyncWhitebeet(Whitebeet):
+    """
+    Asyncio variant of the Whitebeet class. All commands (systemGetVersion, controlPilot*,
+    slac*, v2g*) return awaitables. The parse functions stay synchronous.
+
+    The commands of the Whitebeet class are reused. A command is executed until it needs a
+    response from the module. The request is then sent and the response is awaited. After that
+    the command is executed again and is handed the recorded responses until it returns.
+    Commands do not contain any await, therefore the replay is not interrupted by other
+    coroutines using the same object.
+    """
+
+    def __init__(self, iftype, iface, mac, txCoalescingUs=None, adapterMode="process", recordPath=None,
+                 kernelTimestamps=False, spiGpio=None, spiDevice=None, hardwareCs=False):
+        self._initializeAttributes(txCoalescingUs, adapterMode, recordPath, kernelTimestamps, spiGpio,
+                                   spiDevice, hardwareCs)
+        self.iftype = iftype
+        self.iface = iface
+        self.mac = mac
+        self.version = None
+        self.replay = []
+        self.replayIndex = 0
+
+        self.framing = AsyncFramingInterface()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """
+        Initializes the framing interface and brings the module into a defined state.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._initializeFraming, self.iftype, self.iface, self.mac)
+            self.framing.start_receiving(loop)
+            self.version = await self.systemGetVersion()
+            await self.slacStop()
+            await self.controlPilotStop()
+            if await self.v2gGetMode() == 1:
+                await self.v2gEvseStopListen()
+        except Exception:
+            self.connectionError = True
+            raise ConnectionError("Failed to initialize the framing interface on \"{}\"".format(self.framing.sut_interface))
+
+    async def close(self):
+        """
+        Stops the services of the module and shuts down the framing interface.
+        """
+        if self.framing.isInitialized() == True:
+            if self.connectionError == False:
+                if await self.v2gGetMode() == 1:
+                    await self.v2gEvseStopListen()
+                await self.slacStop()
+                await self.controlPilotStop()
+            self.framing.shut_down_interface()
+
+    def _shutdown(self):
+        if self.framing.isInitialized() == True:
+            self.framing.shut_down_interface()
+
+    async def _run(self, command, *args, **kwargs):
+        """
+        Executes a command of the Whitebeet class and performs its I/O asynchronously.
+        """
+        responses = []
+        while True:
+            self.replay = responses
+            self.replayIndex = 0
+            try:
+                return command(self, *args, **kwargs)
+            except _PendingTransfer as pending:
+                responses.append(await pending.receive(*pending.receive_args))
+            finally:
+                self.replay = []
+
+    def _replayed(self, receive, *args):
+        if self.replayIndex < len(self.replay):
+            response = self.replay[self.replayIndex]
+            self.replayIndex += 1
+            return response
+        raise _PendingTransfer(receive, *args)
+
+    def _sendReceive(self, mod_id, sub_id, payload):
+        self._checkNotPipelined(mod_id, sub_id)
+        return self._replayed(self._sendReceiveAsync, mod_id, sub_id, payload)
+
+    def _receive(self, mod_id, sub_id, req_id, timeout):
+        return self._replayed(self._receiveAsync, mod_id, sub_id, req_id, timeout)
+
+    def _receiveSilent(self, mod_id, sub_id, req_id, timeout):
+        return self._replayed(self._receiveSilentAsync, mod_id, sub_id, req_id, timeout)
+
+    def _receiveNotificationSilent(self, mod_id, sub_ids, timeout):
+        return self._replayed(self._receiveNotificationSilentAsync, mod_id, sub_ids, timeout)
+
+    async def _sendReceiveAsync(self, mod_id, sub_id, payload):
+        """
+        Sends a message and awaits the response. When the whitebeet returns busy the message will
+        be repeated until it is accepted to the timeout runs out.
+        """
+        try:
+            time_end = time.time() + 5
+            sent_time = time.time_ns()
+            while True:
+                req_id = self.framing.build_and_send_frame(mod_id, sub_id, payload)
+                response = await self.framing.receive_next_frame_async(filter_mod=[mod_id, 0xFF], filter_sub={ mod_id: sub_id }, filter_req_id=req_id, timeout=max(time_end - time.time(), 0), noisy_timeout=False)
+                if response is None:
+                    self.framing.request_ids.expire(req_id)
+                if self._checkResponse(sub_id, response):
+                    continue
+                if self.kernelTimestamps:
+                    self._recordTiming(mod_id, sub_id, sent_time, response)
+                return response
+        except Exception:
+            self.connectionError = True
+            raise ConnectionError("Problem with send/receive - Please check your connection!")
+
+    @asynccontextmanager
+    async def pipeline(self):
+        """
+        Asyncio variant of Whitebeet.pipeline, used with "async with". Commands that are awaited
+        inside of the block are only sent, the responses are awaited when the block is left.
+        While the pipeline is open, commands of other coroutines on the same object are
+        pipelined as well.
+        """
+        if self.pipelinedRequests is not None:
+            raise RuntimeError("Pipelines cannot be nested")
+        self.pipelinedRequests = []
+        try:
+            yield self
+        except BaseException:
+            await self._drainPipelineAsync(0, check=False)
+            raise
+        error = await self._drainPipelineAsync(5)
+        if error is not None:
+            raise error
+
+    async def _drainPipelineAsync(self, timeout, check=True):
+        """
+        Ends the pipeline and awaits the responses of all pipelined requests within the timeout.
+        With check the responses are checked and the first error is returned.
+        """
+        requests = self.pipelinedRequests
+        self.pipelinedRequests = None
+        error = None
+        time_end = time.time() + timeout
+        for request in requests:
+            if request.response is None:
+                request.response = await self.framing.receive_next_frame_async(filter_mod=[request.mod_id, 0xFF], filter_sub={ request.mod_id: request.sub_id }, filter_req_id=request.req_id, timeout=max(time_end - time.time(), 0), noisy_timeout=False)
+                if request.response is None:
+                    self.framing.request_ids.expire(request.req_id)
+            if not check:
+                continue
+            try:
+                self._checkPipelined(request, request.response)
+            except (ConnectionError, Warning) as e:
+                if error is None:
+                    error = e
+        return error
+
+    async def _receiveAsync(self, mod_id, sub_id, req_id, timeout):
+        """
+        Awaits a message with the given parameters until the timeout is reached.
+        """
+        response = await self._receiveSilentAsync(mod_id, sub_id, req_id, timeout)
+        if response is None:
+            raise TimeoutError("We did not receive a frame before the timeout of {}s".format(timeout))
+        return response
+
+    async def _receiveSilentAsync(self, mod_id, sub_id, req_id, timeout):
+        """
+        Awaits a message with the given parameters until the timeout is reached.
+        Returns None if no frame is received within timeout.
+        """
+        return await self.framing.receive_next_frame_async(filter_mod=mod_id, filter_sub=sub_id, filter_req_id=req_id, noisy_timeout=False, timeout=timeout)
+
+    async def _receiveNotificationSilentAsync(self, mod_id, sub_ids, timeout):
+        """
+        Awaits one of the given notifications until the timeout is reached.
+        Returns None if no notification is received within timeout.
+        """
+        return await self.framing.receive_notification_async(self._subscription(mod_id, sub_ids), timeout)
+
+    async def v2gEvseRequests(self):
+        """
+        Asynchronous iterator over the V2G request status messages of the EVSE.
+        Yields tuples of sub ID and payload.
+        """
+        while True:
+            # the subscription is renewed if the service was stopped in the meantime
+            subscription = self._subscription(self.v2g_mod_id, self.v2g_evse_notification_ids)
+            frame = await self.framing.receive_notification_async(subscription, timeout=None)
+            yield frame.sub_id, frame.payload
+
+    async def v2gEvRequests(self):
+        """
+        Asynchronous iterator over the V2G request status messages of the EV.
+        Yields tuples of sub ID and payload.
+        """
+        while True:
+            # the subscription is renewed if the service was stopped in the meantime
+            subscription = self._subscription(self.v2g_mod_id, self.v2g_ev_notification_ids)
+            frame = await self.framing.receive_notification_async(subscription, timeout=None)
+            yield frame.sub_id, frame.payload
+
+def _asyncCommand(name):
+    command = getattr(Whitebeet, name)
+
+    async def asyncCommand(self, *args, **kwargs):
+        return await self._run(command, *args, **kwargs)
+
+    asyncCommand.__name__ = name
+    asyncCommand.__qualname__ = "AsyncWhitebeet." + name
+    asyncCommand.__doc__ = command.__doc__
+    return asyncCommand
+
+for _name in dir(Whitebeet):
+    if _name.startswith(("system", "networkConfig", "controlPilot", "slac", "v2g")) and "Parse" not in _name \
+            and callable(getattr(Whitebeet, _name)):
+        setattr(AsyncWhitebeet, _name, _asyncCommand(_name))
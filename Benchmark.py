@@ -0,0 +1,530 @@
+import argparse
+import time
+from collections import deque
+from FramingAPIDef import *
+from FrameBacklog import *
+from FrameEncoder import *
+
+def _frame(mod_id, sub_id, req_id):
+    frame = Frame()
+    frame.mod_id = mod_id
+    frame.sub_id = sub_id
+    frame.req_id = req_id
+    return frame
+
+def benchmarkBacklog(iterations):
+    """
+    Measures the time to find a response in a backlog that is filled with unsolicited V2G
+    notifications and responses nobody waits for, which all have different keys. The lookup
+    cost should not depend on the size of the backlog.
+    """
+    print("Backlog lookup")
+    for size in [10, 100, 1000, 10000]:
+        backlog = FrameBacklog(limits={})
+        for i in range(size):
+            if i % 2:
+                backlog.append(_frame(0x27, 0x80 + i % 18, 0xFF))
+            else:
+                backlog.append(_frame(0x27, 0x40 + i // 2 % 32, i // 64 % 254 + 1))
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            backlog.append(_frame(0x29, 0x48, i % 255))
+            frame_filter = FrameFilter([0x29, 0xFF], {0x29: 0x48}, i % 255)
+            backlog.pop(frame_filter)
+        duration = time.perf_counter() - start
+        print("  backlog size {:>5}: {:.2f}us per lookup".format(size, duration / iterations * 1e6))
+
+def _legacyComputePayloadChecksum(data):
+    """
+    Verbatim copy of FramingInterface.compute_payload_checksum before the FrameEncoder.
+    """
+    sum = 0
+    for i in range(len(data)):
+        sum += data[i]
+    sum = (sum & 0xFFFF) + (sum >> 16)
+    sum = (sum & 0xFF) + (sum >> 8)
+    sum = (sum & 0xFF) + (sum >> 8)
+    if(sum != 0xFF):
+        sum = (~sum & 0xFF)
+
+    return sum.to_bytes(1, byteorder="big", signed=False)
+
+def _legacyBuildFrame(module_id, sub_id, payload, request_id_num):
+    """
+    Verbatim copy of FramingInterface.build_and_send_frame before the FrameEncoder, returning
+    the frame instead of sending it, kept as reference.
+    """
+    payload_length_and_payload = len(payload).to_bytes(
+        2, "big") + payload if payload else b"\x00\x00"
+    request_id = request_id_num.to_bytes(1, "big")
+    frame_without_checksum = (START_OF_FRAME.to_bytes(1, "big") + module_id.to_bytes(1, "big") +
+                              sub_id.to_bytes(1, "big") + request_id +
+                              payload_length_and_payload + b"\x00" + END_OF_FRAME.to_bytes(1,"big"))
+
+    return (START_OF_FRAME.to_bytes(1, "big") + module_id.to_bytes(1, "big") + sub_id.to_bytes(1, "big")
+            + request_id + payload_length_and_payload +
+            _legacyComputePayloadChecksum(frame_without_checksum) + END_OF_FRAME.to_bytes(1, "big"))
+
+def benchmarkEncoder(iterations):
+    """
+    Measures the encoded frames per second of the legacy frame builder and the FrameEncoder
+    for a DC charging parameter update and a command without payload.
+    """
+    print("Frame encoding")
+    encoder = FrameEncoder()
+    update_dc = bytes(range(17))
+    for name, sub_id, payload in [("update DC parameters", 0x63, update_dc), ("no payload", 0x6A, None)]:
+        for req_id in range(1, 255):
+            if encoder.encode(0x27, sub_id, req_id, payload) != _legacyBuildFrame(0x27, sub_id, payload, req_id):
+                raise AssertionError("Encoded frames differ")
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            _legacyBuildFrame(0x27, sub_id, payload, i % 254 + 1)
+        legacy = iterations / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            encoder.encode(0x27, sub_id, i % 254 + 1, payload)
+        encoded = iterations / (time.perf_counter() - start)
+
+        print("  {:<20}: {:>9.0f} frames/s before, {:>9.0f} frames/s after".format(name, legacy, encoded))
+
+def benchmarkSend(iterations, interface="lo"):
+    """
+    Measures the time to send a frame through the Ethernet adapter, once composed with scapy
+    and once on the raw AF_PACKET socket with the precomputed Ethernet header. The packets are
+    sent to the loopback interface, which needs the permission to open raw sockets.
+    """
+    from EthernetAdapter import EthernetAdapter
+
+    print("Ethernet send latency")
+    frame = FrameEncoder().encode(0x27, 0x63, 1, bytes(range(17)))
+    for name, use_raw_socket in [("scapy", False), ("raw socket", True)]:
+        adapter = EthernetAdapter("thread")
+        adapter.sut_interface = interface
+        adapter.dut_mac = "c4:93:00:22:22:22"
+        adapter.use_raw_socket = use_raw_socket
+        try:
+            adapter.open_socket()
+            adapter.send(frame)
+        except Exception as e:
+            print("  {:<10}: not available ({})".format(name, e))
+            adapter.close_socket()
+            continue
+
+        latencies = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            adapter.send(frame)
+            latencies.append(time.perf_counter() - start)
+        adapter.close_socket()
+
+        latencies.sort()
+        print("  {:<10}: {:>6.1f}us mean, {:>6.1f}us median, {:>6.1f}us 99th percentile".format(
+            name, sum(latencies) / iterations * 1e6, latencies[iterations // 2] * 1e6,
+            latencies[iterations * 99 // 100] * 1e6))
+
+def benchmarkReceive(iterations, interface="lo"):
+    """
+    Measures the CPU time to receive a packet through the packet ring and through recv on the
+    filtered raw socket. The packets are sent to the loopback interface in bursts, together
+    with the same number of packets from a foreign source that the kernel filter drops.
+    """
+    import socket
+    from PacketRing import PacketRing
+
+    print("Ethernet receive")
+    frame = FrameEncoder().encode(0x27, 0x80, 0xFF, bytes(range(17)))
+    load = b"\x00\x04" + len(frame).to_bytes(2, "big") + frame
+    dut_mac = "c4:93:00:22:22:22"
+    packet = bytes(6) + bytes.fromhex(dut_mac.replace(":", "")) + b"\x60\x03" + load
+    foreign = bytes(6) + bytes.fromhex("c4:93:00:22:22:23".replace(":", "")) + b"\x60\x03" + load
+    burst = 32
+    for name, ring in [("packet ring", True), ("recv", False)]:
+        try:
+            receiver = PacketRing(interface, 0x6003, dut_mac, ring)
+            sender = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+            sender.bind((interface, 0))
+        except OSError as e:
+            print("  {:<11}: not available ({})".format(name, e))
+            continue
+
+        received = [0]
+        def callback(payload):
+            received[0] += 1
+
+        cpu_time = 0
+        for i in range(iterations // burst):
+            for j in range(burst):
+                sender.send(packet)
+                sender.send(foreign)
+            start = time.process_time()
+            while received[0] < (i + 1) * burst:
+                receiver.receive(callback, 1)
+            cpu_time += time.process_time() - start
+        receiver.close()
+        sender.close()
+
+        print("  {:<11}: {:>6.2f}us CPU time per packet".format(name, cpu_time / received[0] * 1e6))
+
+def benchmarkQueues(iterations):
+    """
+    Measures the handoff of a received frame from the receive loop to the framing interface
+    through the RX queue of the process, thread and shm adapter mode.
+    """
+    from SUTAdapter import SUTAdapter
+
+    print("RX queue handoff")
+    raw = FrameEncoder().encode(0x27, 0x80, 0xFF, bytes(range(17)))
+    for mode in ["process", "thread", "shm"]:
+        adapter = SUTAdapter()
+        adapter.initialize_queues(mode, transmit=False)
+        start = time.perf_counter()
+        for i in range(iterations):
+            # in shm mode the raw frame is handed over behind its timestamp and parsed by the consumer
+            if mode == "shm":
+                adapter.queue_rx.put_nowait(raw, adapter.rx_prefix)
+            else:
+                adapter.queue_rx.put_nowait(Frame(raw))
+            adapter.queue_rx.get_nowait()
+        duration = time.perf_counter() - start
+        print("  {:<7}: {:>8.2f}us per frame".format(mode, duration / iterations * 1e6))
+        if mode == "shm":
+            benchmarkWakeup(adapter, raw, min(iterations, 1000))
+            adapter.queue_rx.close()
+
+def _produceTimestamped(ring, raw, iterations):
+    # puts the frames into the ring with the time they were put in as prefix
+    prefix = bytearray(8)
+    for i in range(iterations):
+        time.sleep(0.0005)
+        prefix[:] = time.perf_counter_ns().to_bytes(8, "little")
+        ring.put_nowait(raw, prefix)
+
+def benchmarkWakeup(adapter, raw, iterations):
+    """
+    Measures the time from putting a frame into the shm ring in another process until the
+    consumer, which is blocked in get(), returns it.
+    """
+    import multiprocessing
+
+    producer = multiprocessing.Process(target=_produceTimestamped, args=(adapter.queue_rx, raw, iterations))
+    producer.start()
+    latencies = []
+    for i in range(iterations):
+        frame = adapter.queue_rx.get(timeout=1)
+        latencies.append(time.perf_counter_ns() - frame.timestamp)
+    producer.join()
+    latencies.sort()
+    print("  {:<7}: {:>8.2f}us mean, {:>8.2f}us median wake-up of a blocked consumer".format(
+        "shm", sum(latencies) / len(latencies) / 1000, latencies[len(latencies) // 2] / 1000))
+
+def benchmarkCoalescing(iterations, packet_cost=50e-6):
+    """
+    Sends bursts of frames through the Ethernet adapter with and without TX coalescing and
+    measures the packets per second on the wire and the latency between send and wire. Every
+    packet costs packet_cost seconds on the simulated wire, which approximates building and
+    sending the packet with scapy. After a burst the sender either waits for the responses,
+    which flushes the coalesced frames, or relies on the flush deadline.
+    """
+    from EthernetAdapter import EthernetAdapter
+
+    print("Ethernet TX coalescing")
+    encoder = FrameEncoder()
+    frame = encoder.encode(0x27, 0x63, 1, bytes(range(17)))
+    burst = 8
+    for coalescing_us, wait_for_responses in [(None, True), (200, True), (200, False)]:
+        adapter = EthernetAdapter()
+        adapter.tx_coalescing_us = coalescing_us
+        queued = deque()
+        latencies = []
+        packets = [0]
+
+        def wire(load):
+            end = time.perf_counter() + packet_cost
+            while time.perf_counter() < end:
+                pass
+            pos = 0
+            while pos < len(load):
+                latencies.append(end - queued.popleft())
+                pos += 4 + int.from_bytes(load[pos + 2:pos + 4], "big")
+            packets[0] += 1
+
+        adapter.send_packet = wire
+        adapter.start_transmit()
+        start = time.perf_counter()
+        for i in range(iterations):
+            queued.append(time.perf_counter())
+            adapter.send(frame)
+            if i % burst == burst - 1:
+                if wait_for_responses:
+                    adapter.flush()
+                while queued:
+                    time.sleep(0)
+        adapter.stop_transmit()
+        duration = time.perf_counter() - start
+
+        name = "off" if coalescing_us is None else "{}us, {}".format(
+            coalescing_us, "flush on wait" if wait_for_responses else "deadline")
+        print("  coalescing {:<22}: {:>7.0f} packets/s, {:>7.0f} frames/s, {:>6.1f}us mean latency".format(
+            name, packets[0] / duration, iterations / duration, sum(latencies) / len(latencies) * 1e6))
+
+def benchmarkLoopback(iterations):
+    """
+    Measures the request round trip through the framing interface on a loopback adapter whose
+    peer answers every request, with and without a simulated link latency and bandwidth.
+    """
+    import threading
+    import LoopbackAdapter
+    from FramingInterface import FramingInterface
+
+    print("Loopback round trip")
+    for latency, bandwidth in [(0, None), (100e-6, None), (100e-6, 10e6)]:
+        module = LoopbackAdapter.listen("benchmark", latency, bandwidth)
+        framing = FramingInterface()
+        framing.initialize_framing("LOOPBACK", "benchmark", None)
+        running = [True]
+
+        def answer():
+            while running[0]:
+                frame = module.wait_for_frame(time.time() + 0.1)
+                if frame is not None:
+                    module.send(encoder.encode(frame.mod_id, frame.sub_id, frame.req_id, b"\x00"))
+
+        encoder = FrameEncoder()
+        thread = threading.Thread(target=answer, daemon=True)
+        thread.start()
+        start = time.perf_counter()
+        for i in range(iterations):
+            framing.send_request(0x29, 0x48, None).result()
+        duration = time.perf_counter() - start
+        running[0] = False
+        thread.join()
+
+        print("  latency {:>5.0f}us, bandwidth {:>10}: {:>7.1f}us per request".format(
+            latency * 1e6, "unlimited" if bandwidth is None else "{:.0f}bit/s".format(bandwidth),
+            duration / iterations * 1e6))
+
+def runEvseSession(whitebeet):
+    """
+    Runs an EVSE session with the commands and parse functions of the Whitebeet class until
+    the session stopped. Returns the number of received notifications.
+    """
+    schedule = {"code": 0, "schedule_tuples": [{"schedule_tuple_id": 1, "schedules": [
+        {"start": 0, "interval": 1800, "power": 11000}]}]}
+    parsers = {
+        0x80: whitebeet.v2gEvseParseSessionStarted,
+        0x81: whitebeet.v2gEvseParsePaymentSelected,
+        0x82: whitebeet.v2gEvseParseAuthorizationStatusRequested,
+        0x83: whitebeet.v2gEvseParseEnergyTransferModeSelected,
+        0x84: whitebeet.v2gEvseParseSchedulesRequested,
+        0x85: whitebeet.v2gEvseParseDCChargeParametersChanged,
+        0x87: whitebeet.v2gEvseParseCableCheckRequested,
+        0x88: whitebeet.v2gEvseParsePreChargeStarted,
+        0x89: whitebeet.v2gEvseParseStartChargingRequested,
+        0x8A: whitebeet.v2gEvseParseStopChargingRequested,
+        0x8B: whitebeet.v2gEvseParseWeldingDetectionStarted,
+        0x8C: whitebeet.v2gEvseParseSessionStopped,
+    }
+    commands = {
+        0x82: lambda: whitebeet.v2gEvseSetAuthorizationStatus(True),
+        0x84: lambda: whitebeet.v2gEvseSetSchedules(schedule),
+        0x87: lambda: whitebeet.v2gEvseSetCableCheckFinished(True),
+        0x89: whitebeet.v2gEvseStartCharging,
+        0x8A: whitebeet.v2gEvseStopCharging,
+    }
+    notifications = 0
+    whitebeet.v2gEvseStartListen()
+    while True:
+        id, data = whitebeet.v2gEvseReceiveRequest()
+        notifications += 1
+        parsers[id](data)
+        if id in commands:
+            commands[id]()
+        if id == 0x8C:
+            return notifications
+
+def benchmarkReplay(iterations):
+    """
+    Records an EVSE session against the emulator and plays it back as fast as possible, which
+    measures the framing, parsing and command layers of the host without a module.
+    """
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import ReplayAdapter
+    from Whitebeet import Whitebeet
+    from WhitebeetEmulator import WhitebeetEmulator
+
+    print("Replay of an EVSE session")
+    sessions = max(iterations // 100, 1)
+    path = os.path.join(tempfile.mkdtemp(), "session.cap")
+    # the framing interface logs every initialization
+    with contextlib.redirect_stdout(io.StringIO()):
+        with WhitebeetEmulator("benchmark"):
+            with Whitebeet("LOOPBACK", "benchmark", None, recordPath=path) as whitebeet:
+                start = time.perf_counter()
+                runEvseSession(whitebeet)
+                live = time.perf_counter() - start
+
+        notifications = 0
+        start = time.perf_counter()
+        for i in range(sessions):
+            ReplayAdapter.prepare("benchmark", path, paced=False)
+            with Whitebeet("REPLAY", "benchmark", None) as whitebeet:
+                notifications += runEvseSession(whitebeet)
+        duration = time.perf_counter() - start
+    os.remove(path)
+
+    print("  emulator: {:>7.2f}ms per session".format(live * 1e3))
+    print("  replay:   {:>7.2f}ms per session including initialization, {:>7.0f} notifications/s".format(
+        duration / sessions * 1e3, notifications / duration))
+
+def benchmarkSpi(iterations):
+    """
+    Measures the host time of an SPI data transfer against the FakeSpiDev, building the
+    transfer byte by byte as before the SpiTransferEngine and with the engine. The throughput
+    the engine reports is compared with the clock of the fake device.
+    """
+    from SpiTransferEngine import SpiTransferEngine
+    from tests.fake_spidev import FakeSpiDev
+
+    print("SPI data transfer")
+    iterations = max(iterations // 10, 1)
+    spi = FakeSpiDev(bufsiz=1 << 17)
+    engine = SpiTransferEngine(spi)
+    for size in [16, 256, 4096, 16384]:
+        data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        start = time.perf_counter()
+        for i in range(iterations):
+            frame = bytearray(b"\x55\x55\x00\x00") + bytearray(data[:size // 2])
+            count = size - size // 2
+            while count > 0:
+                frame.append(0x00)
+                count -= 1
+            reply = bytearray(spi.xfer(frame))
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            reply = engine.transfer(b"\x55\x55\x00\x00", data[:size // 2], size)
+        duration = time.perf_counter() - start
+        print("  {:>5} bytes: {:>8.1f}us legacy, {:>8.1f}us engine per transfer".format(
+            size, legacy / iterations * 1e6, duration / iterations * 1e6))
+
+    spi = FakeSpiDev(clock=True)
+    spi.max_speed_hz = 12000000
+    engine = SpiTransferEngine(spi)
+    for i in range(100):
+        engine.transfer(b"\x55\x55\x00\x00", None, 4096)
+    print("  reported {:.0f} bytes/s at a clock of {:.0f} bytes/s".format(
+        engine.get_statistics()["bytes_per_second"], spi.max_speed_hz / 8))
+
+class _SpiModule():
+    """
+    Slave side of the SPI protocol for the FakeSpiDev, driving RX ready and TX pending of a
+    FakeGpioHal. RX ready goes low after a size header and is raised again by the thread of the
+    module, which also answers every request frame with an ACK and raises TX pending for it.
+    """
+
+    def __init__(self, gpio, rx_ready=22, tx_pending=27):
+        import queue
+        import threading
+
+        self.gpio = gpio
+        self.rx_ready = rx_ready
+        self.tx_pending = tx_pending
+        self.encoder = FrameEncoder()
+        self.lock = threading.Lock()
+        self.responses = deque()
+        self.pending = b""
+        self.events = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.gpio.set_input(self.rx_ready, 1)
+        self.thread.start()
+
+    def respond(self, data):
+        if data[0] == 0xAA:
+            with self.lock:
+                self.pending = self.responses.popleft() if self.responses else b""
+                if not self.responses:
+                    self.gpio.set_input(self.tx_pending, 0)
+            self.gpio.set_input(self.rx_ready, 0)
+            self.events.put(None)
+            size = len(self.pending)
+            return bytes([0xAA, 0xAA, size // 255, size % 255])
+        if len(data) > 4 and data[4] == START_OF_FRAME:
+            self.events.put(bytes(data[4:10]))
+        return b"\x55\x55\x00\x00" + self.pending
+
+    def run(self):
+        while True:
+            header = self.events.get()
+            if header is None:
+                self.gpio.set_input(self.rx_ready, 1)
+                continue
+            response = self.encoder.encode(header[1], header[2], header[3], b"\x00")
+            with self.lock:
+                self.responses.append(response)
+            self.gpio.set_input(self.tx_pending, 1)
+
+def benchmarkSpiLoop(iterations):
+    """
+    Runs requests through the framing interface and the SPI adapter in thread mode against a
+    FakeSpiDev and a FakeGpioHal. Every transfer is triggered by an edge of TX pending or RX
+    ready or by the frame to send. Measures the round trip and the CPU time of the idle
+    adapter, which sleeps until an edge wakes it up.
+    """
+    from FramingInterface import FramingInterface
+    from GpioHal import FakeGpioHal
+    from tests.fake_spidev import FakeSpiDev
+
+    print("SPI round trip with fake GPIOs")
+    iterations = max(iterations // 10, 1)
+    gpio = FakeGpioHal()
+    module = _SpiModule(gpio)
+    framing = FramingInterface()
+    framing.initialize_framing("SPI", "spidev0.0", None, adapter_mode="thread", gpio=gpio,
+                               spi=FakeSpiDev(module.respond))
+    try:
+        start = time.perf_counter()
+        for i in range(iterations):
+            if framing.send_request(0x29, 0x48, None).result(timeout=1) is None:
+                raise AssertionError("No response to request {} over SPI".format(i))
+        duration = time.perf_counter() - start
+
+        cpu_start = time.process_time()
+        time.sleep(0.5)
+        idle = (time.process_time() - cpu_start) / 0.5
+    finally:
+        framing.sut_adapter.stop()
+
+    print("  {:>7.1f}us per request, {:.2f}% CPU while idle".format(duration / iterations * 1e6, idle * 100))
+
+if __name__ == "__main__":
+    benchmarks = {
+        "backlog": benchmarkBacklog,
+        "encoder": benchmarkEncoder,
+        "coalescing": benchmarkCoalescing,
+        "send": benchmarkSend,
+        "receive": benchmarkReceive,
+        "queues": benchmarkQueues,
+        "loopback": benchmarkLoopback,
+        "replay": benchmarkReplay,
+        "spi": benchmarkSpi,
+        "spiloop": benchmarkSpiLoop,
+    }
+    parser = argparse.ArgumentParser(description='Benchmarks of the framing layer.')
+    parser.add_argument('benchmark', type=str, nargs='*', help='Benchmarks to run. Runs all benchmarks if none is given.')
+    parser.add_argument('-n', '--iterations', type=int, default=10000, help='Number of iterations per measurement.')
+    args = parser.parse_args()
+
+    for name in args.benchmark:
+        if name not in benchmarks:
+            parser.error("unknown benchmark \"{}\" (choose from {})".format(name, ", ".join(benchmarks)))
+
+    for name in args.benchmark or benchmarks:
+        benchmarks[name](args.iterations)
@@ -1,27 +1,95 @@
-import multiprocessing
+import threading
 import time
-import sys
+import socket as pysocket
+import struct
 from platform import system as system_type
 from scapy.all import *
-from scapy.layers.l2 import Ether, getmacbyip, sendp
+from scapy.layers.l2 import Ether
+import queue
 
 from SUTAdapter import *
 from FramingAPIDef import *
+from FrameDecoder import FrameDecoder
+import MacResolver
+import EthernetDemultiplexer
 
 if system_type() == "Linux":
     from pylibpcap.base import Sniff
+    from PacketRing import PacketRing
+
+ETHER_TYPE = 0x6003
+
+# software TX timestamps reported on the error queue of the socket, with a key per packet and
+# without a copy of the packet
+SO_TIMESTAMPING = 37
+SOF_TIMESTAMPING_TX_SOFTWARE = 1 << 1
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_OPT_ID = 1 << 7
+SOF_TIMESTAMPING_OPT_TSONLY = 1 << 11
+SOL_PACKET = 263
+PACKET_TX_TIMESTAMP = 16
+
+# struct timespec and struct sock_extended_err, ee_data holds the key of the packet
+_TIMESPEC = struct.Struct("qq")
+_EXTENDED_ERR = struct.Struct("IBBBBII")
+
+# number of TX timestamps kept for requests
+TX_TIMESTAMPS = 256
+
+# a frame of the module fits into one packet behind the record header
+MAX_PAYLOAD_LEN = 1500 - 4 - 8
 
 class EthernetAdapter(SUTAdapter):
-    def __init__(self):
+    def __init__(self, mode="process"):
+        """
+        Besides the adapter modes of the SUTAdapter the mode "shared" attaches the adapter to
+        the EthernetDemultiplexer of the interface, which receives for all modules on it.
+        """
         self.recv_process = None
-        self.queue_rx = multiprocessing.Manager().Queue()
-        self.queue_tx = multiprocessing.Manager().Queue()
+        self.shared = mode == "shared"
+        self.demultiplexer = None
+        # the demultiplexer decodes the frames in its thread into our queue, frames are sent
+        # directly, so there is no TX queue
+        self.initialize_queues("thread" if self.shared else mode, transmit=False)
 
         self.sut_ip = ""
         self.sut_interface = ""
         self.dut_mac = None
         self.packet = None
+
+        # a MAC resolved from sut_ip is removed from the cache when frames were sent but none
+        # arrived for mac_timeout seconds, it is then resolved again in the background. Sending
+        # and receiving may run in different threads, both update unanswered_since under the lock
+        self.mac_cache_path = MacResolver.DEFAULT_CACHE_PATH
+        self.mac_timeout = 10
+        self.mac_resolved = False
+        self.mac_future = None
+        self.mac_lock = threading.Lock()
+        self.unanswered_since = None
         self.socket = None
+
+        # on Linux the packets are sent on a raw AF_PACKET socket with a precomputed header and
+        # received through a packet ring with a kernel filter
+        self.use_raw_socket = True
+        self.raw_socket = None
+        self.eth_header = None
+        self.frame_decoder = FrameDecoder(MAX_PAYLOAD_LEN)
+
+        # with timestamping the frames carry the kernel receive time and the kernel send time
+        # of every request is kept, both need the raw socket
+        self.timestamping = False
+        self.tx_key = 0
+        self.tx_keys = {}
+        self.tx_timestamps = {}
+
+        # TX coalescing is disabled unless a flush deadline is given
+        self.tx_coalescing_us = None
+        self.mtu = 1500
+        self.tx_buffer = bytearray()
+        self.tx_deadline = None
+        self.tx_condition = None
+        self.tx_thread = None
+        self.transmitting = False
         conf.use_pcap=True
 
 
@@ -32,114 +100,372 @@ class EthernetAdapter(SUTAdapter):
         if len(data) > 1450:
             print("Alert: Sending large frame")
 
-        if system_type() == "Linux":
-            self.socket.send(self.packet/(b"\x00\x04" + len(data).to_bytes(2, "big") + data))
+        if self.mac_resolved and self.unanswered_since is None:
+            with self.mac_lock:
+                if self.unanswered_since is None:
+                    self.unanswered_since = time.time()
+
+        header = b"\x00\x04" + len(data).to_bytes(2, "big")
+        if not self.transmitting:
+            if self.raw_socket is not None:
+                if self.timestamping:
+                    self.tx_keys[data[3]] = self.tx_key
+                    self.tx_key += 1
+                # scatter/gather, the frame is not copied into a packet buffer
+                self.raw_socket.sendmsg([self.eth_header, header, data])
+            else:
+                self.send_packet(header + data)
+            return
+
+        # coalesce frames into one packet until the MTU is reached or the deadline has passed
+        with self.tx_condition:
+            if self.tx_buffer and len(self.tx_buffer) + len(header) + len(data) > self.mtu:
+                self._flush()
+            if not self.tx_buffer:
+                self.tx_deadline = time.perf_counter() + self.tx_coalescing_us / 1e6
+                self.tx_condition.notify()
+            # the frame is sent with the next packet
+            if self.timestamping:
+                self.tx_keys[data[3]] = self.tx_key
+            self.tx_buffer += header
+            self.tx_buffer += data
+
+    """
+    send one packet of our custom ethernet type
+    """
+    def send_packet(self, load):
+        if self.raw_socket is not None:
+            self.raw_socket.sendmsg([self.eth_header, load])
+            self.tx_key += 1
+        elif system_type() == "Linux":
+            self.socket.send(self.packet/load)
         else:
             global socket
-            socket.send(self.packet/(b"\x00\x04" + len(data).to_bytes(2, "big") + data))
+            socket.send(self.packet/load)
+
+    """
+    send the coalesced frames immediately
+    """
+    def flush(self):
+        if self.tx_buffer:
+            with self.tx_condition:
+                self._flush()
+
+    def _flush(self):
+        if self.tx_buffer:
+            self.send_packet(bytes(self.tx_buffer))
+            self.tx_buffer.clear()
+            self.tx_deadline = None
 
+    """
+    thread flushing the coalesced frames when the deadline has passed
+    """
+    def process_transmit(self):
+        with self.tx_condition:
+            while self.transmitting:
+                if self.tx_deadline is None:
+                    self.tx_condition.wait()
+                    continue
+                timeout = self.tx_deadline - time.perf_counter()
+                if timeout > 0:
+                    self.tx_condition.wait(timeout)
+                else:
+                    self._flush()
+            self._flush()
+
+    """
+    start coalescing of outgoing frames if a flush deadline is configured
+    """
+    def start_transmit(self):
+        if not self.tx_coalescing_us:
+            return
+        self.tx_condition = threading.Condition()
+        self.transmitting = True
+        self.tx_thread = threading.Thread(target=self.process_transmit, daemon=True)
+        self.tx_thread.start()
+
+    def stop_transmit(self):
+        if self.transmitting:
+            with self.tx_condition:
+                self.transmitting = False
+                self.tx_condition.notify()
+            self.tx_thread.join()
+            self.tx_thread = None
 
     """
     receive data
     """
     def receive(self):
-        if not self.queue_rx.empty():
-            frame = self.queue_rx.get_nowait()
+        self.flush()
+        try:
+            return self.received(self.queue_rx.get_nowait())
+        except queue.Empty:
+            return self.received(None)
+
+    def received(self, frame):
+        """
+        Keeps track of frames that were sent without receiving anything since. Invalidates a
+        resolved MAC address when nothing arrived for mac_timeout seconds after sending, the
+        module may have been replaced. An idle module is not invalidated. The IP address is then
+        resolved again in the background and a changed MAC address is taken over.
+        """
+        if not self.mac_resolved:
             return frame
-        else:
-            return None
+        if self.mac_future is not None:
+            if self.mac_future.done():
+                self.update_mac()
+        elif frame is not None:
+            if self.unanswered_since is not None:
+                with self.mac_lock:
+                    self.unanswered_since = None
+        elif self._unanswered_for(self.mac_timeout):
+            print("No frame received from {} for {}s, removing it from the MAC cache".format(self.dut_mac, self.mac_timeout))
+            resolver = MacResolver.get_resolver(self.mac_cache_path)
+            resolver.invalidate(self.sut_ip, self.sut_interface)
+            self.mac_future = resolver.resolve_async(self.sut_ip, self.sut_interface, self.mac_timeout)
+        return frame
+
+    def _unanswered_for(self, timeout):
+        with self.mac_lock:
+            return self.unanswered_since is not None and time.time() - self.unanswered_since > timeout
+
+    def update_mac(self):
+        """
+        Takes over the result of the background resolution. If it failed the MAC address is
+        kept and invalidated again after the next mac_timeout without an answer.
+        """
+        future = self.mac_future
+        self.mac_future = None
+        with self.mac_lock:
+            self.unanswered_since = None
+        try:
+            mac = future.result()
+        except AssertionError as e:
+            print("{}, keeping {}".format(e, self.dut_mac))
+            return
+        if mac != self.dut_mac:
+            print("MAC address of {} changed from {} to {}".format(self.sut_ip, self.dut_mac, mac))
+            self.change_mac(mac)
+
+    def change_mac(self, mac):
+        """
+        Sends to and receives from a new MAC address of the module. The packet header is
+        rebuilt and, since the receive loop filters on the MAC address, the adapter is attached
+        to the demultiplexer for the new address or the receive loop is restarted.
+        """
+        previous = self.dut_mac
+        self.dut_mac = mac
+        if self.eth_header is not None:
+            self.eth_header = bytes.fromhex(mac.replace(":", "")) + self.eth_header[6:]
+        if self.packet is not None:
+            self.packet.dst = mac
+        if self.demultiplexer is not None:
+            # attached first, the demultiplexer stops with its last adapter
+            self.demultiplexer.attach(mac, self)
+            self.demultiplexer.detach(previous)
+        elif self.recv_process is not None:
+            self.stop_worker(self.recv_process)
+            self.recv_process = self.start_worker(self.process_receive)
+            self.wait_until_ready()
 
     """
     packet callback for our custom ethernet type
     """
-    def pkt_callback(self, packet):
+    def pkt_callback(self, packet, timestamp=None):
         if system_type() == "Linux":
-            payload = Ether(packet)[Ether].load[4:]
+            load = Ether(packet)[Ether].load
         else:
-            payload = packet[Ether].load[4:]
-
-        seqno = 0
+            load = packet[Ether].load
+        self.load_callback(load, timestamp)
 
-        # check for input on uart
-        marker = payload[0]
-
-        # if nothing there, return to receive control
-        if not marker or marker != START_OF_FRAME:
-            return None
-
-        pheader = payload[1:6]
-        pbytes = int.from_bytes(pheader[3:5], 'big')
-
-        pbytedata = 2
-        if pbytes > 0:
-            pbytedata = payload[6:6+pbytes]
-
-        if not pbytedata:
-            print("Had to cancel data reception mid frame")
-            return None
-
-        pdata = (pheader + pbytedata) if pbytes > 0 else pheader
-        pbytes += 5
-
-        crc = int.from_bytes(payload[pbytes+1:pbytes+2], "big")
-        marker = int.from_bytes(payload[pbytes+2:pbytes+3], "big")
-
-        if marker == END_OF_FRAME:
-            frame = self.pack_and_parse_frame(
-                b"\xc0" + pdata + crc.to_bytes(1, "big") + b"\xc1")
-
-            self.queue_rx.put_nowait(frame)
-        else:
-            print("Could not catch end of frame")
-            print(str(payload))
+    """
+    callback for the payload of a packet of our custom ethernet type
+    """
+    def load_callback(self, load, timestamp=None):
+        # the packet holds one or more records of type 0x0004 followed by the data length
+        pos = 0
+        while len(load) - pos >= 4 and load[pos:pos + 2] == b"\x00\x04":
+            length = int.from_bytes(load[pos + 2:pos + 4], "big")
+            if length == 0 or pos + 4 + length > len(load):
+                self.decode_frames(load[pos + 4:], timestamp)
+                break
+            self.decode_frames(load[pos + 4:pos + 4 + length], timestamp)
+            pos += 4 + length
 
     """
     filter packets with custom ethernet type
     """
     def process_receive(self):
+        if system_type() == "Linux" and self.use_raw_socket:
+            try:
+                ring = PacketRing(self.sut_interface, ETHER_TYPE, self.dut_mac, timestamps=self.timestamping)
+            except OSError as e:
+                print("Raw socket not available, receiving with pcap: {}".format(e))
+            else:
+                self.set_ready()
+                if self.timestamping:
+                    callback = lambda load: self.load_callback(load, ring.timestamp)
+                else:
+                    callback = self.load_callback
+                while self.running:
+                    ring.receive(callback, 0.1)
+                ring.close()
+                return
+
         if system_type() == "Linux":
             sniffobj = Sniff(self.sut_interface, filters="ether proto 0x6003 and ether src " + self.dut_mac, promisc=1)
+            # the capture handle is open once Sniff was created
+            self.set_ready()
             for plen, t, buf in sniffobj.capture():
-                self.pkt_callback(buf)
+                if not self.running:
+                    break
+                # the capture time of pcap is taken by the kernel
+                self.pkt_callback(buf, int(t * 1e9) if self.timestamping else None)
         else:
             sniff(filter='ether proto 0x6003 and ether src ' + self.dut_mac, iface=self.sut_interface,
-                prn=self.pkt_callback)
+                prn=lambda packet: self.pkt_callback(packet, int(packet.time * 1e9) if self.timestamping else None),
+                stop_filter=lambda packet: not self.running,
+                started_callback=self.set_ready)
 
     """
-    start process waiting for mac frames of specific ethernet type
+    open the socket for sending packets of our custom ethernet type
     """
-    def start(self):
-
-        self.recv_process = multiprocessing.Process(target=self.process_receive)
-
-        end_time = time.time() + 10
-
-        while self.dut_mac == None and time.time() < end_time:
-            self.dut_mac = getmacbyip(self.sut_ip)
-
-        if self.dut_mac == None:
-            raise AssertionError("[]!] Could not determine target MAC address from IP")
-
+    def open_socket(self):
         if system_type() == "Linux":
-            self.socket = conf.L2socket(iface=self.sut_interface)
-            self.packet = Ether(src=get_if_hwaddr(self.sut_interface), dst=self.dut_mac, type=0x6003)
+            src = get_if_hwaddr(self.sut_interface)
+            if self.use_raw_socket:
+                try:
+                    if self.demultiplexer is not None:
+                        # all modules on the interface send on the socket of the demultiplexer
+                        self.raw_socket = self.demultiplexer.open_send_socket()
+                    else:
+                        # protocol 0, the socket is only used for sending and receives nothing
+                        self.raw_socket = pysocket.socket(pysocket.AF_PACKET, pysocket.SOCK_RAW, 0)
+                        self.raw_socket.bind((self.sut_interface, 0))
+                        if self.timestamping:
+                            self.raw_socket.setsockopt(pysocket.SOL_SOCKET, SO_TIMESTAMPING,
+                                SOF_TIMESTAMPING_TX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE
+                                | SOF_TIMESTAMPING_OPT_ID | SOF_TIMESTAMPING_OPT_TSONLY)
+                            self.tx_key = 0
+                            self.tx_keys.clear()
+                            self.tx_timestamps.clear()
+                    self.eth_header = bytes.fromhex(self.dut_mac.replace(":", "")) \
+                        + bytes.fromhex(src.replace(":", "")) + ETHER_TYPE.to_bytes(2, "big")
+                except OSError as e:
+                    print("Raw socket not available, sending with scapy: {}".format(e))
+                    self.close_socket()
+            if self.raw_socket is None:
+                self.socket = conf.L2socket(iface=self.sut_interface)
+                self.packet = Ether(src=src, dst=self.dut_mac, type=ETHER_TYPE)
         else:
             global socket
             socket = conf.L2socket(iface=self.sut_interface)
-            self.packet = Ether(dst=self.dut_mac, type=0x6003)
-
-        self.recv_process.start()
+            self.packet = Ether(dst=self.dut_mac, type=ETHER_TYPE)
 
+    def get_tx_timestamp(self, req_id):
         """
-        sleep - letting sniffing process initialize
+        Returns the time in ns the kernel sent the last frame with the given request ID. Only
+        available with timestamping on the own raw socket, the socket of the demultiplexer is
+        shared and its packets cannot be told apart.
         """
-        time.sleep(3)
+        if not self.timestamping or self.raw_socket is None or self.demultiplexer is not None:
+            return None
+        key = self.tx_keys.get(req_id)
+        if key is None:
+            return None
+        if key not in self.tx_timestamps:
+            self._read_tx_timestamps()
+        return self.tx_timestamps.get(key)
+
+    def _read_tx_timestamps(self):
+        # the kernel queues one message per packet on the error queue of the socket
+        while True:
+            try:
+                data, ancdata, flags, address = self.raw_socket.recvmsg(0, 256, pysocket.MSG_ERRQUEUE | pysocket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            timestamp = key = None
+            for level, type, cmsg in ancdata:
+                if level == pysocket.SOL_SOCKET and type == SO_TIMESTAMPING:
+                    sec, nsec = _TIMESPEC.unpack_from(cmsg)
+                    timestamp = sec * 1000000000 + nsec
+                elif level == SOL_PACKET and type == PACKET_TX_TIMESTAMP:
+                    key = _EXTENDED_ERR.unpack_from(cmsg)[6]
+            if timestamp is not None and key is not None:
+                self.tx_timestamps[key] = timestamp
+        # keep the timestamps of the latest packets only
+        while len(self.tx_timestamps) > TX_TIMESTAMPS:
+            del self.tx_timestamps[next(iter(self.tx_timestamps))]
+
+    def close_socket(self):
+        if self.raw_socket is not None:
+            # the socket of the demultiplexer is closed with its last adapter
+            if self.demultiplexer is None:
+                self.raw_socket.close()
+            self.raw_socket = None
+
+    """
+    start process waiting for mac frames of specific ethernet type
+    """
+    def start(self):
+
+        if self.dut_mac == None:
+            resolver = MacResolver.get_resolver(self.mac_cache_path)
+            self.dut_mac = resolver.resolve(self.sut_ip, self.sut_interface)
+            self.mac_resolved = True
+            with self.mac_lock:
+                self.unanswered_since = None
+
+        if self.shared:
+            self.running = True
+            demultiplexer = EthernetDemultiplexer.get_demultiplexer(self.sut_interface)
+            demultiplexer.attach(self.dut_mac, self)
+            self.demultiplexer = demultiplexer
+            self.open_socket()
+            self.start_transmit()
+            return
+
+        self.open_socket()
+
+        self.recv_process = self.start_worker(self.process_receive)
+
+        # the coalescing thread is started after the receive process, a spawned process cannot take over its condition
+        self.start_transmit()
+
+        # wait until the receive loop captures, responses sent before would be lost
+        try:
+            self.wait_until_ready()
+        except AssertionError:
+            self.stop()
+            raise
 
     """
     stop listening for specific ethernet type
     """
     def stop(self):
-        self.recv_process.terminate()
+        self.stop_transmit()
+        if self.demultiplexer is not None:
+            self.running = False
+            self.close_socket()
+            self.demultiplexer.detach(self.dut_mac)
+            self.demultiplexer = None
+            return
+        self.stop_worker(self.recv_process)
+        self.close_socket()
+
+    """
+    block until a frame was received or the deadline has passed
+    """
+    def wait_for_frame(self, deadline):
+        # the caller waits for a response, so there is nothing left to coalesce
+        self.flush()
+        timeout = deadline - time.time()
+        try:
+            if timeout <= 0:
+                return self.received(self.queue_rx.get_nowait())
+            return self.received(self.queue_rx.get(timeout=timeout))
+        except queue.Empty:
+            return self.received(None)
 
     """
     returns true if data is available
@@ -0,0 +1,166 @@
+import threading
+import socket as pysocket
+from platform import system as system_type
+from scapy.all import *
+from scapy.layers.l2 import Ether
+
+if system_type() == "Linux":
+    from pylibpcap.base import Sniff
+    from PacketRing import PacketRing
+
+ETHER_TYPE = 0x6003
+
+# seconds to wait for the receive loop to open its device
+READY_TIMEOUT = 10
+
+class EthernetDemultiplexer():
+    """
+    Receives the packets of all modules on one interface. One receive loop captures every
+    packet of our custom Ethernet type and hands its payload to the adapter attached for the
+    source MAC address, which decodes the frames into its own RX queue. Packets of modules
+    that are not attached are dropped. The adapters also share one socket for sending. The
+    frames always carry the kernel receive timestamp.
+
+    The receive loop runs in a thread, so the number of processes and capture handles does
+    not grow with the number of modules on the interface.
+    """
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.lock = threading.Lock()
+        # replaced on every change, the receive loop reads it without locking
+        self.devices = {}
+        self.send_socket = None
+        self.thread = None
+        self.running = False
+        self.ready = threading.Event()
+        self.received = 0
+        self.dropped = 0
+
+    def attach(self, mac, adapter):
+        """
+        Attaches an adapter to the packets from the given MAC address. The receive loop is
+        started with the first adapter.
+        """
+        key = bytes.fromhex(mac.replace(":", ""))
+        with self.lock:
+            if key in self.devices:
+                raise AssertionError("A module with MAC {} is already attached to \"{}\"".format(mac, self.interface))
+            devices = dict(self.devices)
+            devices[key] = adapter
+            self.devices = devices
+            if not self.running:
+                try:
+                    self.start()
+                except AssertionError:
+                    self.devices = {}
+                    raise
+
+    def detach(self, mac):
+        """
+        Detaches the adapter of the given MAC address. The receive loop is stopped with the
+        last adapter.
+        """
+        key = bytes.fromhex(mac.replace(":", ""))
+        with self.lock:
+            devices = dict(self.devices)
+            devices.pop(key, None)
+            self.devices = devices
+            if not devices and self.running:
+                self.stop()
+
+    def open_send_socket(self):
+        """
+        Returns the raw socket for sending on the interface, it is opened on first use. Raises
+        an OSError if raw sockets are not available.
+        """
+        with self.lock:
+            if self.send_socket is None:
+                # protocol 0, the socket is only used for sending and receives nothing
+                sock = pysocket.socket(pysocket.AF_PACKET, pysocket.SOCK_RAW, 0)
+                try:
+                    sock.bind((self.interface, 0))
+                except OSError:
+                    sock.close()
+                    raise
+                self.send_socket = sock
+            return self.send_socket
+
+    def start(self):
+        self.running = True
+        self.ready.clear()
+        self.thread = threading.Thread(target=self.process_receive, daemon=True)
+        self.thread.start()
+        if not self.ready.wait(READY_TIMEOUT):
+            self.stop()
+            raise AssertionError("Receive loop on \"{}\" was not ready within {}s".format(self.interface, READY_TIMEOUT))
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+        if self.send_socket is not None:
+            self.send_socket.close()
+            self.send_socket = None
+
+    """
+    callback for a packet of our custom ethernet type including the Ethernet header
+    """
+    def packet_callback(self, packet, timestamp=None):
+        adapter = self.devices.get(bytes(packet[6:12]))
+        if adapter is None:
+            self.dropped += 1
+            return
+        self.received += 1
+        adapter.load_callback(packet[14:], timestamp)
+
+    """
+    filter packets with custom ethernet type
+    """
+    def process_receive(self):
+        if system_type() == "Linux":
+            try:
+                ring = PacketRing(self.interface, ETHER_TYPE, None, timestamps=True)
+            except OSError as e:
+                print("Raw socket not available, receiving with pcap: {}".format(e))
+            else:
+                self.ready.set()
+                callback = lambda packet: self.packet_callback(packet, ring.timestamp)
+                while self.running:
+                    ring.receive(callback, 0.1, header=True)
+                ring.close()
+                return
+
+            sniffobj = Sniff(self.interface, filters="ether proto 0x6003", promisc=1)
+            self.ready.set()
+            for plen, t, buf in sniffobj.capture():
+                if not self.running:
+                    break
+                self.packet_callback(buf, int(t * 1e9))
+        else:
+            sniff(filter='ether proto 0x6003', iface=self.interface,
+                prn=lambda packet: self.packet_callback(bytes(packet[Ether]), int(packet.time * 1e9)),
+                stop_filter=lambda packet: not self.running,
+                started_callback=self.ready.set)
+
+    def get_statistics(self):
+        """
+        Returns the number of attached modules and the packets that were handed to them or
+        dropped because no module was attached for their source.
+        """
+        return {"devices": len(self.devices), "received": self.received, "dropped": self.dropped}
+
+# demultiplexers by interface name
+_demultiplexers = {}
+_demultiplexers_lock = threading.Lock()
+
+def get_demultiplexer(interface):
+    """
+    Returns the demultiplexer of the interface, it is created on first use.
+    """
+    with _demultiplexers_lock:
+        demultiplexer = _demultiplexers.get(interface)
+        if demultiplexer is None:
+            demultiplexer = _demultiplexers[interface] = EthernetDemultiplexer(interface)
+        return demultiplexer
@@ -108,7 +108,6 @@ class Evse():
             "certificate_installation_support": False,
             "certificate_update_support": False,
         }
-        self.whitebeet.v2gEvseSetConfiguration(self.evse_config)
 
         self.dc_charging_parameters = {
             'isolation_level': 0,
@@ -120,14 +119,20 @@ class Evse():
             'peak_current_ripple': int(self.charger.getEvseDeltaCurrent()),
             'status': 0
         }
-        self.whitebeet.v2gEvseSetDcChargingParameters(self.dc_charging_parameters)
 
         self.ac_charging_parameters = {
             'rcd_status': 0,
             'nominal_voltage': self.charger.getEvseMaxVoltage(),
             'max_current': self.charger.getEvseMaxCurrent(),
         }
-        self.whitebeet.v2gEvseSetAcChargingParameters(self.ac_charging_parameters)
+
+        # The configuration and the charging parameters are independent of each other, therefore
+        # the commands are sent without waiting for the previous response.
+        print("Set V2G configuration and charging parameters")
+        with self.whitebeet.pipeline():
+            self.whitebeet.v2gEvseSetConfiguration(self.evse_config)
+            self.whitebeet.v2gEvseSetDcChargingParameters(self.dc_charging_parameters)
+            self.whitebeet.v2gEvseSetAcChargingParameters(self.ac_charging_parameters)
 
         time.sleep(0.1)
         print("Start V2G")
@@ -0,0 +1,349 @@
+from collections import deque
+
+# Eviction policies of bounded frame buffers
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+# Frame classes and their default bounds, unbounded like before the bounds were introduced
+FRAME_CLASSES = ("responses", "notifications", "data")
+DEFAULT_LIMITS = {"responses": None, "notifications": None, "data": None}
+
+def frame_class(sub_id):
+    """
+    Returns the class of a frame with the given sub ID.
+    """
+    if sub_id > 127:
+        return "notifications"
+    elif sub_id == 1:
+        return "data"
+    return "responses"
+
+def _check_limit(limit, policy):
+    if limit is not None and limit < 1:
+        raise AssertionError("Invalid buffer limit {}".format(limit))
+    if policy not in (DROP_OLDEST, DROP_NEWEST):
+        raise AssertionError("Invalid eviction policy \"{}\"".format(policy))
+
+class FrameBuffer():
+    """
+    FIFO of frames with an optional bound. When the buffer is full either the oldest frame is
+    dropped to make room (DROP_OLDEST) or the new frame is not stored (DROP_NEWEST).
+    """
+
+    def __init__(self, limit=None, policy=DROP_OLDEST):
+        _check_limit(limit, policy)
+        self.frames = deque()
+        self.limit = limit
+        self.policy = policy
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def set_limit(self, limit, policy=DROP_OLDEST):
+        _check_limit(limit, policy)
+        self.limit = limit
+        self.policy = policy
+        while limit is not None and len(self.frames) > limit:
+            self.frames.popleft()
+            self.dropped += 1
+
+    def append(self, frame):
+        """
+        Appends a frame. Returns False if the frame was dropped.
+        """
+        if self.limit is not None and len(self.frames) >= self.limit:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            self.frames.popleft()
+        self.frames.append(frame)
+        if len(self.frames) > self.high_water:
+            self.high_water = len(self.frames)
+        return True
+
+    def popleft(self):
+        return self.frames.popleft()
+
+    def clear(self):
+        self.frames.clear()
+
+    def get_statistics(self):
+        """
+        Returns the number of frames, the bound, the dropped frames and the high-water mark.
+        """
+        return {"count": len(self.frames), "limit": self.limit, "dropped": self.dropped,
+                "high_water": self.high_water}
+
+class FrameFilter():
+    """
+    Filter for received frames. The filter arguments of FramingInterface.receive_next_frame are
+    normalized once when the filter is created. Since all filter criteria only depend on the
+    module ID, sub ID and request ID of a frame the result is cached per key.
+    """
+
+    def __init__(self, filter_mod=None, filter_sub=None, filter_req_id=None,
+                 break_on_data=False, break_on_notification=False):
+        self.mods = self._to_set(filter_mod)
+        self.req_ids = self._to_set(filter_req_id)
+
+        self.subs = None
+        self.subs_by_mod = None
+        if isinstance(filter_sub, dict):
+            self.subs_by_mod = {mod_id: self._to_set(subs) for mod_id, subs in filter_sub.items()}
+        else:
+            self.subs = self._to_set(filter_sub)
+
+        # for backwards compatibility notifications are only accepted when filtered for
+        self.accept_notifications = break_on_notification or bool(filter_sub) or bool(filter_mod) \
+            or bool(filter_req_id)
+        self.break_on_data = break_on_data
+        # received data frames are only collected if the data itself was asked for
+        self.collects_data = break_on_data or (self.subs is not None and 1 in self.subs)
+
+        self._cache = {}
+
+    @staticmethod
+    def _to_set(value):
+        if value is None:
+            return None
+        elif isinstance(value, int):
+            return frozenset((value,))
+        else:
+            return frozenset(value)
+
+    def _subs_for_module(self, mod_id):
+        if self.subs_by_mod is not None:
+            return self.subs_by_mod.get(mod_id)
+        return self.subs
+
+    def _match(self, mod_id, sub_id, req_id):
+        if self.req_ids is not None and req_id not in self.req_ids:
+            return False
+        if self.mods is not None and mod_id not in self.mods:
+            return False
+
+        subs = self._subs_for_module(mod_id)
+        if subs is not None and sub_id not in subs:
+            return False
+
+        if sub_id > 127:
+            return self.accept_notifications
+        elif sub_id == 1:
+            return self.break_on_data or (subs is not None and 1 in subs)
+        return True
+
+    def accepts_key(self, key):
+        """
+        Returns True if frames with the given (mod_id, sub_id, req_id) key pass the filter.
+        """
+        accepted = self._cache.get(key)
+        if accepted is None:
+            accepted = self._cache[key] = self._match(*key)
+        return accepted
+
+    def accepts(self, frame):
+        """
+        Returns True if the frame passes the filter.
+        """
+        return self.accepts_key((frame.mod_id, frame.sub_id, frame.req_id))
+
+    def request_keys(self):
+        """
+        Returns all (mod_id, req_id) pairs the filter can accept or None if the module or the
+        request ID is a wildcard.
+        """
+        if self.mods is None or self.req_ids is None:
+            return None
+        return [(mod_id, req_id) for mod_id in self.mods for req_id in self.req_ids]
+
+    def keys(self):
+        """
+        Returns all keys the filter can accept or None if the filter contains a wildcard.
+        """
+        if self.mods is None or self.req_ids is None:
+            return None
+        keys = []
+        for mod_id in self.mods:
+            subs = self._subs_for_module(mod_id)
+            if subs is None:
+                return None
+            for sub_id in subs:
+                for req_id in self.req_ids:
+                    keys.append((mod_id, sub_id, req_id))
+        return keys
+
+class FrameBacklog():
+    """
+    Backlog of received frames that were not yet consumed. The frames are indexed by
+    (mod_id, sub_id, req_id). Every entry holds the frames with the same key in the order they
+    were received. A sequence number is used to find the oldest frame across several keys.
+    Searching the backlog therefore only depends on the number of different keys and not on
+    the number of frames. A second index holds the keys per (mod_id, req_id), so filters that
+    accept any sub ID of a module, like the 0xFF module of framing errors, do not have to look
+    at every key either.
+
+    The number of frames can be bounded per frame class (responses, notifications, data), so
+    frames nobody asks for cannot accumulate forever. The keys of the frames are also kept in
+    arrival order per frame class to find the oldest frame of a class for eviction without
+    searching the index. Entries of frames that were popped out of order are skipped when they
+    reach the front and are compacted away when they outnumber the frames.
+    """
+
+    def __init__(self, limits=DEFAULT_LIMITS, policy=DROP_OLDEST):
+        self._index = {}
+        self._request_index = {}
+        self._seq_nr = 0
+        self._len = 0
+        self._arrivals = {name: deque() for name in FRAME_CLASSES}
+        self.limits = {}
+        self.policies = {}
+        self.counts = {}
+        self.dropped = {}
+        self.high_water = {}
+        for name in FRAME_CLASSES:
+            self.set_limit(name, limits.get(name), policy)
+            self.counts[name] = 0
+            self.dropped[name] = 0
+            self.high_water[name] = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        entries = [entry for frames in self._index.values() for entry in frames]
+        entries.sort(key=lambda entry: entry[0])
+        return (frame for _, frame in entries)
+
+    def set_limit(self, name, limit, policy=DROP_OLDEST):
+        """
+        Sets the maximum number of frames of a frame class and the policy when it is reached.
+        A limit of None removes the bound.
+        """
+        if name not in FRAME_CLASSES:
+            raise AssertionError("Invalid frame class \"{}\"".format(name))
+        _check_limit(limit, policy)
+        self.limits[name] = limit
+        self.policies[name] = policy
+        while limit is not None and self.counts.get(name, 0) > limit:
+            self._drop_oldest(name)
+
+    def append(self, frame):
+        """
+        Appends a frame to the backlog. Returns False if the frame was dropped.
+        """
+        name = frame_class(frame.sub_id)
+        limit = self.limits[name]
+        if limit is not None and self.counts[name] >= limit:
+            if self.policies[name] == DROP_NEWEST:
+                self.dropped[name] += 1
+                return False
+            self._drop_oldest(name)
+
+        key = (frame.mod_id, frame.sub_id, frame.req_id)
+        frames = self._index.get(key)
+        if frames is None:
+            frames = self._index[key] = deque()
+            request_key = (frame.mod_id, frame.req_id)
+            keys = self._request_index.get(request_key)
+            if keys is None:
+                keys = self._request_index[request_key] = set()
+            keys.add(key)
+        frames.append((self._seq_nr, frame))
+        arrivals = self._arrivals[name]
+        arrivals.append((self._seq_nr, key))
+        self._seq_nr += 1
+        self._len += 1
+        self.counts[name] += 1
+        if self.counts[name] > self.high_water[name]:
+            self.high_water[name] = self.counts[name]
+        if len(arrivals) > 2 * self.counts[name] + 64:
+            self._compact_arrivals(name)
+        return True
+
+    def _is_buffered(self, seq_nr, key):
+        # frames of a key are only removed from the front of its entry
+        frames = self._index.get(key)
+        return frames is not None and frames[0][0] <= seq_nr
+
+    def _compact_arrivals(self, name):
+        self._arrivals[name] = deque(arrival for arrival in self._arrivals[name] if self._is_buffered(*arrival))
+
+    def _drop_oldest(self, name):
+        arrivals = self._arrivals[name]
+        while arrivals:
+            seq_nr, key = arrivals.popleft()
+            if self._is_buffered(seq_nr, key):
+                self._remove(key)
+                self.dropped[name] += 1
+                return
+
+    def _remove(self, key):
+        frames = self._index[key]
+        _, frame = frames.popleft()
+        if not frames:
+            del self._index[key]
+            request_key = (key[0], key[2])
+            keys = self._request_index[request_key]
+            keys.discard(key)
+            if not keys:
+                del self._request_index[request_key]
+        self._len -= 1
+        self.counts[frame_class(key[1])] -= 1
+        return frame
+
+    def pop(self, frame_filter):
+        """
+        Removes and returns the oldest frame that passes the filter. Returns None if there is no
+        such frame.
+        """
+        if self._len == 0:
+            return None
+
+        keys = frame_filter.keys()
+        if keys is None:
+            request_keys = frame_filter.request_keys()
+            if request_keys is not None and len(request_keys) <= len(self._request_index):
+                keys = [key for request_key in request_keys for key in self._request_index.get(request_key, ())]
+        if keys is None or len(keys) > len(self._index):
+            keys = self._index.keys()
+
+        best_key = None
+        best_seq_nr = None
+        for key in keys:
+            frames = self._index.get(key)
+            if frames is None or not frame_filter.accepts_key(key):
+                continue
+            seq_nr = frames[0][0]
+            if best_seq_nr is None or seq_nr < best_seq_nr:
+                best_key = key
+                best_seq_nr = seq_nr
+
+        if best_key is None:
+            return None
+
+        return self._remove(best_key)
+
+    def clear(self):
+        """
+        Removes all frames from the backlog.
+        """
+        self._index.clear()
+        self._request_index.clear()
+        self._len = 0
+        for name in FRAME_CLASSES:
+            self.counts[name] = 0
+            self._arrivals[name].clear()
+
+    def get_statistics(self):
+        """
+        Returns the number of frames, the bound, the dropped frames and the high-water mark per
+        frame class.
+        """
+        return {name: {"count": self.counts[name], "limit": self.limits[name],
+                       "dropped": self.dropped[name], "high_water": self.high_water[name]}
+                for name in FRAME_CLASSES}
@@ -0,0 +1,119 @@
+import multiprocessing
+
+from FramingAPIDef import *
+from FrameEncoder import frame_checksum
+
+class FrameDecoder():
+    """
+    Incremental decoder of the framing protocol. The decoder is fed with the received bytes of
+    a transport unit (Ethernet packet or SPI transfer) and returns every complete frame. A
+    frame that is split over several transport units is kept until the remaining bytes were
+    received. If a frame has a wrong checksum or end marker, the decoder searches for the next
+    start marker behind it instead of giving up the transport unit. While the rest of a frame
+    is awaited, a complete and valid frame starting behind its start marker shows that the
+    header was corrupt, the decoder then resynchronizes to that frame.
+
+    max_payload_len should be the largest payload the transport can carry, a header with a
+    larger length is rejected right away.
+
+    The error counters are kept in shared memory so they can be read from the process that
+    created the decoder while another process feeds it.
+    """
+
+    STATISTICS = ("frames", "checksum_errors", "framing_errors", "discarded_bytes", "resyncs")
+
+    def __init__(self, max_payload_len=0xFFFF):
+        self.max_payload_len = max_payload_len
+        self.buffer = bytearray()
+        self.counters = multiprocessing.RawArray("Q", len(self.STATISTICS))
+
+    def feed(self, data):
+        """
+        Appends the received bytes and returns a list of all frames that are complete now.
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        counters = self.counters
+        size = len(buffer)
+        pos = 0
+
+        while True:
+            start = buffer.find(START_OF_FRAME, pos)
+            if start < 0:
+                self._discard(pos, size)
+                pos = size
+                break
+            self._discard(pos, start)
+            pos = start
+
+            # wait for the rest of the header
+            if size - start < 6:
+                break
+
+            payload_len = (buffer[start + 4] << 8) | buffer[start + 5]
+            if payload_len > self.max_payload_len:
+                counters[2] += 1
+                pos = start + 1
+                continue
+
+            # wait for the rest of the frame unless a valid frame follows a corrupt header
+            end = start + payload_len + 8
+            if end > size:
+                next_start = self._find_frame(start + 1, size)
+                if next_start < 0:
+                    break
+                counters[4] += 1
+                self._discard(start, next_start)
+                pos = next_start
+                continue
+
+            if buffer[end - 1] != END_OF_FRAME:
+                counters[2] += 1
+                pos = start + 1
+                continue
+
+            crc = buffer[end - 2]
+            if crc != 0 and frame_checksum(sum(buffer[start:end]) - crc) != crc:
+                counters[1] += 1
+                pos = start + 1
+                continue
+
+            frames.append(bytes(buffer[start:end]))
+            counters[0] += 1
+            pos = end
+
+        del buffer[:pos]
+        return frames
+
+    def _find_frame(self, pos, size):
+        # returns the start of the first complete frame with a valid end marker and checksum
+        buffer = self.buffer
+        while True:
+            start = buffer.find(START_OF_FRAME, pos, size)
+            if start < 0 or size - start < 8:
+                return -1
+            end = start + ((buffer[start + 4] << 8) | buffer[start + 5]) + 8
+            if end <= size and end - start - 8 <= self.max_payload_len and buffer[end - 1] == END_OF_FRAME:
+                crc = buffer[end - 2]
+                if crc == 0 or frame_checksum(sum(buffer[start:end]) - crc) == crc:
+                    return start
+            pos = start + 1
+
+    def _discard(self, start, end):
+        # idle bytes (0x00) between frames are padding of the transport unit
+        if end > start:
+            self.counters[3] += (end - start) - self.buffer.count(0, start, end)
+
+    def reset(self):
+        """
+        Drops a partially received frame, e.g. after the connection was restarted.
+        """
+        self.buffer.clear()
+
+    def get_statistics(self):
+        """
+        Returns the number of decoded frames, checksum errors, framing errors, discarded bytes
+        and resynchronizations after a corrupt header.
+        """
+        return dict(zip(self.STATISTICS, self.counters))
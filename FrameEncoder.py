@@ -0,0 +1,60 @@
+import struct
+
+from FramingAPIDef import *
+
+_HEADER = struct.Struct(">BBBBH")
+
+def frame_checksum(total):
+    """
+    Computes the checksum of a frame from the sum of all its bytes (with a checksum byte of 0).
+    """
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFF) + (total >> 8)
+    total = (total & 0xFF) + (total >> 8)
+    if total != 0xFF:
+        total = ~total & 0xFF
+    return total
+
+class FrameEncoder():
+    """
+    Encodes frames of the framing protocol. Header, payload, checksum and trailer are written
+    into a buffer that is reused for every frame, so only the final bytes object is allocated.
+    Frames without payload only depend on module ID, sub ID and request ID and are kept in a
+    cache once they were encoded.
+    """
+
+    def __init__(self, size=1500):
+        self.buffer = bytearray(size)
+        self.constant_frames = {}
+
+    def encode(self, mod_id, sub_id, req_id, payload):
+        """
+        Returns the encoded frame as bytes.
+        """
+        if not payload:
+            key = (mod_id, sub_id, req_id)
+            frame = self.constant_frames.get(key)
+            if frame is None:
+                frame = self.constant_frames[key] = self._encode(mod_id, sub_id, req_id, b"")
+            return frame
+        return self._encode(mod_id, sub_id, req_id, payload)
+
+    def _encode(self, mod_id, sub_id, req_id, payload):
+        length = len(payload)
+        if length > 0xFFFF:
+            raise AssertionError("Payload of {} bytes does not fit into a frame".format(length))
+
+        size = length + 8
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+        buffer = self.buffer
+
+        _HEADER.pack_into(buffer, 0, START_OF_FRAME, mod_id, sub_id, req_id, length)
+        buffer[6:6 + length] = payload
+        total = START_OF_FRAME + mod_id + sub_id + req_id + (length >> 8) + (length & 0xFF) \
+            + sum(payload) + END_OF_FRAME
+        buffer[6 + length] = frame_checksum(total)
+        buffer[7 + length] = END_OF_FRAME
+
+        with memoryview(buffer) as view:
+            return bytes(view[:size])
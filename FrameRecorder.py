@@ -0,0 +1,116 @@
+import struct
+import threading
+import time
+
+# Direction of a recorded frame
+RECORD_TX = 0
+RECORD_RX = 1
+# record without data written when a recording starts
+RECORD_SESSION = 2
+
+CAPTURE_MAGIC = b"FV2GCAP\x01"
+
+# timestamp in ns, direction, length of the frame
+_RECORD = struct.Struct("<QBI")
+
+class FrameRecorder():
+    """
+    Records the frames sent to and received from a module. Every frame is appended to the
+    capture file with a timestamp (time.time_ns()) and its direction. The file starts with
+    CAPTURE_MAGIC and is followed by the records, each consisting of a 13 byte header and the
+    raw frame. Frames may be recorded from several threads.
+
+    A recording appended to an existing capture file starts with a RECORD_SESSION record, so
+    the recordings in one file can be told apart. Every record is flushed to the file right
+    away and survives a crash of the application.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.file.write(_RECORD.pack(time.time_ns(), RECORD_SESSION, 0))
+        self.file.flush()
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def record(self, direction, data):
+        """
+        Appends a raw frame to the capture file.
+        """
+        timestamp = time.time_ns()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(_RECORD.pack(timestamp, direction, len(data)))
+            self.file.write(data)
+            self.file.flush()
+            self.frames += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def _read_records(path):
+    # yields the session number and the record of every frame, the session records are skipped
+    with open(path, "rb") as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise AssertionError("\"{}\" is not a capture file".format(path))
+        session = 0
+        first = True
+        while True:
+            header = file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, direction, length = _RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            if direction == RECORD_SESSION:
+                # frames recorded before session records existed form the first session
+                if not first:
+                    session += 1
+            else:
+                yield session, timestamp, direction, data
+            first = False
+
+def count_sessions(path):
+    """
+    Returns the number of recordings in a capture file.
+    """
+    sessions = 0
+    with open(path, "rb") as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise AssertionError("\"{}\" is not a capture file".format(path))
+        first = True
+        while True:
+            header = file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return sessions
+            timestamp, direction, length = _RECORD.unpack(header)
+            if first or direction == RECORD_SESSION:
+                sessions += 1
+            first = False
+            file.seek(length, 1)
+
+def read_capture(path, session=None):
+    """
+    Iterates over the records of a capture file. Yields the timestamp in ns, the direction and
+    the raw frame of every record. A record that was cut off at the end of the file is skipped.
+    With session only the records of that recording are yielded, counted from 0 or from the
+    end of the file if negative.
+    """
+    if session is not None and session < 0:
+        session += count_sessions(path)
+    for record_session, timestamp, direction, data in _read_records(path):
+        if session is None or record_session == session:
+            yield timestamp, direction, data
@@ -2,15 +2,105 @@ import random
 import string
 
 class Frame (object):
-    def __init__(self):
-        self.mod_id = 0
-        self.mod_name = ""
-        self.sub_id = 0
-        self.sub_name = 0
-        self.req_id = 0
-        self.payload_len = 0
-        self.payload = b""
-        crc = 0
+    """
+    A frame of the framing protocol. Module ID, sub ID, request ID, payload length and checksum
+    are read when the frame is created. The frame keeps a memoryview of the received buffer,
+    so the buffer must not be modified afterwards. The payload, the names of module and sub ID
+    and the hex dump are only computed when they are accessed.
+
+    The timestamp is the time in ns (time.time_ns() based) the kernel received the frame, or
+    None if the adapter does not provide kernel timestamps.
+    """
+
+    __slots__ = ("mod_id", "sub_id", "req_id", "payload_len", "crc", "timestamp",
+                 "_raw", "_payload", "_mod_name", "_sub_name", "_raw_hex")
+
+    FIELDS = ("mod_id", "mod_name", "sub_id", "sub_name", "req_id", "payload_len", "payload", "crc", "raw_hex")
+
+    def __init__(self, raw=None):
+        self._payload = None
+        self._mod_name = None
+        self._sub_name = None
+        self._raw_hex = None
+        self.timestamp = None
+        if raw is None:
+            self._raw = None
+            self.mod_id = 0
+            self.sub_id = 0
+            self.req_id = 0
+            self.payload_len = 0
+            self.crc = 0
+        else:
+            self._raw = raw if isinstance(raw, memoryview) else memoryview(raw)
+            self.mod_id = raw[1]
+            self.sub_id = raw[2]
+            self.req_id = raw[3]
+            self.payload_len = (raw[4] << 8) | raw[5]
+            self.crc = raw[-2]
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def payload_view(self):
+        """
+        The payload as memoryview of the received buffer.
+        """
+        if self._payload is not None:
+            return memoryview(self._payload)
+        elif self._raw is not None:
+            return self._raw[6:6 + self.payload_len]
+        return memoryview(b"")
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = self._raw[6:6 + self.payload_len].tobytes() if self._raw is not None else b""
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+
+    @property
+    def mod_name(self):
+        if self._mod_name is None:
+            self._mod_name = get_module_name_by_id(self.mod_id)
+        return self._mod_name
+
+    @mod_name.setter
+    def mod_name(self, value):
+        self._mod_name = value
+
+    @property
+    def sub_name(self):
+        if self._sub_name is None:
+            self._sub_name = get_sub_name_by_id(self.mod_id, self.sub_id)
+        return self._sub_name
+
+    @sub_name.setter
+    def sub_name(self, value):
+        self._sub_name = value
+
+    @property
+    def raw_hex(self):
+        if self._raw_hex is None:
+            self._raw_hex = self._raw.hex("_") if self._raw is not None else ""
+        return self._raw_hex
+
+    # pickle support, the memoryview is replaced by a copy of the frame
+    def __getstate__(self):
+        state = {key: getattr(self, key) for key in self.__slots__}
+        if self._raw is not None:
+            state["_raw"] = self._raw.tobytes()
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+        if self._raw is not None:
+            self._raw = memoryview(self._raw)
 
     # add dict access for backwards compatibility
     def __getitem__(self, key):
@@ -25,9 +115,153 @@ class Frame (object):
         elif key == "req_id":
             return self.req_id
 
-MODULE_IDS = {}
+# Protocol registry
+# module name: [module ID, {sub ID: [sub name, aliases...]}]
+MODULE_IDS = {
+    "sys": [0x10, {
+        0x41: ["get_firmware_version"],
+    }],
+    "netconf": [0x05, {
+        0x55: ["set_port_mirror_state"],
+    }],
+    "v2g": [0x27, {
+        0x40: ["set_mode"],
+        0x41: ["get_mode"],
+        0x42: ["start"],
+        0x43: ["stop"],
+
+        # EVSE sub IDs
+        0x60: ["evse_set_configuration"],
+        0x61: ["evse_get_configuration"],
+        0x62: ["evse_set_dc_charging_parameters"],
+        0x63: ["evse_update_dc_charging_parameters"],
+        0x64: ["evse_get_dc_charging_parameters"],
+        0x65: ["evse_set_ac_charging_parameters"],
+        0x66: ["evse_update_ac_charging_parameters"],
+        0x67: ["evse_get_ac_charging_parameters"],
+        0x68: ["evse_set_sdp_config"],
+        0x69: ["evse_get_sdp_config"],
+        0x6A: ["evse_start_listen"],
+        0x6B: ["evse_set_authorization_status"],
+        0x6C: ["evse_set_schedules"],
+        0x6D: ["evse_set_cable_check_finished"],
+        0x6E: ["evse_start_charging"],
+        0x6F: ["evse_stop_charging"],
+        0x70: ["evse_stop_listen"],
+        0x73: ["evse_set_cable_certificate_installation_and_update_response"],
+        0x74: ["evse_set_meter_receipt"],
+        0x75: ["evse_send_notification"],
+        0x76: ["evse_set_session_parameter_timeout"],
+
+        # EVSE notification IDs
+        0x80: ["evse_session_started"],
+        0x81: ["evse_payment_selected"],
+        0x82: ["evse_request_authorization"],
+        0x83: ["evse_energy_transfer_mode_selected"],
+        0x84: ["evse_request_schedules"],
+        0x85: ["evse_dc_charge_parameters_changed"],
+        0x86: ["evse_ac_charge_parameters_changed"],
+        0x87: ["evse_request_cable_check"],
+        0x88: ["evse_pre_charge_started"],
+        0x89: ["evse_request_start_charging"],
+        0x8A: ["evse_request_stop_charging"],
+        0x8B: ["evse_welding_detection_started"],
+        0x8C: ["evse_session_stopped"],
+        0x8E: ["evse_session_error"],
+        0x8F: ["evse_certificate_installation_requested"],
+        0x90: ["evse_certificate_update_requested"],
+        0x91: ["evse_metering_receipt_status"],
+
+        # EV sub IDs
+        0xA0: ["ev_set_configuration"],
+        0xA1: ["ev_get_configuration"],
+        0xA2: ["ev_set_dc_charging_parameters"],
+        0xA3: ["ev_update_dc_charging_parameters"],
+        0xA4: ["ev_get_dc_charging_parameters"],
+        0xA5: ["ev_set_ac_charging_parameters"],
+        0xA6: ["ev_update_ac_charging_parameters"],
+        0xA7: ["ev_get_ac_charging_parameters"],
+        0xA8: ["ev_set_charging_profile"],
+        0xA9: ["ev_start_session"],
+        0xAA: ["ev_start_cable_check"],
+        0xAB: ["ev_start_pre_charging"],
+        0xAC: ["ev_start_charging"],
+        0xAD: ["ev_stop_charging"],
+        0xAE: ["ev_stop_session"],
+
+        # EV notification IDs
+        0xC0: ["ev_session_started"],
+        0xC1: ["ev_dc_charge_parameters_changed"],
+        0xC2: ["ev_ac_charge_parameters_changed"],
+        0xC3: ["ev_schedule_received"],
+        0xC4: ["ev_cable_check_ready"],
+        0xC5: ["ev_cable_check_finished"],
+        0xC6: ["ev_pre_charging_ready"],
+        0xC7: ["ev_charging_ready"],
+        0xC8: ["ev_charging_started"],
+        0xC9: ["ev_charging_stopped"],
+        0xCA: ["ev_post_charging_ready"],
+        0xCB: ["ev_session_stopped"],
+        0xCC: ["ev_notification_received"],
+        0xCD: ["ev_session_error"],
+    }],
+    "slac": [0x28, {
+        0x42: ["start"],
+        0x43: ["stop"],
+        0x44: ["match", "start_match"],
+        0x4B: ["set_validation_configuration"],
+        0x4D: ["join"],
+        0x80: ["success"],
+        0x81: ["failed"],
+        0x84: ["join_status"],
+    }],
+    "cp": [0x29, {
+        0x40: ["set_mode"],
+        0x41: ["get_mode"],
+        0x42: ["start"],
+        0x43: ["stop"],
+        0x44: ["set_dc"],
+        0x45: ["get_dc"],
+        0x46: ["set_res"],
+        0x47: ["get_res"],
+        0x48: ["get_state"],
+        0x81: ["nc_state"],
+    }],
+    "error": [0xFF, {}],
+}
+
+# Lookup tables of the registry
+MODULE_NAMES = {}
+SUB_NAMES = {}
+MODULE_IDS_BY_NAME = {}
+SUB_IDS_BY_NAME = {}
+
+for _module_name, (_mod_id, _subs) in MODULE_IDS.items():
+    MODULE_NAMES[_mod_id] = _module_name
+    MODULE_IDS_BY_NAME[_module_name] = _mod_id
+    SUB_NAMES[_mod_id] = {}
+    SUB_IDS_BY_NAME[_module_name] = {}
+    for _sub_id, _sub_names in _subs.items():
+        SUB_NAMES[_mod_id][_sub_id] = _sub_names[0]
+        for _sub_name in _sub_names:
+            SUB_IDS_BY_NAME[_module_name][_sub_name] = _sub_id
+
+# the lookups return the same values as the search through MODULE_IDS they replaced: None for
+# an unknown module and the string "None" for an unknown sub ID of a known module
+def get_module_name_by_id(id):
+    return MODULE_NAMES.get(id)
+
+def get_module_id_by_name(name):
+    return MODULE_IDS_BY_NAME.get(name)
+
+def get_sub_name_by_id(module_id, sub_id):
+    sub_names = SUB_NAMES.get(module_id)
+    return sub_names.get(sub_id, "None") if sub_names is not None else None
+
+def get_sub_id_by_name(module_name, sub_name):
+    return SUB_IDS_BY_NAME[module_name].get(sub_name)
 
 START_OF_FRAME      = 0xc0
 END_OF_FRAME        = 0xc1
 START_OF_ENCR_FRAME = 0xfe
-END_OF_ENCR_FRAME   = 0xff
\ No newline at end of file
+END_OF_ENCR_FRAME   = 0xff
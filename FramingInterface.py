@@ -4,12 +4,54 @@ from multiprocessing import Process, Manager
 from binascii import hexlify, unhexlify
 
 from FramingAPIDef import *
+from FrameBacklog import *
+from RequestIdAllocator import *
+from FrameEncoder import *
+from NotificationDispatcher import *
+from FrameRecorder import *
 
 sys.path.append("..")
 
 def log(x): return print(x)
 def debug_log(x): pass
 
+class PendingRequest():
+    """
+    Handle of a request that was sent to the module. The response is routed to the request by
+    its request ID, so several requests can be in flight at the same time.
+    """
+
+    def __init__(self, framing, mod_id, sub_id, payload, req_id, sent_time=None):
+        self.framing = framing
+        self.mod_id = mod_id
+        self.sub_id = sub_id
+        self.payload = payload
+        self.req_id = req_id
+        # time.time_ns() before the request was built and sent
+        self.sent_time = sent_time
+        self.response = None
+
+    def done(self):
+        """
+        Returns True if the response was already received.
+        """
+        return self.response is not None
+
+    def result(self, timeout=5, noisy_timeout=False):
+        """
+        Waits for the response of the request. Returns None if the response was not received
+        within the timeout.
+        """
+        if self.response is None:
+            self.response = self.framing.receive_next_frame(filter_mod=[self.mod_id, 0xFF],
+                                                            filter_sub={self.mod_id: self.sub_id},
+                                                            filter_req_id=self.req_id,
+                                                            timeout=timeout,
+                                                            noisy_timeout=noisy_timeout)
+            if self.response is None:
+                self.framing.request_ids.expire(self.req_id)
+        return self.response
+
 class FramingInterface():
 
     def __init__(self):
@@ -23,7 +65,8 @@ class FramingInterface():
         self.sut_mac = ""
         self.sut_interface = ""
 
-        self.request_id = 0
+        self.request_ids = RequestIdAllocator()
+        self.frame_encoder = FrameEncoder()
         self.seq_nr = -1
         self.last_sent = None
         self.last_frame_fetch_time = None
@@ -32,8 +75,10 @@ class FramingInterface():
         self.cmd_sut_adapter = None
 
         self.notification_frames = []
-        self.data_frames = []
-        self.frame_backlog = []
+        self.data_frames = FrameBuffer(DEFAULT_LIMITS["data"])
+        self.frame_backlog = FrameBacklog()
+        self.notification_dispatcher = NotificationDispatcher()
+        self.recorder = None
 
         self.verbose_tx = False
         self.verbose_rx = False
@@ -46,18 +91,41 @@ class FramingInterface():
     """
     top level function for initializing the SUT adapter for framing
     """
-    def initialize_framing(self, if_type, if_name, mac):
-        """Top level function for initializing the SUT adapter for framing
+    def initialize_framing(self, if_type, if_name, mac, tx_coalescing_us=None, adapter_mode="process", timestamping=False,
+                           gpio=None, spi=None, hardware_cs=False):
+        """Top level function for initializing the SUT adapter for framing. On Ethernet, frames
+        that are sent within tx_coalescing_us microseconds are packed into one packet. The
+        adapter_mode selects whether the adapter receives in a separate "process", in a
+        "thread" or in a separate process handing over the frames through shared memory ("shm").
+        On Ethernet the mode "shared" receives for all modules of an interface in one thread.
+        The "LOOPBACK" interface connects to the peer created by LoopbackAdapter.listen(if_name).
+        The "REPLAY" interface plays back the capture file if_name or the capture prepared by
+        ReplayAdapter.prepare(if_name, ...). On Ethernet the mac may also be the IP address of
+        the module, its MAC address is then resolved by the MacResolver. With timestamping the
+        Ethernet adapter provides the kernel receive and send time of the frames. On SPI, gpio
+        and spi replace the GPIOs and the SPI device of the Raspberry Pi, e.g. by a FakeGpioHal
+        and a FakeSpiDev, and with hardware_cs the chip select of the SPI device is used.
         """
         self.connection_mode = if_type
         if self.connection_mode == "ETH":
             import EthernetAdapter
-            self.sut_adapter = EthernetAdapter.EthernetAdapter()
-            if mac:
+            self.sut_adapter = EthernetAdapter.EthernetAdapter(adapter_mode)
+            if mac and mac.count(".") == 3:
+                self.sut_ip = mac
+                self.sut_adapter.sut_ip = mac
+            elif mac:
                 self.sut_adapter.dut_mac = mac
+            self.sut_adapter.tx_coalescing_us = tx_coalescing_us
+            self.sut_adapter.timestamping = timestamping
         elif self.connection_mode == "SPI":
             import SpiAdapter
-            self.sut_adapter = SpiAdapter.SpiAdapter()
+            self.sut_adapter = SpiAdapter.SpiAdapter(adapter_mode, gpio, spi, hardware_cs)
+        elif self.connection_mode == "LOOPBACK":
+            import LoopbackAdapter
+            self.sut_adapter = LoopbackAdapter.connect(if_name)
+        elif self.connection_mode == "REPLAY":
+            import ReplayAdapter
+            self.sut_adapter = ReplayAdapter.connect(if_name)
         else:
             raise AssertionError("Invalid interface!")
 
@@ -72,11 +140,29 @@ class FramingInterface():
     def set_plain_config(self, connection_mode):
         self.connection_mode = connection_mode
 
-    def receive_next_unencrypted_frame(self, break_on_data, break_on_notification):
-        if not self.sut_adapter.holding_data():
+    def receive_next_unencrypted_frame(self, break_on_data, break_on_notification, deadline=None):
+        if deadline is not None:
+            frame = self.sut_adapter.wait_for_frame(deadline)
+        elif not self.sut_adapter.holding_data():
             return None
         else:
-            return self.sut_adapter.receive()
+            frame = self.sut_adapter.receive()
+        if frame is not None and self.recorder is not None:
+            self.recorder.record(RECORD_RX, frame.raw)
+        return frame
+
+    def start_recording(self, path):
+        """
+        Appends every frame that is sent or received from now on to the capture file at path.
+        The capture can be played back with the "REPLAY" interface.
+        """
+        self.stop_recording()
+        self.recorder = FrameRecorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def reload_communication_interface(self):
         if self.connection_mode == "ETH":
@@ -111,11 +197,10 @@ class FramingInterface():
     def read_input(self, nbytes, timeout=0.3):
         data = b""
         for i in range(0, nbytes):
-            end_time = time.time() + timeout
-            while not self.sut_adapter.holding_data():
-                if time.time() > end_time:
-                    return None
-            data += self.sut_adapter.receive()
+            received = self.sut_adapter.wait_for_frame(time.time() + timeout)
+            if received is None:
+                return None
+            data += received
         return data
 
     def write_output(self, data):
@@ -147,21 +232,26 @@ class FramingInterface():
                            filter_req_id=None,
                            search_backlog=True):
 
-        frame = None
-        satisfied = False
+        frame_filter = FrameFilter(filter_mod, filter_sub, filter_req_id,
+                                   break_on_data, break_on_notification)
 
         timeout_point = time.time() + timeout
-        temp_backlog = []
+        deadline = timeout_point if timeout != 0 else None
         if self.encryption_initiated:
             debug_log("Fetching next encrypted frame from buffer")
         else:
             debug_log("Fetching next normal frame from buffer")
 
-        while not satisfied:
-            satisfied = True
+        """ frames already in the backlog are older than anything still queued in the adapter """
+        if search_backlog and self.frame_backlog:
+            debug_log("Searching backlog, current size: {}".format(len(self.frame_backlog)))
+            frame = self.frame_backlog.pop(frame_filter)
+            if frame is not None:
+                return self._accept_frame(frame, frame_filter)
 
+        while True:
             """ make sure to get frames every x milliseconds """
-            if self.limited_host_simulation and len(self.frame_backlog) == 0:
+            if self.limited_host_simulation:
                 if not self.last_frame_fetch_time:
                     self.last_frame_fetch_time = time.time()
 
@@ -173,75 +263,20 @@ class FramingInterface():
                 frame = self.receive_next_encrypted_frame()
             else:
                 frame = self.receive_next_unencrypted_frame(
-                    break_on_data, break_on_notification)
-
-            # check if we got a frame or no input on uart
-            if frame is None:
-                if self.frame_backlog and search_backlog:
-                    debug_log("Retrieving frame from backlog, current size: {}".format(
-                        len(self.frame_backlog)))
-                    frame = self.frame_backlog.pop(0)
-                    # debug_log(self.printable_frame(frame))
+                    break_on_data, break_on_notification, deadline)
 
             if frame is not None:
-                if filter_req_id is not None:
-                    # Filter for request ID
-                    if isinstance(filter_req_id, int):
-                        filter_req_id = [filter_req_id]
-                    if frame.req_id not in filter_req_id:
-                        satisfied = False
-
-                if filter_mod is not None:
-                    # Filter for module ID
-                    if isinstance(filter_mod, int):
-                        filter_mod = [filter_mod]
-                    if frame.mod_id not in filter_mod:
-                        satisfied = False
-
-                if filter_sub is not None:
-                    # Filter for sub ID
-                    sub_id_filter_list = None
-
-                    if isinstance(filter_sub, dict):
-                        if frame.mod_id in filter_sub:
-                            sub_id_filter_list = filter_sub[frame.mod_id]
-                    else:
-                        sub_id_filter_list = filter_sub
-
-                    if isinstance(sub_id_filter_list, int):
-                        sub_id_filter_list = [sub_id_filter_list]
-
-                    if not (sub_id_filter_list == None or frame.sub_id in sub_id_filter_list):
-                        satisfied = False
-
-                # for backwards compatibility
-                if frame.sub_id > 127:
-                    if not break_on_notification and not filter_sub and not filter_mod \
-                            and not filter_req_id:
-                        satisfied = False
-                elif frame.sub_id == 1:
-                    if break_on_data or 1 in filter_sub:
-                        self.data_frames.append(frame)
-                    else:
-                        satisfied = False
-
-                if not satisfied:
-                    temp_backlog.append(frame)
-            else:
-                satisfied = False
-
-            if timeout == 0:
-                if satisfied == False:
-                    frame = None
-
-                if self.sut_adapter.holding_data():
+                if self._is_late_frame(frame) or self.notification_dispatcher.dispatch(frame):
                     continue
+                if frame_filter.accepts(frame):
+                    return self._accept_frame(frame, frame_filter)
+                self.frame_backlog.append(frame)
+                continue
 
-                if len(self.frame_backlog) == 0 or search_backlog == False:
-                    break
+            if timeout == 0:
+                return None
 
-            elif time.time() > timeout_point and not satisfied:
-                self.frame_backlog = temp_backlog + self.frame_backlog
+            elif time.time() > timeout_point:
                 debug_log("Im over timeout {}: timeout_point is {} and i am {}".format(
                     str(timeout), str(timeout_point), str(time.time())))
 
@@ -250,11 +285,57 @@ class FramingInterface():
                 else:
                     return None
 
-            else:
-                # Timeout not exceeded, continue
-                pass
+    def subscribe(self, mod_id, sub_ids, callback=None):
+        """
+        Subscribes to the notifications with the given sub IDs of a module. Matching
+        notifications are routed to the subscription when they are received instead of being
+        stored in the backlog. Notifications that are already in the backlog are handed over.
+        """
+        subscription = self.notification_dispatcher.subscribe(mod_id, sub_ids, callback)
+        frame_filter = FrameFilter(mod_id, subscription.sub_ids, NotificationDispatcher.NOTIFICATION_REQ_IDS)
+        frame = self.frame_backlog.pop(frame_filter)
+        while frame is not None:
+            subscription.deliver(frame)
+            frame = self.frame_backlog.pop(frame_filter)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Ends a subscription. Notifications that were buffered for it are dropped, later ones
+        are stored in the backlog again.
+        """
+        self.notification_dispatcher.unsubscribe(subscription)
+        subscription.frames.clear()
+
+    def receive_notification(self, subscription, timeout=5):
+        """
+        Returns the next notification of a subscription without callback. Frames received in
+        the meantime are routed as usual. Returns None if no notification was received within
+        the timeout.
+        """
+        deadline = time.time() + timeout
+        while not subscription.frames:
+            frame = self.receive_next_unencrypted_frame(False, False, deadline)
+            if frame is not None:
+                if not self._is_late_frame(frame) and not self.notification_dispatcher.dispatch(frame):
+                    self.frame_backlog.append(frame)
+            elif time.time() >= deadline:
+                return None
+        return subscription.frames.popleft()
 
-        self.frame_backlog = temp_backlog + self.frame_backlog
+    def _is_late_frame(self, frame):
+        """
+        Responses to requests that already timed out are dropped
+        """
+        if self.request_ids.is_late(frame.req_id):
+            debug_log("Dropping late response with request ID {}".format(frame.req_id))
+            return True
+        return False
+
+    def _accept_frame(self, frame, frame_filter):
+        self.request_ids.release(frame.req_id)
+        if frame.sub_id == 1 and frame_filter.collects_data:
+            self.data_frames.append(frame)
         return frame
 
     def send_frame_and_get_answer(self, module_id, sub_id, payload, timeout=5,
@@ -263,6 +344,22 @@ class FramingInterface():
         return self.receive_next_frame(filter_req_id=req_id, timeout=timeout,
                                        noisy_timeout=noisy_timeout)
 
+    def send_request(self, module_id, sub_id, payload):
+        """
+        Sends a frame without waiting for the response. Returns a PendingRequest handle which
+        is used to receive the response later on.
+        """
+        sent_time = time.time_ns()
+        req_id = self.build_and_send_frame(module_id, sub_id, payload)
+        return PendingRequest(self, module_id, sub_id, payload, req_id, sent_time)
+
+    def get_tx_timestamp(self, req_id):
+        """
+        Returns the time in ns the kernel sent the last frame with the given request ID, or
+        None if the adapter does not provide kernel timestamps.
+        """
+        return self.sut_adapter.get_tx_timestamp(req_id)
+
     """
     get last sent frame
     """
@@ -274,6 +371,8 @@ class FramingInterface():
     """
     def send_frame(self, frame):
         self.last_sent = frame
+        if self.recorder is not None:
+            self.recorder.record(RECORD_TX, frame)
         if self.encryption_initiated:
             self.send_encrypted_frame(frame)
         else:
@@ -301,36 +400,23 @@ class FramingInterface():
 
     def printable_frame(self, frame):
         prettystring = "\n###### FRAME ######"
-        for key in frame.__dict__.keys():
-            if key[0] == "_":
-                continue
+        for key in Frame.FIELDS:
             prettystring += "\n| " + key + ": " + \
-                str(frame.__dict__[key]) + "\t\t\t"
+                str(getattr(frame, key)) + "\t\t\t"
 
         return prettystring + "\n"
 
     def build_and_send_frame(self, module_id, sub_id, payload, req_id=None):
-        payload_length_and_payload = len(payload).to_bytes(
-            2, "big") + payload if payload else b"\x00\x00"
         request_id_num = self.generate_next_request_id() if req_id == None else req_id
-        request_id = request_id_num.to_bytes(1, "big")
-        frame_without_checksum = (START_OF_FRAME.to_bytes(1, "big") + module_id.to_bytes(1, "big") +
-                                  sub_id.to_bytes(1, "big") + request_id +
-                                  payload_length_and_payload + b"\x00" + END_OF_FRAME.to_bytes(1,"big"))
-
-        self.send_frame(START_OF_FRAME.to_bytes(1, "big") + module_id.to_bytes(1, "big") + sub_id.to_bytes(1, "big")
-                        + request_id + payload_length_and_payload +
-                        self.compute_payload_checksum(frame_without_checksum) + END_OF_FRAME.to_bytes(1, "big"))
+        self.send_frame(self.frame_encoder.encode(module_id, sub_id, request_id_num, payload))
 
         return request_id_num
 
     def generate_next_request_id(self):
-        if self.request_id == 254: # Skip 0xFF as that's used for status messages
-            self.request_id = 0
-        else:
-            self.request_id += 1
+        return self.request_ids.allocate()
 
-        return self.request_id
+    def get_request_statistics(self):
+        return self.request_ids.get_statistics()
 
     def generate_next_seq_nr(self):
         if self.seq_nr == 200055:
@@ -354,6 +440,7 @@ class FramingInterface():
         self.drain_data()
         self.data_frames.clear()
         self.frame_backlog.clear()
+        self.notification_dispatcher.clear()
 
     def drain_data(self):
         self.sut_adapter.clear_queues()
@@ -364,28 +451,45 @@ class FramingInterface():
     def get_backlog_frames(self):
         pass
 
+    def set_buffer_limit(self, frame_class, limit, policy=DROP_OLDEST):
+        """
+        Bounds the number of buffered frames of a frame class ("responses", "notifications" or
+        "data"). When the limit is reached either the oldest frame (DROP_OLDEST) or the new
+        frame (DROP_NEWEST) is dropped. The notification limit also applies to the frames of
+        every subscription, the data limit also to the received data frames.
+        """
+        self.frame_backlog.set_limit(frame_class, limit, policy)
+        if frame_class == "notifications":
+            self.notification_dispatcher.set_limit(limit, policy)
+        elif frame_class == "data":
+            self.data_frames.set_limit(limit, policy)
+
+    def get_buffer_statistics(self):
+        """
+        Returns the number of frames, the limit, the dropped frames and the high-water mark of
+        the backlog per frame class, of the data frames and of the subscriptions.
+        """
+        return {
+            "backlog": self.frame_backlog.get_statistics(),
+            "data_frames": self.data_frames.get_statistics(),
+            "subscriptions": self.notification_dispatcher.get_statistics(),
+        }
+
     def get_module_name_by_id(self, id):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_details[0] == id:
-                return module_name
+        return get_module_name_by_id(id)
 
     def get_module_id_by_name(self, name):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_name == name:
-                return module_details[0]
+        return get_module_id_by_name(name)
 
     def get_sub_name_by_id(self, module_id, sub_id):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_details[0] == module_id:
-                return module_details[1][sub_id][0] if sub_id in module_details[1].keys() else "None"
+        return get_sub_name_by_id(module_id, sub_id)
 
     def get_sub_id_by_name(self, module_name, sub_name):
-        for s_name, s_id in MODULE_IDS[module_name][1]:
-            if sub_name == s_name:
-                return s_id
+        return get_sub_id_by_name(module_name, sub_name)
 
     def shut_down_interface(self):
         self.clear_backlog()
         self.sut_adapter.clear_queues()
         self.sut_adapter.stop()
+        self.stop_recording()
         self.initialized = False
\ No newline at end of file
@@ -0,0 +1,118 @@
+import threading
+
+# RPi.GPIO is only needed on the Raspberry Pi
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+class GpioHal():
+    """
+    Interface of the GPIOs used by the SPI adapter. Pins are numbered like the BCM numbering
+    of the Raspberry Pi. Edge callbacks are called on a rising edge of an input, from a thread
+    of the HAL.
+    """
+
+    # the GPIOs can only be accessed from the process that created the HAL
+    thread_only = False
+
+    def setup_input(self, pin):
+        pass
+
+    def setup_output(self, pin, initial):
+        pass
+
+    def input(self, pin):
+        pass
+
+    def output(self, pin, value):
+        pass
+
+    def add_edge_callback(self, pin, callback):
+        pass
+
+    def remove_edge_callback(self, pin):
+        pass
+
+class RpiGpioHal(GpioHal):
+    """
+    GPIOs of the Raspberry Pi accessed with RPi.GPIO. Edges are detected by the kernel, the
+    callbacks run in the event thread of RPi.GPIO of the process that added them.
+    """
+
+    def __init__(self):
+        if GPIO is None:
+            raise ImportError("RPi.GPIO is needed for the GPIOs of the Raspberry Pi")
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_input(self, pin):
+        GPIO.setup(pin, GPIO.IN)
+
+    def setup_output(self, pin, initial):
+        GPIO.setup(pin, GPIO.OUT, initial=GPIO.HIGH if initial else GPIO.LOW)
+
+    def input(self, pin):
+        return GPIO.input(pin)
+
+    def output(self, pin, value):
+        GPIO.output(pin, value)
+
+    def add_edge_callback(self, pin, callback):
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=lambda channel: callback())
+
+    def remove_edge_callback(self, pin):
+        GPIO.remove_event_detect(pin)
+
+class FakeGpioHal(GpioHal):
+    """
+    GPIOs in memory for running the SPI adapter without hardware. The inputs are driven with
+    set_input(), which calls the edge callback of the pin on a rising edge. The levels written
+    to the outputs are kept in outputs.
+
+    Only usable in the thread mode of the adapter. The levels and callbacks live in the memory
+    of the process that created the HAL, a transfer process in the process or shm mode would
+    work on a copy that never sees set_input(), so the SPI adapter rejects these modes.
+    """
+
+    thread_only = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.levels = {}
+        self.outputs = {}
+        self.callbacks = {}
+
+    def setup_input(self, pin):
+        with self.lock:
+            self.levels.setdefault(pin, 0)
+
+    def setup_output(self, pin, initial):
+        with self.lock:
+            self.outputs[pin] = [int(initial)]
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def output(self, pin, value):
+        with self.lock:
+            self.outputs.setdefault(pin, []).append(int(value))
+
+    def add_edge_callback(self, pin, callback):
+        with self.lock:
+            self.callbacks[pin] = callback
+
+    def remove_edge_callback(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+
+    def set_input(self, pin, value):
+        """
+        Drives an input to the given level.
+        """
+        with self.lock:
+            previous = self.levels.get(pin, 0)
+            self.levels[pin] = int(value)
+            callback = self.callbacks.get(pin) if value and not previous else None
+        if callback is not None:
+            callback()
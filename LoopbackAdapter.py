@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import deque
+
+from SUTAdapter import *
+from FramingAPIDef import *
+from FrameDecoder import FrameDecoder
+
+class LoopbackPipe():
+    """
+    One direction of an in-process byte pipe. Written buffers are handed to the reader without
+    copying them. Each buffer becomes readable once it was serialized with the given bandwidth
+    (bits per second, None for unlimited) and the latency (seconds) has passed.
+    """
+
+    def __init__(self, latency=0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.buffers = deque()
+        self.busy_until = 0
+        self.condition = threading.Condition()
+        self.bytes_written = 0
+
+    def write(self, data):
+        with self.condition:
+            now = time.time()
+            start = max(now, self.busy_until)
+            self.busy_until = start + (len(data) * 8 / self.bandwidth if self.bandwidth else 0)
+            self.buffers.append((self.busy_until + self.latency, data))
+            self.bytes_written += len(data)
+            self.condition.notify_all()
+
+    def read(self, deadline):
+        """
+        Returns the next buffer that arrived until the deadline (time.time() based) or None.
+        """
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.buffers and self.buffers[0][0] <= now:
+                    return self.buffers.popleft()[1]
+                if now >= deadline:
+                    return None
+                wakeup = deadline
+                if self.buffers:
+                    wakeup = min(wakeup, self.buffers[0][0])
+                self.condition.wait(wakeup - now)
+
+    def ready(self):
+        return bool(self.buffers) and self.buffers[0][0] <= time.time()
+
+    def clear(self):
+        with self.condition:
+            self.buffers.clear()
+
+class LoopbackAdapter(SUTAdapter):
+    """
+    SUT adapter connected to a peer adapter in the same process instead of a module. Each
+    sent frame is written to the pipe towards the peer and decoded on the other side, so the
+    peer sees the same byte stream a module would receive. Use pair() to create two connected
+    adapters, or listen() and connect() to attach a framing interface by interface name.
+    """
+
+    def __init__(self, pipe_tx, pipe_rx):
+        self.pipe_tx = pipe_tx
+        self.pipe_rx = pipe_rx
+        self.frames = deque()
+        self.frame_decoder = FrameDecoder()
+        self.sut_interface = ""
+
+    @staticmethod
+    def pair(latency=0, bandwidth=None):
+        """
+        Returns two connected adapters. Latency and bandwidth apply to both directions.
+        """
+        pipe_a = LoopbackPipe(latency, bandwidth)
+        pipe_b = LoopbackPipe(latency, bandwidth)
+        return LoopbackAdapter(pipe_a, pipe_b), LoopbackAdapter(pipe_b, pipe_a)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    """
+    send data
+    """
+    def send(self, data):
+        self.pipe_tx.write(bytes(data))
+
+    """
+    receive data
+    """
+    def receive(self):
+        return self.wait_for_frame(0)
+
+    """
+    block until a frame was received or the deadline has passed
+    """
+    def wait_for_frame(self, deadline):
+        while not self.frames:
+            data = self.pipe_rx.read(deadline)
+            if data is None:
+                return None
+            for raw in self.frame_decoder.feed(data):
+                self.frames.append(self.parse_frame(raw))
+        return self.frames.popleft()
+
+    """
+    returns true if data is available
+    """
+    def holding_data(self):
+        return bool(self.frames) or self.pipe_rx.ready()
+
+    """
+    clearing queues
+    """
+    def clear_queues(self):
+        self.frames.clear()
+        self.pipe_rx.clear()
+
+# adapters waiting for a framing interface, by interface name
+_listening = {}
+
+def listen(name, latency=0, bandwidth=None):
+    """
+    Creates a connected pair of adapters. The first one is handed to the framing interface that
+    is initialized with the interface type "LOOPBACK" and the given name, the second one is
+    returned for the module side.
+    """
+    host, module = LoopbackAdapter.pair(latency, bandwidth)
+    _listening[name] = host
+    return module
+
+def connect(name):
+    """
+    Returns the host side adapter that was created by listen() with the given name.
+    """
+    host = _listening.pop(name, None)
+    if host is None:
+        raise AssertionError("No loopback peer listening on \"{}\"".format(name))
+    return host
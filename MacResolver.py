@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+# IP to MAC mappings that survive a restart of the application
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "FreeV2G", "mac_cache.json")
+
+NEIGHBOUR_TABLE = "/proc/net/arp"
+
+# flag of a complete entry in the neighbour table
+ATF_COM = 0x2
+
+def read_neighbour_table(path=NEIGHBOUR_TABLE):
+    """
+    Returns the complete entries of the kernel neighbour table as dictionary of IP to
+    (MAC, interface). Returns an empty dictionary if the table is not available.
+    """
+    entries = {}
+    try:
+        with open(path) as file:
+            lines = file.readlines()[1:]
+    except OSError:
+        return entries
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        ip, hw_type, flags, mac, mask, interface = fields[:6]
+        if int(flags, 16) & ATF_COM and mac != "00:00:00:00:00:00":
+            entries[ip] = (mac.lower(), interface)
+    return entries
+
+class MacResolver():
+    """
+    Resolves the MAC address of a module from its IP address. The kernel neighbour table is
+    read first, then the cache file is consulted and only then ARP requests are sent, with a
+    timeout that is doubled after every unanswered request. Resolved addresses are written to
+    the cache file, so a reconnect after a restart does not wait for ARP. An entry that turned
+    out to be wrong has to be removed with invalidate(). The invalidated address is then not
+    taken from the neighbour table either, until ARP resolved the IP address again.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, neighbour_table=NEIGHBOUR_TABLE):
+        self.cache_path = cache_path
+        self.neighbour_table = neighbour_table
+        self.lock = threading.Lock()
+        self.cache = self._load()
+        # MAC addresses removed by invalidate() by cache key
+        self.invalidated = {}
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _save(self):
+        # written to a temporary file first, a crash never leaves a truncated cache behind
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            temporary = self.cache_path + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump(self.cache, file, indent=4)
+            os.replace(temporary, self.cache_path)
+        except OSError as e:
+            print("Could not write MAC cache \"{}\": {}".format(self.cache_path, e))
+
+    def _key(self, ip, interface):
+        return "{}%{}".format(ip, interface) if interface else ip
+
+    def lookup(self, ip, interface=None):
+        """
+        Returns the MAC address of the IP address from the neighbour table or the cache without
+        sending anything. Returns None if the address is unknown.
+        """
+        entry = read_neighbour_table(self.neighbour_table).get(ip)
+        if entry is not None and (not interface or entry[1] == interface) \
+                and self.invalidated.get(self._key(ip, interface)) != entry[0]:
+            self._store(ip, interface, entry[0])
+            return entry[0]
+        with self.lock:
+            entry = self.cache.get(self._key(ip, interface))
+        return entry["mac"] if entry is not None else None
+
+    def resolve(self, ip, interface=None, timeout=10, initial_timeout=0.05):
+        """
+        Returns the MAC address of the IP address. If it is neither in the neighbour table nor
+        in the cache, ARP requests are sent until the timeout has passed. The first request
+        waits initial_timeout seconds for the reply, every further request twice as long.
+        Raises an AssertionError if the address could not be resolved.
+        """
+        mac = self.lookup(ip, interface)
+        if mac is not None:
+            return mac
+
+        end_time = time.time() + timeout
+        wait = initial_timeout
+        while True:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                raise AssertionError("Could not determine target MAC address from IP {}".format(ip))
+            mac = self._arp(ip, interface, min(wait, remaining))
+            if mac is None:
+                # the kernel may have resolved the address in the meantime
+                mac = self.lookup(ip, interface)
+            if mac is not None:
+                with self.lock:
+                    # a stale neighbour table entry stays ignored if the module got a new MAC
+                    if self.invalidated.get(self._key(ip, interface)) == mac:
+                        del self.invalidated[self._key(ip, interface)]
+                self._store(ip, interface, mac)
+                return mac
+            wait *= 2
+
+    def resolve_async(self, ip, interface=None, timeout=10):
+        """
+        Resolves the MAC address in a thread. Returns a concurrent.futures.Future with the
+        result of resolve().
+        """
+        future = Future()
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.resolve(ip, interface, timeout))
+            except BaseException as e:
+                future.set_exception(e)
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def invalidate(self, ip, interface=None):
+        """
+        Removes the IP address from the cache. Called when no frames arrive from the resolved
+        MAC address anymore.
+        """
+        key = self._key(ip, interface)
+        with self.lock:
+            entry = self.cache.pop(key, None)
+            if entry is None:
+                return
+            self.invalidated[key] = entry["mac"]
+            self._save()
+
+    def _store(self, ip, interface, mac):
+        key = self._key(ip, interface)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry["mac"] == mac:
+                return
+            self.cache[key] = {"mac": mac, "time": time.time()}
+            self._save()
+
+    def _arp(self, ip, interface, timeout):
+        # sends one ARP request and returns the MAC of the reply or None
+        from scapy.layers.l2 import ARP, Ether
+        from scapy.sendrecv import srp1
+        request = Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=ip)
+        try:
+            if interface:
+                reply = srp1(request, iface=interface, timeout=timeout, verbose=0)
+            else:
+                reply = srp1(request, timeout=timeout, verbose=0)
+        except OSError as e:
+            print("ARP request for {} failed: {}".format(ip, e))
+            time.sleep(timeout)
+            return None
+        if reply is None or ARP not in reply:
+            return None
+        return reply[ARP].hwsrc.lower()
+
+# resolvers by cache path, shared by all adapters of the application
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+def get_resolver(cache_path=DEFAULT_CACHE_PATH):
+    """
+    Returns the resolver of the given cache file, all adapters using the same file share it.
+    """
+    with _resolvers_lock:
+        resolver = _resolvers.get(cache_path)
+        if resolver is None:
+            resolver = _resolvers[cache_path] = MacResolver(cache_path)
+        return resolver
@@ -0,0 +1,106 @@
+from FrameBacklog import *
+
+class Subscription():
+    """
+    Subscription to notifications of one module. Notifications are passed to the callback if
+    one is given (e.g. the put method of a queue), otherwise they are collected in the bounded
+    frames buffer.
+    """
+
+    def __init__(self, dispatcher, mod_id, sub_ids, callback=None, limit=None, policy=DROP_OLDEST):
+        self.dispatcher = dispatcher
+        self.mod_id = mod_id
+        self.sub_ids = tuple(sub_ids)
+        self.callback = callback
+        self.frames = FrameBuffer(limit, policy)
+
+    def deliver(self, frame):
+        if self.callback is not None:
+            self.callback(frame)
+        else:
+            self.frames.append(frame)
+
+    def cancel(self):
+        """
+        Stops the delivery of notifications to this subscription.
+        """
+        self.dispatcher.unsubscribe(self)
+
+class NotificationDispatcher():
+    """
+    Routes received notifications to the subscriptions registered for their module ID and
+    sub ID. Every notification is routed once when it is received.
+    """
+
+    NOTIFICATION_REQ_IDS = (0x00, 0xFF)
+
+    def __init__(self, limit=DEFAULT_LIMITS["notifications"], policy=DROP_OLDEST):
+        self.subscriptions = {}
+        self.limit = limit
+        self.policy = policy
+
+    def set_limit(self, limit, policy=DROP_OLDEST):
+        """
+        Sets the bound of the frames buffer of all subscriptions.
+        """
+        self.limit = limit
+        self.policy = policy
+        for subscription in self:
+            subscription.frames.set_limit(limit, policy)
+
+    def __iter__(self):
+        subscriptions = []
+        for entries in self.subscriptions.values():
+            for subscription in entries:
+                if subscription not in subscriptions:
+                    subscriptions.append(subscription)
+        return iter(subscriptions)
+
+    def subscribe(self, mod_id, sub_ids, callback=None):
+        """
+        Registers a subscription for the given sub IDs of a module.
+        """
+        if isinstance(sub_ids, int):
+            sub_ids = [sub_ids]
+        subscription = Subscription(self, mod_id, sub_ids, callback, self.limit, self.policy)
+        for sub_id in subscription.sub_ids:
+            self.subscriptions.setdefault((mod_id, sub_id), []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for sub_id in subscription.sub_ids:
+            key = (subscription.mod_id, sub_id)
+            subscriptions = self.subscriptions.get(key)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.remove(subscription)
+                if not subscriptions:
+                    del self.subscriptions[key]
+
+    def clear(self):
+        """
+        Removes the buffered notifications of all subscriptions.
+        """
+        for subscription in self:
+            subscription.frames.clear()
+
+    def dispatch(self, frame):
+        """
+        Hands a frame to all matching subscriptions. Returns False if the frame is not a
+        notification or nobody subscribed to it.
+        """
+        if frame.req_id not in self.NOTIFICATION_REQ_IDS:
+            return False
+        subscriptions = self.subscriptions.get((frame.mod_id, frame.sub_id))
+        if not subscriptions:
+            return False
+        for subscription in subscriptions:
+            subscription.deliver(frame)
+        return True
+
+    def get_statistics(self):
+        """
+        Returns the buffer statistics of all subscriptions without callback.
+        """
+        return [dict(subscription.frames.get_statistics(), mod_id=subscription.mod_id,
+                     sub_ids=subscription.sub_ids)
+                for subscription in self if subscription.callback is None]
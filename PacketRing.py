@@ -0,0 +1,169 @@
+import ctypes
+import mmap
+import select
+import socket
+import struct
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V2 = 1
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+SO_ATTACH_FILTER = 26
+SO_TIMESTAMPNS = 35
+
+ETHER_HEADER_LEN = 14
+
+# struct tpacket2_hdr: status, len, snaplen, mac, net, sec, nsec, vlan_tci, vlan_tpid
+_TPACKET2_HDR = struct.Struct("IIIHHIIHH4x")
+_STATUS = struct.Struct("I")
+_TIMESPEC = struct.Struct("qq")
+
+def ether_filter(ether_type, src_mac=None):
+    """
+    Returns the classic BPF program of the pcap filter "ether proto <ether_type> and ether src
+    <src_mac>" as list of (code, jt, jf, k). Without src_mac only the Ethernet type is checked.
+    """
+    if src_mac is None:
+        return [
+            (0x28, 0, 0, 12),                               # ldh [12]
+            (0x15, 0, 1, ether_type),                       # jeq #ether_type, else drop
+            (0x06, 0, 0, 0x40000),                          # ret #262144
+            (0x06, 0, 0, 0),                                # ret #0
+        ]
+    mac = bytes.fromhex(src_mac.replace(":", ""))
+    return [
+        (0x28, 0, 0, 12),                                   # ldh [12]
+        (0x15, 0, 5, ether_type),                           # jeq #ether_type, else drop
+        (0x20, 0, 0, 8),                                    # ld [8]
+        (0x15, 0, 3, int.from_bytes(mac[2:6], "big")),      # jeq #src[2:6], else drop
+        (0x28, 0, 0, 6),                                    # ldh [6]
+        (0x15, 0, 1, int.from_bytes(mac[0:2], "big")),      # jeq #src[0:2], else drop
+        (0x06, 0, 0, 0x40000),                              # ret #262144
+        (0x06, 0, 0, 0),                                    # ret #0
+    ]
+
+def attach_filter(sock, program):
+    """
+    Attaches a classic BPF program to a socket, packets it rejects never leave the kernel.
+    """
+    code = ctypes.create_string_buffer(b"".join(struct.pack("HBBI", *instruction) for instruction in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack("HL", len(program), ctypes.addressof(code)))
+
+class PacketRing():
+    """
+    Receives the packets of one Ethernet type from one source MAC (or from any source if
+    src_mac is None) on a raw AF_PACKET socket.
+    The filter runs in the kernel. The packets are written by the kernel into a PACKET_RX_RING
+    that is mapped into our memory, so a wakeup hands over all packets received in the meantime
+    without a system call per packet. The payload is passed as memoryview of the ring.
+
+    If the ring cannot be set up (or ring is False) the packets are read from the socket, one
+    recv per packet but still without waking up for foreign packets.
+
+    With timestamps set the kernel receive time of the packet in ns is available in the
+    attribute timestamp during the callback. The ring always carries it, without the ring it
+    is read from the SO_TIMESTAMPNS control message.
+    """
+
+    def __init__(self, interface, ether_type, src_mac, ring=True, block_size=1 << 16, block_nr=16, frame_size=2048,
+                 timestamps=False):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        self.ring = None
+        self.timestamps = timestamps
+        self.timestamp = None
+        try:
+            # the filter is attached before binding to the protocol, so no foreign packet is queued
+            attach_filter(self.sock, ether_filter(ether_type, src_mac))
+            if ring:
+                try:
+                    self._setup_ring(block_size, block_nr, frame_size)
+                except OSError as e:
+                    print("Packet ring not available, receiving with recv: {}".format(e))
+            if timestamps and self.ring is None:
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            # the protocol of the address is given in host byte order
+            self.sock.bind((interface, ether_type))
+        except:
+            self.close()
+            raise
+
+        self.buffer = bytearray(0x10000)
+        self.poll = select.poll()
+        self.poll.register(self.sock, select.POLLIN | select.POLLERR)
+
+    def _setup_ring(self, block_size, block_nr, frame_size):
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+        self.frame_size = frame_size
+        self.frame_nr = block_size // frame_size * block_nr
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                             struct.pack("IIII", block_size, block_nr, frame_size, self.frame_nr))
+        self.ring = mmap.mmap(self.sock.fileno(), block_size * block_nr, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.view = memoryview(self.ring)
+        self.index = 0
+
+    def receive(self, callback, timeout, header=False):
+        """
+        Waits up to timeout seconds for packets and passes the Ethernet payload of every
+        received packet to the callback, with header set the packet including the Ethernet
+        header. The data is only valid during the callback. Returns the number of packets.
+        """
+        skip = 0 if header else ETHER_HEADER_LEN
+        if not self._ready() and not self.poll.poll(timeout * 1000):
+            return 0
+        if self.ring is None:
+            return self._receive_socket(callback, skip)
+
+        count = 0
+        view = self.view
+        while True:
+            offset = self.index * self.frame_size
+            status, length, snaplen, mac, net, sec, nsec, vlan_tci, vlan_tpid = _TPACKET2_HDR.unpack_from(view, offset)
+            if not status & TP_STATUS_USER:
+                return count
+            start = offset + mac + skip
+            if self.timestamps:
+                self.timestamp = sec * 1000000000 + nsec
+            callback(view[start:offset + mac + snaplen])
+            _STATUS.pack_into(view, offset, TP_STATUS_KERNEL)
+            self.index = (self.index + 1) % self.frame_nr
+            count += 1
+
+    def _ready(self):
+        if self.ring is None:
+            return False
+        return bool(_STATUS.unpack_from(self.view, self.index * self.frame_size)[0] & TP_STATUS_USER)
+
+    def _receive_socket(self, callback, skip):
+        # read everything that is queued without blocking
+        count = 0
+        with memoryview(self.buffer) as view:
+            while True:
+                try:
+                    if self.timestamps:
+                        length = self._recv_timestamp()
+                    else:
+                        length = self.sock.recv_into(self.buffer, 0, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    return count
+                callback(view[skip:length])
+                count += 1
+
+    def _recv_timestamp(self):
+        length, ancdata, flags, address = self.sock.recvmsg_into([self.buffer], socket.CMSG_SPACE(_TIMESPEC.size),
+                                                                 socket.MSG_DONTWAIT)
+        self.timestamp = None
+        for level, type, data in ancdata:
+            if level == socket.SOL_SOCKET and type == SO_TIMESTAMPNS:
+                sec, nsec = _TIMESPEC.unpack_from(data)
+                self.timestamp = sec * 1000000000 + nsec
+        return length
+
+    def close(self):
+        if self.ring is not None:
+            self.view.release()
+            self.ring.close()
+            self.ring = None
+        self.sock.close()
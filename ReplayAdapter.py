@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+
+from SUTAdapter import *
+from FramingAPIDef import *
+from FrameEncoder import frame_checksum
+from FrameRecorder import *
+
+class ReplayAdapter(SUTAdapter):
+    """
+    SUT adapter that plays back the received frames of a capture file written by the
+    FrameRecorder. The recorded frames sent by the host are used to keep the order: a received
+    frame is only handed out after the host sent all frames that were sent before it in the
+    recording. The request ID of a response is replaced by the request ID of the matching
+    frame the host sent, so the responses are routed to the new requests.
+
+    With paced set the received frames keep their recorded distance to the preceding frame of
+    the host, otherwise they are handed out as fast as possible. Of a capture file holding
+    several recordings the given session is played back, by default the last one.
+    """
+
+    NOTIFICATION_REQ_IDS = (0x00, 0xFF)
+
+    def __init__(self, path, paced=True, session=-1):
+        self.path = path
+        self.paced = paced
+        self.sut_interface = ""
+        self.condition = threading.Condition()
+
+        # received frames with the number of frames the host sent before them
+        self.records = deque()
+        self.expected = deque()
+        for timestamp, direction, data in read_capture(path, session):
+            if direction == RECORD_TX:
+                self.expected.append((timestamp, data))
+            else:
+                self.records.append((timestamp, len(self.expected), data))
+
+        self.sent = 0
+        self.unexpected = 0
+        self.skipped = 0
+        self.replayed = 0
+        self.request_ids = {}
+        self.anchor = (time.time(), self.records[0][0] if self.records else 0)
+
+    def start(self):
+        with self.condition:
+            self.anchor = (time.time(), self.anchor[1])
+
+    def stop(self):
+        pass
+
+    """
+    send data
+    """
+    def send(self, data):
+        """
+        Matches the frame with the next recorded frame of the host with the same module ID
+        and sub ID. Recorded frames the host did not send are skipped.
+        """
+        with self.condition:
+            for index, (timestamp, expected) in enumerate(self.expected):
+                if expected[1] == data[1] and expected[2] == data[2]:
+                    break
+            else:
+                self.unexpected += 1
+                return
+
+            for i in range(index + 1):
+                self.expected.popleft()
+            self.skipped += index
+            self.sent += index + 1
+            self.request_ids[expected[3]] = data[3]
+            self.anchor = (time.time(), timestamp)
+            self.condition.notify_all()
+
+    """
+    receive data
+    """
+    def receive(self):
+        return self.wait_for_frame(0)
+
+    def _release_time(self):
+        # returns the time the next frame is handed out or None if the host has to send first
+        timestamp, sent, data = self.records[0]
+        if sent > self.sent:
+            return None
+        if not self.paced:
+            return 0
+        return self.anchor[0] + max(timestamp - self.anchor[1], 0) / 1e9
+
+    """
+    block until a frame was received or the deadline has passed
+    """
+    def wait_for_frame(self, deadline):
+        with self.condition:
+            while True:
+                now = time.time()
+                release = self._release_time() if self.records else None
+                if release is not None and release <= now:
+                    return self._next_frame()
+                if now >= deadline:
+                    return None
+                self.condition.wait(min(deadline, release or deadline) - now)
+
+    def _next_frame(self):
+        timestamp, sent, data = self.records.popleft()
+        self.replayed += 1
+        req_id = data[3]
+        if req_id not in self.NOTIFICATION_REQ_IDS and req_id in self.request_ids:
+            data = bytearray(data)
+            data[3] = self.request_ids[req_id]
+            data[-2] = 0
+            data[-2] = frame_checksum(sum(data))
+            data = bytes(data)
+        return self.parse_frame(data)
+
+    """
+    returns true if data is available
+    """
+    def holding_data(self):
+        with self.condition:
+            if not self.records:
+                return False
+            release = self._release_time()
+            return release is not None and release <= time.time()
+
+    """
+    clearing queues
+    """
+    def clear_queues(self):
+        # the recording is not discarded, it is the input of the replay
+        pass
+
+    def finished(self):
+        """
+        Returns True if all received frames were played back.
+        """
+        return not self.records
+
+    def get_statistics(self):
+        """
+        Returns the number of replayed frames, the frames still to replay and the frames of the
+        host that were matched, skipped or not found in the recording.
+        """
+        with self.condition:
+            return {"replayed": self.replayed, "remaining": len(self.records), "sent": self.sent,
+                    "skipped": self.skipped, "unexpected": self.unexpected}
+
+# capture files prepared for a framing interface, by interface name
+_prepared = {}
+
+def prepare(name, path, paced=True, session=-1):
+    """
+    Prepares the replay of a capture file for the framing interface that is initialized with
+    the interface type "REPLAY" and the given name.
+    """
+    _prepared[name] = ReplayAdapter(path, paced, session)
+
+def connect(name):
+    """
+    Returns the adapter prepared for the given name. Without preparation the name is the path
+    of the capture file, which is replayed at the recorded pace.
+    """
+    adapter = _prepared.pop(name, None)
+    return adapter if adapter is not None else ReplayAdapter(name)
@@ -0,0 +1,87 @@
+import time
+
+class RequestIdAllocator():
+    """
+    Allocates the request IDs of the framing protocol. An ID is not handed out again as long as
+    a request with this ID is in flight. When a request times out its ID is kept back for the
+    quarantine period, so a late response cannot be mistaken for the response of a newer
+    request. The IDs 0x00 and 0xFF are never allocated because they are used by notifications
+    and status messages.
+    """
+
+    FIRST_ID = 0x01
+    LAST_ID = 0xFE
+
+    def __init__(self, timeout=5, quarantine=10):
+        self.timeout = timeout
+        self.quarantine = quarantine
+        self.last_id = 0
+        self.outstanding = {}
+        self.timed_out = {}
+        self.timed_out_count = 0
+        self.late_count = 0
+
+    def allocate(self, timeout=None):
+        """
+        Returns the next free request ID. The request is considered timed out if it is not
+        released within the timeout.
+        """
+        now = time.time()
+        for _ in range(self.LAST_ID - self.FIRST_ID + 1):
+            if self.last_id >= self.LAST_ID:
+                self.last_id = self.FIRST_ID
+            else:
+                self.last_id += 1
+            req_id = self.last_id
+
+            deadline = self.outstanding.get(req_id)
+            if deadline is not None:
+                if deadline > now:
+                    continue
+                self.expire(req_id, now)
+
+            quarantine_end = self.timed_out.get(req_id)
+            if quarantine_end is not None:
+                if quarantine_end > now:
+                    continue
+                del self.timed_out[req_id]
+
+            self.outstanding[req_id] = now + (self.timeout if timeout is None else timeout)
+            return req_id
+
+        raise AssertionError("No free request ID available")
+
+    def release(self, req_id):
+        """
+        Marks the request as completed after its response was received.
+        """
+        self.outstanding.pop(req_id, None)
+
+    def expire(self, req_id, now=None):
+        """
+        Marks the request as timed out. The ID is kept back for the quarantine period.
+        """
+        if self.outstanding.pop(req_id, None) is not None:
+            now = time.time() if now is None else now
+            self.timed_out[req_id] = now + self.quarantine
+            self.timed_out_count += 1
+
+    def is_late(self, req_id):
+        """
+        Checks a received response. Returns True if the response belongs to a request that
+        already timed out.
+        """
+        if req_id in self.timed_out:
+            self.late_count += 1
+            return True
+        return False
+
+    def get_statistics(self):
+        """
+        Returns the number of outstanding requests, timed out requests and late responses.
+        """
+        return {
+            "outstanding": len(self.outstanding),
+            "timed_out": self.timed_out_count,
+            "late": self.late_count,
+        }
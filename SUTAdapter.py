@@ -1,11 +1,105 @@
+import multiprocessing
+import queue
+import struct
+import threading
 from binascii import hexlify, unhexlify
 
 from FramingAPIDef import *
+from FrameEncoder import frame_checksum
+from SharedRingBuffer import SharedRingBuffer
+
+# Adapter modes: the receive loop runs in a separate process, in a thread or in a separate
+# process that hands over the frames through shared memory
+ADAPTER_MODES = ("process", "thread", "shm")
+
+# seconds to wait for the receive loop to open its device
+READY_TIMEOUT = 10
+
+# kernel timestamp in front of a frame in the shared memory ring, 0 if there is none
+_TIMESTAMP = struct.Struct("Q")
 
 class SUTAdapter:
     def __init__(self):
         pass
 
+    def initialize_queues(self, mode, transmit=True):
+        """
+        Creates the RX and TX queues. In process mode the receive loop runs in its own process
+        and the queues are proxies of a manager process. In thread mode the receive loop runs in
+        a thread and the queues are in-process queues, so no frame has to be pickled. In shm
+        mode the receive loop runs in its own process and the queues are shared memory ring
+        buffers holding the raw frames, which are parsed when they are taken out. Without
+        transmit the adapter sends itself and no TX queue is created.
+        """
+        if mode == "thread":
+            self.queue_rx = queue.SimpleQueue()
+            self.queue_tx = queue.SimpleQueue() if transmit else None
+            self.ready = threading.Event()
+        elif mode == "shm":
+            self.queue_rx = SharedRingBuffer(1 << 20, parse=self.parse_timestamped_frame)
+            self.queue_tx = SharedRingBuffer(1 << 16) if transmit else None
+            # written in front of every frame in the ring, reused for all frames
+            self.rx_prefix = bytearray(_TIMESTAMP.size)
+            self.ready = multiprocessing.Event()
+        elif mode == "process":
+            manager = multiprocessing.Manager()
+            self.queue_rx = manager.Queue()
+            self.queue_tx = manager.Queue() if transmit else None
+            self.ready = multiprocessing.Event()
+        else:
+            raise AssertionError("Invalid adapter mode \"{}\"".format(mode))
+        self.mode = mode
+        self.transmit = transmit
+        self.running = False
+
+    def start_worker(self, target):
+        """
+        Runs the receive loop in a process or thread depending on the adapter mode. The receive
+        loop calls set_ready() once its device is open.
+        """
+        # the rings are closed when the worker stops, a restarted worker needs new ones
+        if self.mode == "shm" and self.queue_rx.closed:
+            self.initialize_queues(self.mode, self.transmit)
+        self.running = True
+        self.ready.clear()
+        if self.mode == "thread":
+            worker = threading.Thread(target=target, daemon=True)
+        else:
+            worker = multiprocessing.Process(target=target)
+        worker.start()
+        return worker
+
+    def stop_worker(self, worker):
+        """
+        Stops the receive loop. A thread leaves its loop on its own, a process is terminated.
+        """
+        self.running = False
+        if worker is None:
+            return
+        if self.mode == "thread":
+            worker.join(1)
+        else:
+            worker.terminate()
+            worker.join(1)
+        if self.mode == "shm":
+            self.queue_rx.close()
+            if self.queue_tx is not None:
+                self.queue_tx.close()
+
+    def set_ready(self):
+        """
+        Signals that the receive loop opened its device and frames can be exchanged.
+        """
+        self.ready.set()
+
+    def wait_until_ready(self, timeout=READY_TIMEOUT):
+        """
+        Blocks until the receive loop is ready. Raises an AssertionError if it did not get ready
+        within the timeout.
+        """
+        if not self.ready.wait(timeout):
+            raise AssertionError("Receive loop on \"{}\" was not ready within {}s".format(self.sut_interface, timeout))
+
     def receive(self):
         pass
 
@@ -21,34 +115,76 @@ class SUTAdapter:
     def holding_data(self):
         pass
 
+    def wait_for_frame(self, deadline):
+        """
+        Blocks until a frame was received or the deadline (time.time() based) has passed.
+        Returns the frame or None.
+        """
+        pass
+
+    def decode_frames(self, data, timestamp=None):
+        """
+        Feeds received bytes into the frame decoder and puts every complete frame into the
+        RX queue. The kernel timestamp of the received data is passed on to the frames.
+        """
+        for raw in self.frame_decoder.feed(data):
+            if self.mode == "shm":
+                # the ring counts frames it has no space for, they are parsed by the consumer
+                _TIMESTAMP.pack_into(self.rx_prefix, 0, timestamp or 0)
+                try:
+                    self.queue_rx.put_nowait(raw, self.rx_prefix)
+                except queue.Full:
+                    pass
+            else:
+                frame = self.parse_frame(raw)
+                frame.timestamp = timestamp
+                self.queue_rx.put_nowait(frame)
+
+    def parse_frame(self, raw):
+        """
+        Parses a frame that was already checked by the frame decoder.
+        """
+        return self.pack_and_parse_frame(raw, nocrc=True)
+
+    def parse_timestamped_frame(self, record):
+        """
+        Parses a frame taken out of the shared memory ring together with its kernel timestamp.
+        """
+        frame = self.parse_frame(memoryview(record)[_TIMESTAMP.size:])
+        frame.timestamp = _TIMESTAMP.unpack_from(record)[0] or None
+        return frame
+
+    def get_tx_timestamp(self, req_id):
+        """
+        Returns the time in ns the kernel sent the last frame with the given request ID, or
+        None if the adapter does not provide kernel timestamps.
+        """
+        return None
+
+    def get_decoder_statistics(self):
+        """
+        Returns the counters of the frame decoder.
+        """
+        return self.frame_decoder.get_statistics()
+
 
     def get_module_name_by_id(self, id):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_details[0] == id:
-                return module_name
+        return get_module_name_by_id(id)
 
     def get_module_id_by_name(self, name):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_name == name:
-                return module_details[0]
+        return get_module_id_by_name(name)
 
     def get_sub_name_by_id(self, module_id, sub_id):
-        for module_name, module_details in MODULE_IDS.items():
-            if module_details[0] == module_id:
-                return module_details[1][sub_id][0] if sub_id in module_details[1].keys() else "None"
+        return get_sub_name_by_id(module_id, sub_id)
 
     def get_sub_id_by_name(self, module_name, sub_name):
-        for s_name, s_id in MODULE_IDS[module_name][1]:
-            if sub_name == s_name:
-                return s_id
+        return get_sub_id_by_name(module_name, sub_name)
 
     def printable_frame(self, frame):
         prettystring = "\n###### FRAME ######"
-        for key in frame.__dict__.keys():
-            if key[0] == "_":
-                continue
+        for key in Frame.FIELDS:
             prettystring += "\n| " + key + ": " + \
-                str(frame.__dict__[key]) + "\t\t\t"
+                str(getattr(frame, key)) + "\t\t\t"
 
         return prettystring + "\n"
 
@@ -65,23 +201,10 @@ class SUTAdapter:
         return sum.to_bytes(1, byteorder="big", signed=False)
 
     def pack_and_parse_frame(self, binary_string, nocrc=False):
-        frame = Frame()
-        frame.mod_id = binary_string[1]
-        frame.mod_name = self.get_module_name_by_id(binary_string[1])
-        frame.sub_id = binary_string[2]
-        frame.sub_name = self.get_sub_name_by_id(
-            binary_string[1], binary_string[2])
-        frame.req_id = binary_string[3]
-        frame.payload_len = int.from_bytes(binary_string[4:6], 'big')
-        frame.payload = binary_string[6:5+frame.payload_len+1]
-        frame.crc = binary_string[-2]
-        hex_byte_string = str(hexlify(binary_string))
-        frame.raw_hex = "_".join(
-            hex_byte_string[i:i+2] for i in range(2, len(hex_byte_string) - 1, 2))
+        frame = Frame(binary_string)
 
         # check for correct checksum
-        if not nocrc and self.compute_payload_checksum(binary_string[:-2] + b"\x00"
-                                                       + binary_string[-1:]) != frame.crc.to_bytes(1, "big") and frame.crc != 0:
+        if not nocrc and frame.crc != 0 and frame_checksum(sum(binary_string) - frame.crc) != frame.crc:
             raise AssertionError(
                 "CRC of received frame not correct!\n" + frame.raw_hex)
 
@@ -89,7 +212,4 @@ class SUTAdapter:
         if frame.mod_name == "error":
             print("Warning: Binuart \"Error\" frame responded")
 
-        # '-'.join(hex_byte_string[i:i+2] for i in range(0, len(hex_byte_string) , 2))
         return frame
-
-
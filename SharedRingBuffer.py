@@ -0,0 +1,169 @@
+import multiprocessing
+import queue
+import struct
+from multiprocessing import shared_memory
+
+_INDEX = struct.Struct("Q")
+_LENGTH = struct.Struct("I")
+
+class SharedRingBuffer():
+    """
+    Single-producer/single-consumer ring buffer in shared memory. It is used like a queue
+    between the receive process of an adapter and the framing interface. The producer copies
+    the raw frames into the ring, the consumer copies them out again and parses them lazily,
+    so no frame is pickled and no manager process is involved.
+
+    The header holds the write index (head), the dropped counter and the read index (tail).
+    Both indices only grow, the position in the ring is the index modulo the size. Only the
+    producer writes the head and only the consumer writes the tail. A record is a 4 byte
+    length followed by the data padded to 4 bytes and may wrap around the end of the ring.
+
+    Python has no memory barriers, so the indices are published through the semaphores of
+    multiprocessing, whose operations order the memory accesses on every architecture:
+    the producer releases the available semaphore once per record after writing it, and the
+    consumer only reads a record it acquired from the semaphore. A waiting consumer sleeps in
+    the semaphore and is woken by the next record. The consumer writes the tail under the
+    tail lock after it copied the record out, the producer takes the lock to read the tail
+    when the space it knows of does not suffice.
+    """
+
+    HEAD_OFFSET = 0
+    DROPPED_OFFSET = 8
+    TAIL_OFFSET = 64
+    HEADER_SIZE = 128
+
+    def __init__(self, size=1 << 20, parse=None):
+        if size < 64 or size & (size - 1):
+            raise AssertionError("Size of the ring buffer must be a power of two")
+        self.size = size
+        self.mask = size - 1
+        self.parse = parse
+        self.creator = True
+        self.available = multiprocessing.Semaphore(0)
+        self.tail_lock = multiprocessing.Lock()
+        self._attach(shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + size))
+
+    def _attach(self, shm):
+        self.shm = shm
+        self.buf = shm.buf
+        self.data = shm.buf[self.HEADER_SIZE:self.HEADER_SIZE + self.size]
+        self.closed = False
+        # tail as last read by the producer, the space up to it is free
+        self.known_tail = 0
+
+    # the shared memory is attached by name when the ring is passed to a spawned process
+    def __getstate__(self):
+        return {"name": self.shm.name, "size": self.size, "parse": self.parse,
+                "available": self.available, "tail_lock": self.tail_lock}
+
+    def __setstate__(self, state):
+        self.size = state["size"]
+        self.mask = self.size - 1
+        self.parse = state["parse"]
+        self.available = state["available"]
+        self.tail_lock = state["tail_lock"]
+        self.creator = False
+        self._attach(shared_memory.SharedMemory(name=state["name"]))
+
+    def _index(self, offset):
+        return _INDEX.unpack_from(self.buf, offset)[0]
+
+    def _write(self, start, data):
+        # copies the data to the position in the ring and returns the position after it
+        length = len(data)
+        if start + length <= self.size:
+            self.data[start:start + length] = data
+        else:
+            first = self.size - start
+            with memoryview(data) as view:
+                self.data[start:] = view[:first]
+                self.data[:length - first] = view[first:]
+        return (start + length) & self.mask
+
+    def put_nowait(self, record, prefix=None):
+        """
+        Copies a record into the ring. A prefix is copied in front of the record, so both form
+        one record without being concatenated first. Raises queue.Full and counts the record
+        as dropped if there is not enough space.
+        """
+        length = len(record) if prefix is None else len(prefix) + len(record)
+        needed = 4 + ((length + 3) & ~3)
+        head = _INDEX.unpack_from(self.buf, self.HEAD_OFFSET)[0]
+        if needed > self.size - (head - self.known_tail):
+            with self.tail_lock:
+                self.known_tail = _INDEX.unpack_from(self.buf, self.TAIL_OFFSET)[0]
+            if needed > self.size - (head - self.known_tail):
+                _INDEX.pack_into(self.buf, self.DROPPED_OFFSET, self._index(self.DROPPED_OFFSET) + 1)
+                raise queue.Full
+
+        data = self.data
+        pos = head & self.mask
+        _LENGTH.pack_into(data, pos, length)
+        start = (pos + 4) & self.mask
+        if start + length <= self.size:
+            # the record does not wrap around
+            if prefix is not None:
+                end = start + len(prefix)
+                data[start:end] = prefix
+                start = end
+            data[start:start + len(record)] = record
+        else:
+            if prefix is not None:
+                start = self._write(start, prefix)
+            self._write(start, record)
+
+        _INDEX.pack_into(self.buf, self.HEAD_OFFSET, head + needed)
+        self.available.release()
+
+    def get_nowait(self):
+        """
+        Removes the oldest record from the ring. Raises queue.Empty if the ring is empty.
+        """
+        return self.get(False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes the oldest record from the ring. While the ring is empty the consumer sleeps
+        until the producer writes the next record or the timeout has passed. Raises
+        queue.Empty if no record is available.
+        """
+        if not self.available.acquire(block, timeout):
+            raise queue.Empty
+
+        tail = _INDEX.unpack_from(self.buf, self.TAIL_OFFSET)[0]
+        pos = tail & self.mask
+        length = _LENGTH.unpack_from(self.data, pos)[0]
+        start = (pos + 4) & self.mask
+        if start + length <= self.size:
+            record = self.data[start:start + length].tobytes()
+        else:
+            record = self.data[start:].tobytes() + self.data[:start + length - self.size].tobytes()
+
+        with self.tail_lock:
+            _INDEX.pack_into(self.buf, self.TAIL_OFFSET, tail + 4 + ((length + 3) & ~3))
+        return self.parse(record) if self.parse is not None else record
+
+    def empty(self):
+        return self._index(self.TAIL_OFFSET) == self._index(self.HEAD_OFFSET)
+
+    def used(self):
+        return self._index(self.HEAD_OFFSET) - self._index(self.TAIL_OFFSET)
+
+    def get_statistics(self):
+        """
+        Returns the size of the ring, the used bytes and the number of dropped records.
+        """
+        return {"size": self.size, "used": self.used(), "dropped": self._index(self.DROPPED_OFFSET)}
+
+    def close(self):
+        """
+        Detaches from the shared memory. The creator also removes it.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.data.release()
+        self.buf = None
+        self.shm.close()
+        if self.creator:
+            self.shm.unlink()
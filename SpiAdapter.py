@@ -9,15 +9,23 @@
 *
 """
 import multiprocessing
+import threading
 import time
 import sys
-import spidev
-import RPi.GPIO as GPIO
 import re
+import queue
 
+# spidev is only needed on the Raspberry Pi
+try:
+    import spidev
+except ImportError:
+    spidev = None
 
 from SUTAdapter import *
 from FramingAPIDef import *
+from FrameDecoder import FrameDecoder
+from GpioHal import RpiGpioHal
+from SpiTransferEngine import SpiTransferEngine
 
 #def log(x): return print(x)
 def log(x): return
@@ -25,31 +33,56 @@ def log(x): return
 def packet_dump(x): return
 def debug_log(x): pass
 
+# seconds the transfer loop sleeps without an edge before it checks the GPIOs again, in case
+# an edge was missed
+IDLE_TIMEOUT = 0.1
+
+# seconds to wait for RX ready before the data transfer
+RX_READY_TIMEOUT = 1
+
+# the size header of the slave limits the frames of one transfer
+MAX_PAYLOAD_LEN = 255 * 255 + 255 - 8
+
 class SpiAdapter(SUTAdapter):
-    def __init__(self):
+    def __init__(self, mode="process", gpio=None, spi=None, hardware_cs=False):
+        """
+        The GPIOs are accessed through the given GpioHal, by default the GPIOs of the
+        Raspberry Pi. A GpioHal that is thread_only like the FakeGpioHal requires the thread
+        mode. The SPI device is a spidev.SpiDev opened on start unless a device like the
+        FakeSpiDev is given. With hardware_cs the chip select of the SPI device is used
+        instead of the GPIO gpioAltCS.
+        """
         log("SpiAdapter->__init__()")
+        if mode != "thread" and getattr(gpio, "thread_only", False):
+            raise AssertionError("{} is only usable in the thread mode of the SPI adapter".format(type(gpio).__name__))
         self.started = False
         self.spiadapter_process = None
-        self.queue_rx = multiprocessing.Manager().Queue()
-        self.queue_tx = multiprocessing.Manager().Queue()
+        self.initialize_queues(mode)
+        # set by edges of RX ready and TX pending and by frames put into the TX queue
+        self.wakeup = threading.Event() if mode == "thread" else multiprocessing.Event()
 
         self.sut_interface = ""
         self.packet = None
-        self.spi = None
+        self.spi = spi
+        self.hardware_cs = hardware_cs
+        self.engine = None
+        # transfers, bytes and ns in the SPI device, shared with the transfer process
+        self.transfer_counters = [0, 0, 0] if mode == "thread" else multiprocessing.Array("Q", 3, lock=False)
         self.gpioRxReady = 22
         self.gpioTxPending = 27
         self.gpioAltCS = 24
         self.DefectPacket = 0
         self.PacketCount = 0
+        self.frame_decoder = FrameDecoder(MAX_PAYLOAD_LEN)
+        self.gpio = gpio if gpio is not None else RpiGpioHal()
         
         # Prepare GPIOS for Rx Ready and Tx Pending detection
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.gpioRxReady, GPIO.IN)
-        GPIO.setup(self.gpioTxPending, GPIO.IN)
+        self.gpio.setup_input(self.gpioRxReady)
+        self.gpio.setup_input(self.gpioTxPending)
         
         # Optional CS (needed due to problems with default CS)
-        GPIO.setup(self.gpioAltCS, GPIO.OUT, initial=GPIO.HIGH)
+        if not self.hardware_cs:
+            self.gpio.setup_output(self.gpioAltCS, True)
 
     """
     send data
@@ -57,6 +90,7 @@ class SpiAdapter(SUTAdapter):
     def send(self, data):
         log("SpiAdapter->send()")
         self.queue_tx.put_nowait(data)
+        self.wakeup.set()
         packet_dump(bytes(data).hex())
 
     """
@@ -64,114 +98,108 @@ class SpiAdapter(SUTAdapter):
     """
     def receive(self):
         log("SpiAdapter->receive()")
-        if not self.queue_rx.empty():
-            frame = self.queue_rx.get_nowait()
-            return frame
-        else:
+        try:
+            return self.queue_rx.get_nowait()
+        except queue.Empty:
             return None
-        return None
 
     """
     packet callback for our custom ethernet type
     """
     def pkt_callback(self, packet):
         log("SpiAdapter->pkt_callback()")
-        payload = packet[4:]
-
-        # check for input on uart
-        marker = payload[0]
-
-        # if nothing there, return to receive control
-        if not marker or marker != START_OF_FRAME:
-            return None
-
-        pheader = payload[1:6]
-        pbytes = int.from_bytes(pheader[3:5], 'big')
-
-        pbytedata = 2
-        if pbytes > 0:
-            pbytedata = payload[6:6+pbytes]
-
-        if not pbytedata:
-            print("Had to cancel data reception mid frame")
-            return None
-
-        pdata = (pheader + pbytedata) if pbytes > 0 else pheader
-        pbytes += 5
-
-        crc = int.from_bytes(payload[pbytes+1:pbytes+2], "big")
-        marker = int.from_bytes(payload[pbytes+2:pbytes+3], "big")
-
-        if marker == END_OF_FRAME:
-            frame = self.pack_and_parse_frame(
-                b"\xc0" + pdata + crc.to_bytes(1, "big") + b"\xc1")
+        self.decode_frames(packet[4:])
 
-            self.queue_rx.put_nowait(frame)
-        else:
-            print("Could not catch end of frame")
-            print(str(payload))
+    """
+    wait until the input has the given level
+    """
+    def wait_for_input(self, pin, level, timeout):
+        end_time = time.time() + timeout
+        while True:
+            # cleared before the input is read, an edge afterwards is not lost
+            self.wakeup.clear()
+            if self.gpio.input(pin) == level:
+                return True
+            remaining = end_time - time.time()
+            if remaining <= 0 or not self.running:
+                return False
+            self.wakeup.wait(remaining)
 
     """
     filter packets with custom ethernet type
     """
     def process_spi_transfers(self):
-        while 1:
-            # check if slave is ready for receiving frames
-            if GPIO.input(self.gpioRxReady) == 1:
-                # check if TX data is available or TX pending is set
-                if not self.queue_tx.empty() or GPIO.input(self.gpioTxPending) == 1:
-                    log("SpiAdapter->process_spi_transfers()")
-                    spi_slave_trans_size = 0
-                    spi_master_trans_size = 0
-                    TxFrame = None
-
-                    # Read out frame from TX queue
-                    if not self.queue_tx.empty():
-                        TxFrame = self.queue_tx.get_nowait()
-                        spi_master_trans_size = len(TxFrame)
-                   
-                    # Create and send SPI size header
-                    Transfer = self.__AddSizeHeader(spi_master_trans_size)
-                    packet_dump(bytes(Transfer).hex())
-                    reply = self.__TransferData(Transfer)
+        # the edges are detected in the process running the transfer loop
+        self.gpio.add_edge_callback(self.gpioRxReady, self.wakeup.set)
+        self.gpio.add_edge_callback(self.gpioTxPending, self.wakeup.set)
+        try:
+            # the SPI device was opened before the transfer loop was started
+            self.set_ready()
+            while self.running:
+                self.wakeup.clear()
+                if not self.transfer_pending():
+                    # sleep until an edge or a frame to send wakes us up
+                    self.wakeup.wait(IDLE_TIMEOUT)
+        finally:
+            self.gpio.remove_edge_callback(self.gpioRxReady)
+            self.gpio.remove_edge_callback(self.gpioTxPending)
+
+    """
+    run a transfer if the slave is ready and one of both sides has data, returns True if a
+    transfer was run
+    """
+    def transfer_pending(self):
+        # check if slave is ready for receiving frames
+        if self.gpio.input(self.gpioRxReady) == 1:
+            # check if TX data is available or TX pending is set
+            if not self.queue_tx.empty() or self.gpio.input(self.gpioTxPending) == 1:
+                log("SpiAdapter->process_spi_transfers()")
+                spi_slave_trans_size = 0
+                spi_master_trans_size = 0
+                TxFrame = None
+
+                # Read out frame from TX queue
+                try:
+                    TxFrame = self.queue_tx.get_nowait()
+                    spi_master_trans_size = len(TxFrame)
+                except queue.Empty:
+                    pass
+               
+                # Create and send SPI size header
+                reply = self.engine.transfer(b"\xAA\xAA", spi_master_trans_size.to_bytes(2, "big"))
+                packet_dump(bytes(reply).hex())
+
+                # check if valid data was received from SLAVE
+                if reply[0] == 0xAA and reply[1] == 0xAA:
+                    # calculate rx data size from slave
+                    spi_slave_trans_size = reply[2] * 255 + reply[3]
+
+                    # start SPI transfer
+                    if not self.wait_for_input(self.gpioRxReady, 1, RX_READY_TIMEOUT):
+                        print("Warning: Slave not ready for the data-frame!")
+                        return True
+
+                    # the data is padded with zeros if SPI slave wants to send more data than master,
+                    # the reply is only read if the slave sends data
+                    reply = self.engine.transfer(b"\x55\x55\x00\x00", TxFrame, spi_slave_trans_size,
+                                                 read=spi_slave_trans_size > 0)
+                    if reply is None:
+                        return True
                     packet_dump(bytes(reply).hex())
 
-                    # check if valid data was received from SLAVE
-                    if reply[0] == 0xAA and reply[1] == 0xAA:
-                        count = 0
-                        next_transfer_data = self.__GenerateDataFrame(TxFrame)
-                        # calculate rx data size from slave
-                        spi_slave_trans_size = reply[2] * 255 + reply[3]
-                    
-                        # append data to data for next SPI transfer if SPI slave wants to send more data than master
-                        if spi_slave_trans_size > spi_master_trans_size:
-                            count = spi_slave_trans_size - spi_master_trans_size
-                            
-                        while count > 0:
-                            next_transfer_data.append(0x00)
-                            count -= 1
-
-                        # start SPI transfer
-                        packet_dump(bytes(next_transfer_data).hex())
-                        while 1:
-                            if GPIO.input(self.gpioRxReady) == 1:
-                                break;
-
-                        reply = self.__TransferData(next_transfer_data)
-                        reply = bytearray(reply)
-                        packet_dump(bytes(reply).hex())
-
-                        if len(reply) > 4:
-                            if reply[0] == 0x55 and reply[1] == 0x55 and reply[2] == 0x00 and reply[3] == 0x00:
-                                self.pkt_callback(reply)
-                            else:
-                                print("Warning: Received invalid data-frame header!")
-                                print (reply)
+                    if len(reply) > 4:
+                        if reply[0] == 0x55 and reply[1] == 0x55 and reply[2] == 0x00 and reply[3] == 0x00:
+                            self.pkt_callback(reply)
                         else:
-                            print("Warning: Too few data received!")
+                            print("Warning: Received invalid data-frame header!")
+                            print(bytes(reply))
                     else:
-                        print("Warning: Received invalid size-frame header!")
-                        print(reply)
+                        print("Warning: Too few data received!")
+                else:
+                    print("Warning: Received invalid size-frame header!")
+                    print(bytes(reply))
+                return True
+        return False
 
     """
     start process waiting for mac frames of specific ethernet type
@@ -184,31 +212,50 @@ class SpiAdapter(SUTAdapter):
         device = int(temp.group(2))
         
         # start SPI device
-        self.spi = spidev.SpiDev()
+        if self.spi is None:
+            if spidev is None:
+                raise ImportError("spidev is needed for the SPI interface")
+            self.spi = spidev.SpiDev()
         self.spi.open(bus, device)
         self.spi.max_speed_hz = 12000000
         self.spi.mode = 0b00
+        self.engine = SpiTransferEngine(self.spi, gpio=self.gpio, cs_pin=None if self.hardware_cs else self.gpioAltCS,
+                                        counters=self.transfer_counters)
         
         print ("Start SPI on bus " + str(bus) + " device " + str(device) + " with " + str(self.spi.max_speed_hz) + " MHz")
         
         # initialize and start SPI transfer process
-        self.spiadapter_process = multiprocessing.Process(target=self.process_spi_transfers)
-        self.spiadapter_process.start()
+        self.spiadapter_process = self.start_worker(self.process_spi_transfers)
 
         self.started = True
 
-        """
-        sleep - letting sniffing process initialize
-        """
-        time.sleep(1)
+        try:
+            self.wait_until_ready()
+        except AssertionError:
+            self.stop()
+            raise
 
     """
     stop listening for specific ethernet type
     """
     def stop(self):
         log("SpiAdapter->stop()")
-        self.spiadapter_process.terminate()
-        time.sleep(1)
+        # wake up the transfer loop, it leaves without waiting for the idle timeout
+        self.running = False
+        self.wakeup.set()
+        self.stop_worker(self.spiadapter_process)
+
+    """
+    block until a frame was received or the deadline has passed
+    """
+    def wait_for_frame(self, deadline):
+        timeout = deadline - time.time()
+        try:
+            if timeout <= 0:
+                return self.queue_rx.get_nowait()
+            return self.queue_rx.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
     """
     returns true if data is available
@@ -224,29 +271,9 @@ class SpiAdapter(SUTAdapter):
         while not self.queue_rx.empty():
             msg = self.queue_rx.get_nowait()
 
-    def __AddSizeHeader(self, size):
-        log("SpiAdapter->__AddSizeHeader()")
-        data = b"\xAA\xAA"
-        data += size.to_bytes(2, "big")
-        return data
-
-    def __TransferData(self, txData):
-        #log("SpiAdapter->__TransferData()")
-        GPIO.output(self.gpioAltCS, False)
-        #time.sleep(0.00002)
-        #self.PacketCount += 1
-        end_time_toggle = time.time_ns() + 10 * 1000
-        while time.time_ns() < end_time_toggle:
-            continue
-        
-        #if (self.PacketCount == self.DefectPacket):
-        #    txData = txData[:3]
-        reply = self.spi.xfer(txData)
-        GPIO.output(self.gpioAltCS, True)
-        return reply
-
-    def __GenerateDataFrame(self, data):
-        frame = bytearray(b"\x55\x55\x00\x00")
-        if data != None:
-            frame += bytearray(data)
-        return frame
\ No newline at end of file
+    def get_transfer_statistics(self):
+        """
+        Returns the number of SPI transfers, the transferred bytes and the throughput in bytes/s
+        while the SPI device was busy.
+        """
+        return self.engine.get_statistics() if self.engine is not None else None
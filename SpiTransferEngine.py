@@ -0,0 +1,136 @@
+import time
+
+# size header or data header and the largest frame of the framing protocol
+MAX_TRANSFER_SIZE = 4 + 8 + 0xFFFF
+
+# transfers up to this size are run with xfer on a list like before the engine, copying them
+# into the buffers costs more than building the list
+SMALL_TRANSFER_SIZE = 64
+
+# largest transfer of one ioctl if the parameter of the spidev driver cannot be read
+DEFAULT_BUFSIZ = 4096
+BUFSIZ_PATH = "/sys/module/spidev/parameters/bufsiz"
+
+def read_bufsiz(path=BUFSIZ_PATH):
+    """
+    Returns the largest transfer the spidev driver accepts in one ioctl.
+    """
+    try:
+        with open(path) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return DEFAULT_BUFSIZ
+
+class SpiTransferEngine():
+    """
+    Runs the SPI transfers of the SPI adapter. The data to send is copied into a buffer that
+    is allocated once for the largest frame and padded with zeros by a slice assignment. The
+    reply is copied into a second buffer and returned as memoryview of it, which is only
+    valid until the next transfer. Small transfers like the size header are run with xfer on a
+    list, which spidev converts fastest, and their reply is returned as bytes.
+
+    Other transfers up to bufsiz bytes are run with xfer2, larger ones with xfer3, which splits
+    them into several ioctls but keeps the chip select active in between. If the reply is not needed
+    the data is only written with writebytes2. writebytes2 releases the chip select between its
+    ioctls, so with the hardware chip select it is only used up to bufsiz bytes.
+
+    With a cs_pin the chip select is a GPIO driven through the GpioHal. The data is copied
+    into the buffer while the setup time of the chip select runs. Without cs_pin the hardware
+    chip select of the SPI device is used.
+
+    The number of transfers, the transferred bytes and the time spent in the SPI device are
+    counted in counters, which may be a shared array for reading them from another process.
+    """
+
+    def __init__(self, spi, max_size=MAX_TRANSFER_SIZE, gpio=None, cs_pin=None, cs_setup_ns=10000, counters=None):
+        self.spi = spi
+        self.gpio = gpio
+        self.cs_pin = cs_pin
+        self.cs_setup_ns = cs_setup_ns
+        self.tx_buffer = bytearray(max_size)
+        self.rx_buffer = bytearray(max_size)
+        self.tx_view = memoryview(self.tx_buffer)
+        self.rx_view = memoryview(self.rx_buffer)
+        self.zeros = memoryview(bytes(max_size))
+        self.bufsiz = getattr(spi, "bufsiz", None) or read_bufsiz()
+        self.has_xfer3 = hasattr(spi, "xfer3")
+        self.has_writebytes2 = hasattr(spi, "writebytes2")
+        # transfers, bytes, ns in the SPI device
+        self.counters = counters if counters is not None else [0, 0, 0]
+
+    def transfer(self, header, data=None, length=0, read=True):
+        """
+        Transfers the header followed by the data, padded with zeros to length bytes. Returns
+        the reply of the same size, as memoryview or as bytes for a small transfer, or None if
+        read is False.
+        """
+        data_len = len(data) if data is not None else 0
+        start = len(header)
+        size = start + max(length, data_len)
+        if size > len(self.tx_buffer):
+            raise AssertionError("SPI transfer of {} bytes exceeds the buffer of {} bytes".format(size, len(self.tx_buffer)))
+
+        if self.cs_pin is not None:
+            self.gpio.output(self.cs_pin, False)
+            selected = time.perf_counter_ns()
+
+        padding = size - start - data_len
+        small = size <= SMALL_TRANSFER_SIZE
+        if small:
+            values = list(header)
+            if data_len:
+                values.extend(data)
+            if padding:
+                values.extend(self.zeros[:padding])
+        else:
+            buffer = self.tx_buffer
+            buffer[:start] = header
+            if data_len:
+                buffer[start:start + data_len] = data
+            if padding:
+                buffer[start + data_len:size] = self.zeros[:padding]
+            values = self.tx_view[:size]
+
+        if self.cs_pin is not None:
+            # the rest of the setup time of the chip select
+            end = selected + self.cs_setup_ns
+            while time.perf_counter_ns() < end:
+                pass
+
+        begin = time.perf_counter_ns()
+        try:
+            if not read and self.has_writebytes2 and (size <= self.bufsiz or self.cs_pin is not None):
+                self.spi.writebytes2(values)
+                reply = None
+            elif small:
+                reply = self.spi.xfer(values)
+            elif size > self.bufsiz and self.has_xfer3:
+                reply = self.spi.xfer3(values)
+            else:
+                reply = self.spi.xfer2(values)
+        finally:
+            duration = time.perf_counter_ns() - begin
+            if self.cs_pin is not None:
+                self.gpio.output(self.cs_pin, True)
+            if not small:
+                values.release()
+
+        counters = self.counters
+        counters[0] += 1
+        counters[1] += size
+        counters[2] += duration
+        if not read:
+            return None
+        if small:
+            return bytes(reply)
+        self.rx_buffer[:size] = reply
+        return self.rx_view[:size]
+
+    def get_statistics(self):
+        """
+        Returns the number of transfers, the transferred bytes and the throughput in bytes/s
+        while the SPI device was busy.
+        """
+        transfers, size, duration = self.counters[:3]
+        return {"transfers": transfers, "bytes": size,
+                "bytes_per_second": size / duration * 1e9 if duration else None}
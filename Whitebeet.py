@@ -3,113 +3,32 @@ from encodings import utf_8
 from multiprocessing import Value
 import time
 import struct
+from collections import deque
+from contextlib import contextmanager
 from Logger import *
 from FramingInterface import *
 
 class Whitebeet():
 
-    def __init__(self, iftype, iface, mac):
-        self.logger = Logger()
-
-        self.connectionError = False
-        self.payloadBytes = bytes()
-        self.payloadBytesRead = 0
-        self.payloadBytesLen = 0
+    # Notification IDs of the V2G module
+    v2g_evse_notification_ids = (0x80, 0x81, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+                                 0x8A, 0x8B, 0x8C, 0x8E, 0x8F, 0x90, 0x91)
+    v2g_ev_notification_ids = (0xC0, 0xC1, 0xC2, 0xC3, 0xC4, 0xC5, 0xC6, 0xC7, 0xC8, 0xC9,
+                               0xCA, 0xCB, 0xCC, 0xCD)
 
-        # System sub IDs
-        self.sys_mod_id = 0x10
-        self.sys_sub_get_firmware_version = 0x41
+    # number of request timings that are kept
+    request_timings = 1000
 
-        # Network configuration IDs
-        self.netconf_sub_id = 0x05
-        self.netconf_set_port_mirror_state = 0x55
-
-        # SLAC module IDs
-        self.slac_mod_id = 0x28
-        self.slac_sub_start = 0x42
-        self.slac_sub_stop = 0x43
-        self.slac_sub_match = 0x44
-        self.slac_sub_start_match = 0x44
-        self.slac_sub_set_validation_configuration = 0x4B
-        self.slac_sub_join = 0x4D
-        self.slac_sub_success = 0x80
-        self.slac_sub_failed = 0x81
-        self.slac_sub_join_status = 0x84
-
-        # CP module IDs
-        self.cp_mod_id = 0x29
-        self.cp_sub_set_mode = 0x40
-        self.cp_sub_get_mode = 0x41
-        self.cp_sub_start = 0x42
-        self.cp_sub_stop = 0x43
-        self.cp_sub_set_dc = 0x44
-        self.cp_sub_get_dc = 0x45
-        self.cp_sub_set_res = 0x46
-        self.cp_sub_get_res = 0x47
-        self.cp_sub_get_state = 0x48
-        self.cp_sub_nc_state = 0x81
-
-        # V2G module IDs
-        self.v2g_mod_id = 0x27
-        self.v2g_sub_set_mode = 0x40
-        self.v2g_sub_get_mode = 0x41
-        self.v2g_sub_start = 0x42
-        self.v2g_sub_stop = 0x43
-
-        # EV sub IDs
-        self.v2g_sub_ev_set_configuration = 0xA0
-        self.v2g_sub_ev_get_configuration = 0xA1
-        self.v2g_sub_ev_set_dc_charging_parameters = 0xA2
-        self.v2g_sub_ev_update_dc_charging_parameters = 0xA3
-        self.v2g_sub_ev_get_dc_charging_parameters = 0xA4
-        self.v2g_sub_ev_set_ac_charging_parameters = 0xA5
-        self.v2g_sub_ev_update_ac_charging_parameters = 0xA6
-        self.v2g_sub_ev_get_ac_charging_parameters = 0xA7
-        self.v2g_sub_ev_set_charging_profile = 0xA8
-        self.v2g_sub_ev_start_session = 0xA9
-        self.v2g_sub_ev_start_cable_check = 0xAA
-        self.v2g_sub_ev_start_pre_charging = 0xAB
-        self.v2g_sub_ev_start_charging = 0xAC
-        self.v2g_sub_ev_stop_charging = 0xAD
-        self.v2g_sub_ev_stop_session = 0xAE
-       
-
-        # EVSE sub IDs
-        self.v2g_sub_evse_set_configuration = 0x60
-        self.v2g_sub_evse_get_configuration = 0x61
-        self.v2g_sub_evse_set_dc_charging_parameters = 0x62
-        self.v2g_sub_evse_update_dc_charging_parameters = 0x63
-        self.v2g_sub_evse_get_dc_charging_parameters = 0x64
-        self.v2g_sub_evse_set_ac_charging_parameters = 0x65
-        self.v2g_sub_evse_update_ac_charging_parameters = 0x66
-        self.v2g_sub_evse_get_ac_charging_parameters = 0x67
-        self.v2g_sub_evse_set_sdp_config = 0x68
-        self.v2g_sub_evse_get_sdp_config = 0x69
-        self.v2g_sub_evse_start_listen = 0x6A
-        self.v2g_sub_evse_set_authorization_status = 0x6B
-        self.v2g_sub_evse_set_schedules = 0x6C
-        self.v2g_sub_evse_set_cable_check_finished = 0x6D
-        self.v2g_sub_evse_start_charging = 0x6E
-        self.v2g_sub_evse_stop_charging = 0x6F
-        self.v2g_sub_evse_stop_listen = 0x70
-        self.v2g_sub_evse_set_cable_certificate_installation_and_update_response = 0x73
-        self.v2g_sub_evse_set_meter_receipt = 0x74
-        self.v2g_sub_evse_send_notification = 0x75
-        self.v2g_sub_evse_set_session_parameter_timeout = 0x76
+    def __init__(self, iftype, iface, mac, txCoalescingUs=None, adapterMode="process", recordPath=None,
+                 kernelTimestamps=False, spiGpio=None, spiDevice=None, hardwareCs=False):
+        self._initializeAttributes(txCoalescingUs, adapterMode, recordPath, kernelTimestamps, spiGpio,
+                                   spiDevice, hardwareCs)
 
         # Initialization of the framing interface
         self.framing = FramingInterface()
-        iftype =  iftype.upper()
 
         try:
-            if iftype == 'ETH':
-                self.framing.initialize_framing(iftype, iface, mac)
-                log("iface: {}, name: {}, mac: {}".format(iftype, iface, mac))
-            else:
-                self.framing.initialize_framing(iftype, iface, None)
-                log("iface: {}, name: {}".format(iftype, iface))
-
-            self.framing.clear_backlog()
+            self._initializeFraming(iftype, iface, mac)
             self.version = self.systemGetVersion()
             self.slacStop()
             self.controlPilotStop()
@@ -119,6 +38,64 @@ class Whitebeet():
             self.connectionError = True
             raise ConnectionError("Failed to initialize the framing interface on \"{}\"".format(self.framing.sut_interface))
 
+    def _initializeAttributes(self, txCoalescingUs, adapterMode, recordPath, kernelTimestamps, spiGpio,
+                              spiDevice, hardwareCs):
+        """
+        Sets up the settings of the framing interface, the state and the module and sub IDs used
+        by the commands.
+        """
+        self.logger = Logger()
+
+        self.txCoalescingUs = txCoalescingUs
+        self.adapterMode = adapterMode
+        self.recordPath = recordPath
+        self.kernelTimestamps = kernelTimestamps
+        self.spiGpio = spiGpio
+        self.spiDevice = spiDevice
+        self.hardwareCs = hardwareCs
+
+        self.connectionError = False
+        self.payloadBytes = bytes()
+        self.payloadBytesRead = 0
+        self.payloadBytesLen = 0
+        self.pipelinedRequests = None
+        self.subscriptions = {}
+        # (mod ID, sub ID, total time, wire time) of the latest requests in ns
+        self.requestTimings = deque(maxlen=self.request_timings)
+
+        # Module and sub IDs of the protocol registry, i.e. self.cp_mod_id, self.cp_sub_set_mode
+        for module_name, (mod_id, subs) in MODULE_IDS.items():
+            setattr(self, module_name + "_mod_id", mod_id)
+            for sub_id, sub_names in subs.items():
+                for sub_name in sub_names:
+                    setattr(self, module_name + "_sub_" + sub_name, sub_id)
+
+        # Network configuration IDs
+        self.netconf_sub_id = self.netconf_mod_id
+        self.netconf_set_port_mirror_state = self.netconf_sub_set_port_mirror_state
+
+    def _initializeFraming(self, iftype, iface, mac):
+        """
+        Initializes the framing interface on the given interface. If a record path is given,
+        all frames are recorded to this capture file, starting with the initialization.
+        """
+        iftype =  iftype.upper()
+
+        if iftype == 'ETH':
+            self.framing.initialize_framing(iftype, iface, mac, self.txCoalescingUs, self.adapterMode, self.kernelTimestamps)
+            log("iface: {}, name: {}, mac: {}".format(iftype, iface, mac))
+        elif iftype == 'SPI':
+            self.framing.initialize_framing(iftype, iface, None, adapter_mode=self.adapterMode, gpio=self.spiGpio,
+                                            spi=self.spiDevice, hardware_cs=self.hardwareCs)
+            log("iface: {}, name: {}".format(iftype, iface))
+        else:
+            self.framing.initialize_framing(iftype, iface, None, adapter_mode=self.adapterMode)
+            log("iface: {}, name: {}".format(iftype, iface))
+
+        if self.recordPath is not None:
+            self.framing.start_recording(self.recordPath)
+        self.framing.clear_backlog()
+
     def __enter__(self):
         return self
 
@@ -153,41 +130,90 @@ class Whitebeet():
         
         return retValue
 
-    def _sendReceive(self, mod_id, sub_id, payload):
+    def _sendRequest(self, mod_id, sub_id, payload):
         """
-        Sends a message and receives the response. When the whitebeet returns busy the message will
+        Sends a message without waiting for the response. Returns the handle of the request.
+        """
+        return self.framing.send_request(mod_id, sub_id, payload)
+
+    def _receiveResponse(self, request):
+        """
+        Receives the response of a request. When the whitebeet returns busy the message will
         be repeated until it is accepted to the timeout runs out.
         """
         try:
-            time_now = time.time()
-            time_start = time_now
-            time_end = time_start + 5
-            loop = True
-            response = None
-            while loop == True:
-                req_id = self.framing.build_and_send_frame(mod_id, sub_id, payload)
-                response = self.framing.receive_next_frame(filter_mod=[mod_id, 0xFF], filter_sub={ mod_id: sub_id }, filter_req_id=req_id, timeout=time_end - time_start)
-                if response is None:
-                    self.connectionError = True
-                    raise ConnectionError("Problem with send/receive - Please check your connection!")
-                elif response.mod_id == 0xFF:
-                    raise Warning("Framing protocol error: {:02X}".format(response.sub_id))
-                elif response.sub_id != sub_id:
-                    raise Warning("Response from mod ID {:02X} with unexpected sub ID {:02X} received".format(response.mod_id, response.sub_id))
-                elif response.payload_len == 1 and response.payload[0] == 1:
-                    loop = True
+            time_end = time.time() + 5
+            while True:
+                response = request.result(timeout=max(time_end - time.time(), 0))
+                if self._checkResponse(request.sub_id, response):
+                    request = self._sendRequest(request.mod_id, request.sub_id, request.payload)
                 else:
-                    loop = False
-            return response
+                    return response
         except:
             self.connectionError = True
             raise ConnectionError("Problem with send/receive - Please check your connection!")
 
-    def _sendReceiveAck(self, mod_id, sub_id, payload):
+    def _checkResponse(self, sub_id, response):
         """
-        Sends a message and expects and ACK as response. Additional payload is returned.
+        Checks the response of a request. Raises a ConnectionError if the response is missing,
+        is a framing protocol error or has another sub ID. Returns True if the module was busy
+        and the request has to be repeated.
         """
-        response = self._sendReceive(mod_id, sub_id, payload)
+        if response is None:
+            raise ConnectionError("Problem with send/receive - Please check your connection!")
+        elif response.mod_id == 0xFF:
+            raise ConnectionError("Framing protocol error: {:02X}".format(response.sub_id))
+        elif response.sub_id != sub_id:
+            raise ConnectionError("Response from mod ID {:02X} with unexpected sub ID {:02X} received".format(response.mod_id, response.sub_id))
+        return response.payload_len == 1 and response.payload[0] == 1
+
+    def _sendReceive(self, mod_id, sub_id, payload):
+        """
+        Sends a message and receives the response. When the whitebeet returns busy the message will
+        be repeated until it is accepted to the timeout runs out.
+        """
+        self._checkNotPipelined(mod_id, sub_id)
+        request = self._sendRequest(mod_id, sub_id, payload)
+        response = self._receiveResponse(request)
+        if self.kernelTimestamps:
+            self._recordTiming(mod_id, sub_id, request.sent_time, response)
+        return response
+
+    def _recordTiming(self, mod_id, sub_id, sentTime, response):
+        """
+        Records the time from sending a request until its response was received. With kernel
+        timestamps the time on the wire and in the module is recorded separately, the rest
+        of the total time is spent in the host.
+        """
+        if sentTime is None:
+            return
+        total = time.time_ns() - sentTime
+        wire = None
+        txTimestamp = self.framing.get_tx_timestamp(response.req_id)
+        if txTimestamp is not None and response.timestamp is not None:
+            wire = response.timestamp - txTimestamp
+        self.requestTimings.append((mod_id, sub_id, total, wire))
+
+    def getRequestTimings(self):
+        """
+        Returns the number of recorded requests and the mean total, wire and host time per
+        request in us. The wire time is the time between the kernel sending the request and
+        receiving the response, it includes the processing in the module. The host time is
+        the rest, spent in queues, parsing and the application. Requests are only recorded with
+        kernelTimestamps, wire and host time are None if the adapter provides no kernel
+        timestamps. The host time includes repetitions of busy requests.
+        """
+        timings = list(self.requestTimings)
+        wired = [(total, wire) for mod_id, sub_id, total, wire in timings if wire is not None]
+        statistics = {"requests": len(timings), "total": None, "wire": None, "host": None}
+        if timings:
+            statistics["total"] = sum(timing[2] for timing in timings) / len(timings) / 1000
+        if wired:
+            statistics["wire"] = sum(wire for total, wire in wired) / len(wired) / 1000
+            statistics["host"] = sum(total - wire for total, wire in wired) / len(wired) / 1000
+        return statistics
+
+    def _checkAck(self, mod_id, sub_id, response):
         if response.payload_len == 0:
             raise Warning("Module did not accept command with no return code")
         elif response.payload[0] != 0:
@@ -195,6 +221,89 @@ class Whitebeet():
         else:
             return response
 
+    def _sendReceiveAck(self, mod_id, sub_id, payload):
+        """
+        Sends a message and expects and ACK as response. Additional payload is returned.
+        Inside of a pipeline the message is only sent and None is returned.
+        """
+        if self.pipelinedRequests is not None:
+            self.pipelinedRequests.append(self._sendRequest(mod_id, sub_id, payload))
+            return None
+        response = self._sendReceive(mod_id, sub_id, payload)
+        return self._checkAck(mod_id, sub_id, response)
+
+    def _sendReceiveAckValue(self, mod_id, sub_id, payload):
+        """
+        Sends a message and expects an ACK as response. Returns the response, whose additional
+        payload is the value of the command. Cannot be used inside of a pipeline.
+        """
+        response = self._sendReceive(mod_id, sub_id, payload)
+        return self._checkAck(mod_id, sub_id, response)
+
+    def _checkNotPipelined(self, mod_id, sub_id):
+        """
+        Commands that return a value need the response right away, which is only received when
+        the pipeline ends.
+        """
+        if self.pipelinedRequests is not None:
+            raise RuntimeError("Command {:x}:{:x} returns a value and cannot be used inside of a pipeline".format(mod_id, sub_id))
+
+    @contextmanager
+    def pipeline(self):
+        """
+        Commands that are issued inside of the with block are sent right away without waiting
+        for the response of the previous command. The responses are received and checked when
+        the block is left. Only commands that do not return a value may be used in a pipeline,
+        others raise a RuntimeError. If a command fails the responses of all other commands are
+        still received before the first error is raised. If the block raises, the responses are
+        not checked and responses that were not received yet are dropped.
+        """
+        if self.pipelinedRequests is not None:
+            raise RuntimeError("Pipelines cannot be nested")
+        self.pipelinedRequests = []
+        try:
+            yield self
+        except BaseException:
+            self._drainPipeline(0, check=False)
+            raise
+        error = self._drainPipeline(5)
+        if error is not None:
+            raise error
+
+    def _drainPipeline(self, timeout, check=True):
+        """
+        Ends the pipeline and receives the responses of all pipelined requests within the
+        timeout. A request whose response is missing is expired, so its late response is
+        dropped. With check the responses are checked and the first error is returned.
+        """
+        requests = self.pipelinedRequests
+        self.pipelinedRequests = None
+        error = None
+        time_end = time.time() + timeout
+        for request in requests:
+            response = request.result(timeout=max(time_end - time.time(), 0))
+            if not check:
+                continue
+            try:
+                self._checkPipelined(request, response)
+            except (ConnectionError, Warning) as e:
+                if error is None:
+                    error = e
+        return error
+
+    def _checkPipelined(self, request, response):
+        """
+        Checks the response of a pipelined request like _sendReceiveAck does outside of a
+        pipeline. Busy responses are not repeated, the command would be executed after the
+        commands that were sent after it. Only a missing response marks the connection as
+        broken.
+        """
+        if response is None:
+            self.connectionError = True
+        if self._checkResponse(request.sub_id, response):
+            raise ConnectionError("Module was busy and did not execute command {:x}:{:x}".format(request.mod_id, request.sub_id))
+        return self._checkAck(request.mod_id, request.sub_id, response)
+
     def _receive(self, mod_id, sub_id, req_id, timeout):
         """
         Try to receive a message with the given parameters until the timeout is reached.
@@ -216,6 +325,43 @@ class Whitebeet():
         response = self.framing.receive_next_frame(filter_mod=mod_id, filter_sub=sub_id, filter_req_id=req_id, noisy_timeout=False, timeout=timeout)
         return response
 
+    def _subscription(self, mod_id, sub_ids):
+        """
+        Returns the subscription to the given notifications. The subscription is created on first
+        use and kept, so the notifications are routed to it when they are received.
+        """
+        subscription = self.subscriptions.get((mod_id, sub_ids))
+        if subscription is None:
+            subscription = self.framing.subscribe(mod_id, sub_ids)
+            self.subscriptions[(mod_id, sub_ids)] = subscription
+        return subscription
+
+    def unsubscribe(self, mod_id=None):
+        """
+        Removes the subscriptions to the notifications of the given module or of all modules,
+        buffered notifications are dropped. The services unsubscribe when they are stopped, so
+        notifications of a session are not received in the next one.
+        """
+        for key in list(self.subscriptions):
+            if mod_id is None or key[0] == mod_id:
+                self.framing.unsubscribe(self.subscriptions.pop(key))
+
+    def _receiveNotification(self, mod_id, sub_ids, timeout):
+        """
+        Try to receive one of the given notifications until the timeout is reached.
+        """
+        response = self._receiveNotificationSilent(mod_id, sub_ids, timeout)
+        if response is None:
+            raise TimeoutError("We did not receive a frame before the timeout of {}s".format(timeout))
+        return response
+
+    def _receiveNotificationSilent(self, mod_id, sub_ids, timeout):
+        """
+        Try to receive one of the given notifications until the timeout is reached.
+        Does not raise an assertion if no notification is received within timeout.
+        """
+        return self.framing.receive_notification(self._subscription(mod_id, sub_ids), timeout)
+
     def _printPayload(self, payload):
             print("Length of payload: " + str(len(payload)))
             print("Payload:")
@@ -304,7 +450,7 @@ class Whitebeet():
         """
         Retrives the firmware version in the form x.x.x
         """
-        response = self._sendReceiveAck(self.sys_mod_id, self.sys_sub_get_firmware_version, None)
+        response = self._sendReceiveAckValue(self.sys_mod_id, self.sys_sub_get_firmware_version, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         version_length = self.payloadReaderReadInt(2)
         return self.payloadReaderReadBytes(version_length).decode("utf-8")
@@ -332,7 +478,7 @@ class Whitebeet():
         Sets the mode of the control pilot service.
         Returns: 0: EV, 1: EVSE, 255: Mode was not yet set
         """
-        response = self._sendReceiveAck(self.cp_mod_id, self.cp_sub_get_mode, None)
+        response = self._sendReceiveAckValue(self.cp_mod_id, self.cp_sub_get_mode, None)
         if response.payload_len != 2:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.payload[1] not in [0, 1, 255]:
@@ -369,7 +515,7 @@ class Whitebeet():
         """
         Returns the currently configured duty cycle
         """
-        response = self._sendReceiveAck(self.cp_mod_id, self.cp_sub_get_dc, None)
+        response = self._sendReceiveAckValue(self.cp_mod_id, self.cp_sub_get_dc, None)
         if response.payload_len != 3:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         else:
@@ -383,7 +529,7 @@ class Whitebeet():
         """
         Returns the state of the resistor value
         """
-        response = self._sendReceiveAck(self.cp_mod_id, self.cp_sub_get_res, None)
+        response = self._sendReceiveAckValue(self.cp_mod_id, self.cp_sub_get_res, None)
         if response.payload_len != 1:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.payload[0] not in range(0, 5):
@@ -398,7 +544,7 @@ class Whitebeet():
         if not isinstance(value, int) or value not in range(0, 2):
             print("Resistor value needs to be of type int with range 0..2")
             return None
-        response = self._sendReceiveAck(self.cp_mod_id, self.cp_sub_set_res, value.to_bytes(1, "big"))
+        response = self._sendReceiveAckValue(self.cp_mod_id, self.cp_sub_set_res, value.to_bytes(1, "big"))
         if response.payload_len != 1:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.payload[0] not in range(0, 5):
@@ -411,7 +557,7 @@ class Whitebeet():
         Returns the state on the CP
         0: state A, 1: state B, 2: state C, 3: state D, 4: state E, 5: state F, 6: Unknown
         """
-        response = self._sendReceiveAck(self.cp_mod_id, self.cp_sub_get_state, None)
+        response = self._sendReceiveAckValue(self.cp_mod_id, self.cp_sub_get_state, None)
         if response.payload_len != 2:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.payload[1] not in range(0, 7):
@@ -435,6 +581,7 @@ class Whitebeet():
         Stops the SLAC service.
         """
         response = self._sendReceive(self.slac_mod_id, self.slac_sub_stop, None)
+        self.unsubscribe(self.slac_mod_id)
         if response.payload[0] not in [0, 0x10]:
             raise Warning("SLAC module did not accept our stop command")
 
@@ -449,7 +596,7 @@ class Whitebeet():
         Waits for SLAC success or failed message for matching process
         """
         time_start = time.time()
-        response = self._receive(self.slac_mod_id, [self.slac_sub_success, self.slac_sub_failed], 0xFF, 60)
+        response = self._receiveNotification(self.slac_mod_id, (self.slac_sub_success, self.slac_sub_failed), 60)
         if response.payload_len != 0:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.sub_id == self.slac_sub_success:
@@ -515,7 +662,7 @@ class Whitebeet():
         Returns the mode of the V2G service.
         Returns: 0: EV, 1: EVSE, 2: Mode was not yet set
         """
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_get_mode, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_get_mode, None)
         if response.payload_len != 2:
             raise Warning("Module returned malformed message with length {}".format(response.payload_len))
         elif response.payload[1] not in [0, 1, 2]:
@@ -534,6 +681,7 @@ class Whitebeet():
         Stops the v2g service.
         """
         self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_stop, None)
+        self.unsubscribe(self.v2g_mod_id)
 
     # EV 
     def v2gEvSetConfiguration(self, config):
@@ -588,7 +736,7 @@ class Whitebeet():
         """
         
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_ev_get_configuration, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_ev_get_configuration, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         self.payloadReaderReadInt(1)
 
@@ -730,7 +878,7 @@ class Whitebeet():
         Returns dictionary
         """
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_ev_get_dc_charging_parameters, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_ev_get_dc_charging_parameters, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         self.payloadReaderReadInt(1)
         ret["min_voltage"] = self.payloadReaderReadBytes(3)
@@ -823,7 +971,7 @@ class Whitebeet():
         Returns dictionary
         """
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_ev_get_dc_charging_parameters, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_ev_get_dc_charging_parameters, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         self.payloadReaderReadInt(1)
         ret["min_voltage"] = self.payloadReaderReadBytes(3)
@@ -1169,7 +1317,7 @@ class Whitebeet():
         """
         
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_evse_get_configuration, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_evse_get_configuration, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         
         code = self.payloadReaderReadBytes(1)
@@ -1307,7 +1455,7 @@ class Whitebeet():
 
         """
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_evse_get_dc_charging_parameters, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_evse_get_dc_charging_parameters, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         code = self.payloadReaderReadInt(1)
         ret['code'] = code
@@ -1404,7 +1552,7 @@ class Whitebeet():
 
         """
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_evse_get_ac_charging_parameters, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_evse_get_ac_charging_parameters, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         code = self.payloadReaderReadInt(1)
         ret['code'] = code
@@ -1458,7 +1606,7 @@ class Whitebeet():
         Returns the SDP server configuration
         """
         ret = {}
-        response = self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_evse_get_sdp_config, None)
+        response = self._sendReceiveAckValue(self.v2g_mod_id, self.v2g_sub_evse_get_sdp_config, None)
         self.payloadReaderInitialize(response.payload, response.payload_len)
         code = self.payloadReaderReadInt(1)
         ret['code'] = code
@@ -1639,6 +1787,7 @@ class Whitebeet():
     def v2gEvseStopListen(self):
         payload = b''
         self._sendReceiveAck(self.v2g_mod_id, self.v2g_sub_evse_stop_listen, payload)
+        self.unsubscribe(self.v2g_mod_id)
 
     def v2gEvseSetCertificateInstallationAndUpdateResponse(self, response):
         if not ('status' in response or isinstance(response['status'], int) or response['status'] in [0,1,2]):
@@ -2056,50 +2205,14 @@ class Whitebeet():
         """
         Receives a V2G request status message.
         """
-        sub_id_list = []
-        sub_id_list.append(0x80)
-        sub_id_list.append(0x81)
-        sub_id_list.append(0x82)
-        sub_id_list.append(0x83)
-        sub_id_list.append(0x84)
-        sub_id_list.append(0x85)
-        sub_id_list.append(0x86)
-        sub_id_list.append(0x87)
-        sub_id_list.append(0x88)
-        sub_id_list.append(0x89)
-        sub_id_list.append(0x8A)
-        sub_id_list.append(0x8B)
-        sub_id_list.append(0x8C)
-        sub_id_list.append(0x8E)
-        sub_id_list.append(0x8F)
-        sub_id_list.append(0x90)
-        sub_id_list.append(0x91)
-        response = self._receive(self.v2g_mod_id, sub_id_list, [0x00, 0xFF], 30)
+        response = self._receiveNotification(self.v2g_mod_id, self.v2g_evse_notification_ids, 30)
         return response.sub_id, response.payload
 
     def v2gEvseReceiveRequestSilent(self):
         """
         Receives a V2G request status message.
         """
-        sub_id_list = []
-        sub_id_list.append(0x80)
-        sub_id_list.append(0x81)
-        sub_id_list.append(0x82)
-        sub_id_list.append(0x83)
-        sub_id_list.append(0x84)
-        sub_id_list.append(0x85)
-        sub_id_list.append(0x86)
-        sub_id_list.append(0x87)
-        sub_id_list.append(0x88)
-        sub_id_list.append(0x89)
-        sub_id_list.append(0x8A)
-        sub_id_list.append(0x8B)
-        sub_id_list.append(0x8C)
-        sub_id_list.append(0x8E)
-        sub_id_list.append(0x8F)
-        sub_id_list.append(0x90)
-        sub_id_list.append(0x91)
-        response = self._receiveSilent(self.v2g_mod_id, sub_id_list, [0x00, 0xFF], 0.1)
+        response = self._receiveNotificationSilent(self.v2g_mod_id, self.v2g_evse_notification_ids, 0.1)
         if response is not None:
             return response.sub_id, response.payload
         else:
@@ -2109,20 +2222,5 @@ class Whitebeet():
         """
         Receives a V2G request status message.
         """
-        sub_id_list = []
-        sub_id_list.append(0xC0)
-        sub_id_list.append(0xC1)
-        sub_id_list.append(0xC2)
-        sub_id_list.append(0xC3)
-        sub_id_list.append(0xC4)
-        sub_id_list.append(0xC5)
-        sub_id_list.append(0xC6)
-        sub_id_list.append(0xC7)
-        sub_id_list.append(0xC8)
-        sub_id_list.append(0xC9)
-        sub_id_list.append(0xCA)
-        sub_id_list.append(0xCB)
-        sub_id_list.append(0xCC)
-        sub_id_list.append(0xCD)
-        response = self._receive(self.v2g_mod_id, sub_id_list, [0x00, 0xFF], 1)
+        response = self._receiveNotification(self.v2g_mod_id, self.v2g_ev_notification_ids, 1)
         return response.sub_id, response.payload
@@ -0,0 +1,366 @@
+import os
+import struct
+import threading
+import time
+
+import LoopbackAdapter
+from FramingAPIDef import *
+from FrameEncoder import *
+
+_EXPONENTIAL = struct.Struct("!hb")
+
+def exponential(value):
+    """
+    Encodes a value in the exponential format of the V2G module (16 bit value, 8 bit exponent).
+    """
+    exponent = 0
+    while value != int(value) and exponent > -3:
+        value *= 10
+        exponent -= 1
+    value = int(value)
+    while abs(value) > 0x7FFF:
+        value = int(value / 10)
+        exponent += 1
+    return _EXPONENTIAL.pack(value, exponent)
+
+class WhitebeetEmulator():
+    """
+    Emulates the module side of the framing protocol on a loopback adapter. Every command of the
+    SYS, CP, SLAC and V2G modules is acknowledged, get commands return the state that was set
+    before and the V2G commands of a session trigger the notifications a module would send, so
+    that complete EVSE and EV sessions run without hardware.
+
+    The emulator plays the counterpart of the host: if the host is the EVSE it emulates the EV
+    and the other way round. The EV always selects the DC energy transfer mode 0. After the
+    host started charging the emulator sends charge_loop_count charge parameter notifications
+    and then ends charging.
+
+    The emulator must be started before the host connects:
+
+        with WhitebeetEmulator("emulator"):
+            whitebeet = Whitebeet("LOOPBACK", "emulator", None)
+    """
+
+    NOTIFICATION_REQ_ID = 0xFF
+
+    # get commands return the payload of the last set command of the same parameters
+    GETTERS = {
+        "evse_get_configuration": "evse_set_configuration",
+        "evse_get_dc_charging_parameters": "evse_set_dc_charging_parameters",
+        "evse_get_ac_charging_parameters": "evse_set_ac_charging_parameters",
+        "evse_get_sdp_config": "evse_set_sdp_config",
+        "ev_get_configuration": "ev_set_configuration",
+        "ev_get_dc_charging_parameters": "ev_set_dc_charging_parameters",
+        "ev_get_ac_charging_parameters": "ev_set_ac_charging_parameters",
+    }
+
+    # charging parameters of the emulated EV and EVSE
+    EV_PARAMETERS = {
+        "departure_time": 3600,
+        "energy_request": 20000,
+        "max_voltage": 400,
+        "min_current": 1,
+        "max_current": 100,
+        "max_power": 25000,
+        "energy_capacity": 50000,
+        "full_soc": 100,
+        "bulk_soc": 80,
+        "soc": 30,
+        "target_voltage": 200,
+        "target_current": 50,
+    }
+
+    EVSE_PARAMETERS = {
+        "min_voltage": 50,
+        "min_current": 0,
+        "min_power": 0,
+        "max_voltage": 400,
+        "max_current": 100,
+        "max_power": 25000,
+        "present_voltage": 200,
+        "present_current": 50,
+        "peak_current_ripple": 1,
+    }
+
+    # charging schedule of the emulated EVSE as (start, interval, power)
+    SCHEDULE = [(0, 3600, 11000), (3600, 82800, 11000)]
+
+    def __init__(self, name="emulator", latency=0, bandwidth=None, version="1.0.0", charge_loop_count=3):
+        self.name = name
+        self.adapter = LoopbackAdapter.listen(name, latency, bandwidth)
+        self.encoder = FrameEncoder()
+        self.version = version
+        self.charge_loop_count = charge_loop_count
+
+        self.ev_connected = True
+        self.slac_match_success = True
+        self.evse_duty_cycle = 50
+
+        self.parameters = {}
+        self.notifications = []
+        self.cp_mode = 255
+        self.cp_duty_cycle = 1000
+        self.cp_resistor = 0
+        self.v2g_mode = 2
+        self.session_active = False
+        self.charging = False
+        self.commands = 0
+        self.sessions = 0
+
+        self.thread = None
+        self.running = False
+
+        self.handlers = {}
+        for module_name, sub_name, handler in [
+            ("sys", "get_firmware_version", self._sys_get_firmware_version),
+            ("cp", "set_mode", self._cp_set_mode),
+            ("cp", "get_mode", self._cp_get_mode),
+            ("cp", "set_dc", self._cp_set_duty_cycle),
+            ("cp", "get_dc", self._cp_get_duty_cycle),
+            ("cp", "set_res", self._cp_set_resistor_value),
+            ("cp", "get_state", self._cp_get_state),
+            ("slac", "match", self._slac_match),
+            ("slac", "join", self._slac_join),
+            ("v2g", "set_mode", self._v2g_set_mode),
+            ("v2g", "get_mode", self._v2g_get_mode),
+            ("v2g", "evse_start_listen", self._evse_start_listen),
+            ("v2g", "evse_set_authorization_status", self._evse_set_authorization_status),
+            ("v2g", "evse_set_schedules", self._evse_set_schedules),
+            ("v2g", "evse_set_cable_check_finished", self._evse_set_cable_check_finished),
+            ("v2g", "evse_start_charging", self._evse_start_charging),
+            ("v2g", "evse_stop_charging", self._evse_stop_charging),
+            ("v2g", "ev_start_session", self._ev_start_session),
+            ("v2g", "ev_start_cable_check", self._ev_start_cable_check),
+            ("v2g", "ev_start_pre_charging", self._ev_start_pre_charging),
+            ("v2g", "ev_start_charging", self._ev_start_charging),
+            ("v2g", "ev_stop_charging", self._ev_stop_charging),
+            ("v2g", "ev_stop_session", self._ev_stop_session),
+        ]:
+            self.handlers[self._id(module_name, sub_name)] = handler
+
+        for get_name, set_name in self.GETTERS.items():
+            self.handlers[self._id("v2g", get_name)] = self._getter(self._id("v2g", set_name))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    @staticmethod
+    def _id(module_name, sub_name):
+        return get_module_id_by_name(module_name), get_sub_id_by_name(module_name, sub_name)
+
+    def start(self):
+        """
+        Starts answering the commands in a thread.
+        """
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while self.running:
+            frame = self.adapter.wait_for_frame(time.time() + 0.1)
+            if frame is not None:
+                self.handle_frame(frame)
+
+    def handle_frame(self, frame):
+        """
+        Answers a command frame and sends the notifications it triggered.
+        """
+        self.commands += 1
+        key = (frame.mod_id, frame.sub_id)
+        payload = frame.payload
+        handler = self.handlers.get(key)
+        response = handler(payload) if handler is not None else b"\x00"
+        self.parameters[key] = payload
+
+        self.adapter.send(self.encoder.encode(frame.mod_id, frame.sub_id, frame.req_id, response))
+        for mod_id, sub_id, notification in self.notifications:
+            self.adapter.send(self.encoder.encode(mod_id, sub_id, self.NOTIFICATION_REQ_ID, notification))
+        self.notifications.clear()
+
+    def notify(self, module_name, sub_name, payload=b""):
+        """
+        Queues a notification that is sent after the response of the current command.
+        """
+        mod_id, sub_id = self._id(module_name, sub_name)
+        self.notifications.append((mod_id, sub_id, payload))
+
+    def _getter(self, key):
+        def get(payload):
+            return b"\x00" + self.parameters.get(key, b"")
+        return get
+
+    def _sys_get_firmware_version(self, payload):
+        version = self.version.encode("utf-8")
+        return b"\x00" + len(version).to_bytes(1, "big") + version
+
+    def _cp_set_mode(self, payload):
+        self.cp_mode = payload[0]
+        return b"\x00"
+
+    def _cp_get_mode(self, payload):
+        return bytes([0, self.cp_mode])
+
+    def _cp_set_duty_cycle(self, payload):
+        self.cp_duty_cycle = int.from_bytes(payload[0:2], "big")
+        return b"\x00"
+
+    def _cp_get_duty_cycle(self, payload):
+        # in EV mode the duty cycle is generated by the emulated EVSE
+        duty_cycle = self.evse_duty_cycle if self.cp_mode == 0 else self.cp_duty_cycle
+        return b"\x00" + duty_cycle.to_bytes(2, "big")
+
+    def _cp_set_resistor_value(self, payload):
+        self.cp_resistor = payload[0]
+        return b"\x00"
+
+    def _cp_get_state(self, payload):
+        if not self.ev_connected:
+            state = 0
+        elif self.cp_mode == 0:
+            state = 1 + self.cp_resistor
+        else:
+            state = 2 if self.charging else 1
+        return bytes([0, state])
+
+    def _slac_match(self, payload):
+        self.notify("slac", "success" if self.slac_match_success else "failed")
+        return b"\x00"
+
+    def _slac_join(self, payload):
+        self.notify("slac", "join_status", b"\x01")
+        return b"\x00"
+
+    def _v2g_set_mode(self, payload):
+        self.v2g_mode = payload[0]
+        return b"\x00"
+
+    def _v2g_get_mode(self, payload):
+        return bytes([0, self.v2g_mode])
+
+    def _dc_charge_parameters(self):
+        ev = self.EV_PARAMETERS
+        return exponential(ev["max_voltage"]) + exponential(ev["max_current"]) \
+            + b"\x01" + exponential(ev["max_power"]) \
+            + b"\x01\x00" + bytes([ev["soc"]]) \
+            + exponential(ev["target_voltage"]) + exponential(ev["target_current"]) \
+            + b"\x01" + bytes([ev["full_soc"]]) + b"\x01" + bytes([ev["bulk_soc"]]) \
+            + b"\x00" + b"\x00" + b"\x00" + b"\x00"
+
+    def _evse_start_listen(self, payload):
+        self.session_active = True
+        self.notify("v2g", "evse_session_started", b"\x00" + os.urandom(8) + b"\x06" + os.urandom(6))
+        self.notify("v2g", "evse_payment_selected", b"\x00")
+        self.notify("v2g", "evse_request_authorization", (60000).to_bytes(4, "big"))
+        return b"\x00"
+
+    def _evse_set_authorization_status(self, payload):
+        if payload[0] != 0:
+            self._evse_session_stopped()
+            return b"\x00"
+        ev = self.EV_PARAMETERS
+        self.notify("v2g", "evse_energy_transfer_mode_selected",
+            b"\x01" + ev["departure_time"].to_bytes(4, "big")
+            + b"\x01" + exponential(ev["energy_request"])
+            + exponential(ev["max_voltage"])
+            + b"\x01" + exponential(ev["min_current"])
+            + exponential(ev["max_current"])
+            + b"\x01" + exponential(ev["max_power"])
+            + b"\x00" + exponential(ev["energy_capacity"])
+            + b"\x01" + bytes([ev["full_soc"]]) + b"\x01" + bytes([ev["bulk_soc"]])
+            + b"\x01\x00" + bytes([ev["soc"]]))
+        self.notify("v2g", "evse_request_schedules", (60000).to_bytes(4, "big") + (12).to_bytes(2, "big"))
+        return b"\x00"
+
+    def _evse_set_schedules(self, payload):
+        self.notify("v2g", "evse_dc_charge_parameters_changed", self._dc_charge_parameters())
+        self.notify("v2g", "evse_request_cable_check", (40000).to_bytes(4, "big"))
+        return b"\x00"
+
+    def _evse_set_cable_check_finished(self, payload):
+        self.notify("v2g", "evse_pre_charge_started")
+        profiles = b"".join(start.to_bytes(4, "big") + exponential(power) for start, _, power in self.SCHEDULE)
+        self.notify("v2g", "evse_request_start_charging",
+            (5000).to_bytes(4, "big") + (1).to_bytes(2, "big") + bytes([len(self.SCHEDULE)]) + profiles)
+        return b"\x00"
+
+    def _evse_start_charging(self, payload):
+        self.charging = True
+        for i in range(self.charge_loop_count):
+            self.notify("v2g", "evse_dc_charge_parameters_changed", self._dc_charge_parameters())
+        self.notify("v2g", "evse_request_stop_charging", (5000).to_bytes(4, "big") + b"\x00")
+        return b"\x00"
+
+    def _evse_stop_charging(self, payload):
+        if self.session_active:
+            self.notify("v2g", "evse_welding_detection_started")
+            self._evse_session_stopped()
+        return b"\x00"
+
+    def _evse_session_stopped(self):
+        self.charging = False
+        self.session_active = False
+        self.sessions += 1
+        self.notify("v2g", "evse_session_stopped", b"\x00")
+
+    def _ev_dc_charge_parameters(self):
+        evse = self.EVSE_PARAMETERS
+        return b"".join(exponential(evse[key]) for key in ("min_voltage", "min_current", "min_power",
+                "max_voltage", "max_current", "max_power", "present_voltage", "present_current")) \
+            + b"\x00" + b"\x01\x00" + b"\x00\x00\x00" \
+            + exponential(evse["peak_current_ripple"]) + b"\x00" + b"\x00"
+
+    def _ev_start_session(self, payload):
+        self.session_active = True
+        evse_id = b"DE*A23*E45B*78C"
+        self.notify("v2g", "ev_session_started",
+            b"\x00" + os.urandom(8) + bytes([len(evse_id)]) + evse_id + b"\x00" + b"\x00")
+        entries = b"".join(start.to_bytes(4, "big") + interval.to_bytes(4, "big") + exponential(power)
+            for start, interval, power in self.SCHEDULE)
+        self.notify("v2g", "ev_schedule_received",
+            b"\x01" + (1).to_bytes(2, "big") + len(self.SCHEDULE).to_bytes(2, "big") + entries)
+        self.notify("v2g", "ev_cable_check_ready")
+        return b"\x00"
+
+    def _ev_start_cable_check(self, payload):
+        self.notify("v2g", "ev_cable_check_finished")
+        self.notify("v2g", "ev_pre_charging_ready")
+        return b"\x00"
+
+    def _ev_start_pre_charging(self, payload):
+        self.notify("v2g", "ev_dc_charge_parameters_changed", self._ev_dc_charge_parameters())
+        self.notify("v2g", "ev_charging_ready")
+        return b"\x00"
+
+    def _ev_start_charging(self, payload):
+        self.charging = True
+        self.notify("v2g", "ev_charging_started")
+        for i in range(self.charge_loop_count):
+            self.notify("v2g", "ev_dc_charge_parameters_changed", self._ev_dc_charge_parameters())
+        return self._ev_stop_charging(payload)
+
+    def _ev_stop_charging(self, payload):
+        if self.charging:
+            self.charging = False
+            self.notify("v2g", "ev_charging_stopped")
+        return b"\x00"
+
+    def _ev_stop_session(self, payload):
+        if self.session_active:
+            self.session_active = False
+            self.sessions += 1
+            self.notify("v2g", "ev_post_charging_ready")
+            self.notify("v2g", "ev_session_stopped")
+        return b"\x00"
@@ -0,0 +1,60 @@
+import time
+from collections import deque
+
+from SpiTransferEngine import DEFAULT_BUFSIZ
+
+class FakeSpiDev():
+    """
+    Stand-in for spidev.SpiDev for running the SPI adapter without hardware. Every transfer
+    is handed to the responder, which returns the reply of the slave, by default zeros. xfer
+    and xfer2 reject transfers larger than bufsiz like the driver does. With clock set every
+    transfer takes as long as it would on the wire at max_speed_hz. The calls per method are
+    counted in calls, the method and the data of the latest transfers are kept in sent.
+    """
+
+    def __init__(self, responder=None, bufsiz=DEFAULT_BUFSIZ, clock=False):
+        self.responder = responder
+        self.bufsiz = bufsiz
+        self.clock = clock
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.opened = None
+        self.calls = {}
+        self.sent = deque(maxlen=1000)
+
+    def open(self, bus, device):
+        self.opened = (bus, device)
+
+    def close(self):
+        self.opened = None
+
+    def _transfer(self, method, values, limit=True):
+        if limit and len(values) > self.bufsiz:
+            raise OverflowError("Argument list size exceeds {} bytes.".format(self.bufsiz))
+        data = bytes(values)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        self.sent.append((method, data))
+        if self.clock:
+            end = time.perf_counter() + len(data) * 8 / self.max_speed_hz
+            while time.perf_counter() < end:
+                pass
+        if self.responder is not None:
+            reply = self.responder(data)
+        else:
+            reply = bytes(len(data))
+        return list(reply[:len(data)]) + [0] * (len(data) - len(reply))
+
+    def xfer(self, values):
+        return self._transfer("xfer", values)
+
+    def xfer2(self, values):
+        return self._transfer("xfer2", values)
+
+    def xfer3(self, values):
+        return tuple(self._transfer("xfer3", values, limit=False))
+
+    def writebytes(self, values):
+        self._transfer("writebytes", values)
+
+    def writebytes2(self, values):
+        self._transfer("writebytes2", values, limit=False)
@@ -0,0 +1,73 @@
+from FrameBacklog import FrameBacklog, FrameFilter, DEFAULT_LIMITS, DROP_NEWEST
+
+class Frame():
+    def __init__(self, mod_id, sub_id, req_id):
+        self.mod_id = mod_id
+        self.sub_id = sub_id
+        self.req_id = req_id
+
+def test_backlog_is_unbounded_by_default():
+    backlog = FrameBacklog()
+
+    for i in range(5000):
+        backlog.append(Frame(0x27, 0x80, i & 0xFF))
+
+    assert len(backlog) == 5000
+    assert all(limit is None for limit in DEFAULT_LIMITS.values())
+
+def test_oldest_frame_of_the_class_is_dropped():
+    backlog = FrameBacklog({"responses": 2})
+    notification = Frame(0x27, 0x80, 0x00)
+    first = Frame(0x27, 0x41, 1)
+    second = Frame(0x28, 0x42, 2)
+    third = Frame(0x27, 0x41, 3)
+
+    for frame in [notification, first, second, third]:
+        backlog.append(frame)
+
+    assert list(backlog) == [notification, second, third]
+    assert backlog.get_statistics()["responses"]["dropped"] == 1
+
+def test_frames_popped_out_of_order_are_not_dropped_again():
+    backlog = FrameBacklog({"responses": 2})
+    first = Frame(0x27, 0x41, 1)
+    second = Frame(0x27, 0x42, 2)
+    third = Frame(0x27, 0x43, 3)
+    fourth = Frame(0x27, 0x44, 4)
+
+    backlog.append(first)
+    backlog.append(second)
+    assert backlog.pop(FrameFilter(filter_req_id=1)) is first
+    backlog.append(third)
+    backlog.append(fourth)
+
+    assert list(backlog) == [third, fourth]
+    assert backlog.get_statistics()["responses"]["dropped"] == 1
+
+def test_newest_frame_is_dropped_with_drop_newest():
+    backlog = FrameBacklog({"responses": 1}, DROP_NEWEST)
+    first = Frame(0x27, 0x41, 1)
+
+    assert backlog.append(first)
+    assert not backlog.append(Frame(0x27, 0x41, 2))
+    assert list(backlog) == [first]
+
+def test_lowering_the_limit_drops_the_oldest_frames():
+    backlog = FrameBacklog()
+    frames = [Frame(0x27, 0x80 + i, 0xFF) for i in range(10)]
+    for frame in frames:
+        backlog.append(frame)
+
+    backlog.set_limit("notifications", 3)
+
+    assert list(backlog) == frames[-3:]
+
+def test_arrival_order_stays_bounded_when_frames_are_popped():
+    backlog = FrameBacklog({"responses": 10})
+    backlog.append(Frame(0x27, 0x41, 0))
+    for i in range(1, 10000):
+        backlog.append(Frame(0x27, 0x42, i & 0xFF))
+        assert backlog.pop(FrameFilter(filter_sub=0x42)) is not None
+
+    assert len(backlog) == 1
+    assert len(backlog._arrivals["responses"]) < 100
@@ -0,0 +1,147 @@
+import time
+from collections import deque
+
+import pytest
+
+import SpiAdapter
+from FrameEncoder import FrameEncoder
+from GpioHal import FakeGpioHal
+from tests.fake_spidev import FakeSpiDev
+
+RX_READY = 22
+TX_PENDING = 27
+
+FRAME = FrameEncoder().encode(0x29, 0x48, 0x01, b"\x00")
+
+class Slave():
+    """
+    Slave side of the SPI protocol. The size header is answered with the size of the next
+    frame to send, which is sent in the data transfer. TX pending is dropped when the last
+    frame was handed out. With drop_rx_ready RX ready goes low after the size header and is
+    never raised again.
+    """
+
+    def __init__(self, gpio, drop_rx_ready=False):
+        self.gpio = gpio
+        self.drop_rx_ready = drop_rx_ready
+        self.frames = deque()
+        self.pending = b""
+        gpio.set_input(RX_READY, 1)
+
+    def respond(self, data):
+        if data[0] == 0xAA:
+            self.pending = self.frames.popleft() if self.frames else b""
+            if not self.frames:
+                self.gpio.set_input(TX_PENDING, 0)
+            if self.drop_rx_ready:
+                self.gpio.set_input(RX_READY, 0)
+            size = len(self.pending)
+            return bytes([0xAA, 0xAA, size // 255, size % 255])
+        return b"\x55\x55\x00\x00" + self.pending
+
+@pytest.fixture
+def start_adapter(monkeypatch):
+    """
+    Starts an SPI adapter in thread mode on fake GPIOs and a fake SPI device. Without an
+    idle_timeout only an edge or a frame to send wakes up the transfer loop.
+    """
+    adapters = []
+
+    def start(idle_timeout=10, drop_rx_ready=False):
+        monkeypatch.setattr(SpiAdapter, "IDLE_TIMEOUT", idle_timeout)
+        gpio = FakeGpioHal()
+        slave = Slave(gpio, drop_rx_ready)
+        spi = FakeSpiDev(slave.respond)
+        adapter = SpiAdapter.SpiAdapter("thread", gpio=gpio, spi=spi)
+        adapter.sut_interface = "spidev0.0"
+        adapter.start()
+        adapters.append(adapter)
+        return adapter, gpio, slave, spi
+
+    yield start
+    for adapter in adapters:
+        adapter.stop()
+
+def wait_until(condition, timeout=1):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.001)
+    return True
+
+def test_idle_adapter_does_not_transfer(start_adapter):
+    adapter, gpio, slave, spi = start_adapter()
+
+    time.sleep(0.3)
+
+    assert spi.calls == {}
+
+def test_tx_pending_edge_triggers_transfer(start_adapter):
+    adapter, gpio, slave, spi = start_adapter()
+    slave.frames.append(FRAME)
+
+    gpio.set_input(TX_PENDING, 1)
+
+    frame = adapter.wait_for_frame(time.time() + 1)
+    assert frame is not None
+    assert (frame.mod_id, frame.sub_id, frame.req_id) == (0x29, 0x48, 0x01)
+    assert list(spi.sent) == [
+        ("xfer", b"\xAA\xAA\x00\x00"),
+        ("xfer", b"\x55\x55\x00\x00" + bytes(len(FRAME))),
+    ]
+    # TX pending was dropped by the slave, nothing more to do
+    time.sleep(0.2)
+    assert len(spi.sent) == 2
+
+def test_rx_ready_edge_triggers_pending_send(start_adapter):
+    adapter, gpio, slave, spi = start_adapter()
+    gpio.set_input(RX_READY, 0)
+
+    adapter.send(FRAME)
+    time.sleep(0.2)
+    assert spi.calls == {}
+
+    gpio.set_input(RX_READY, 1)
+
+    assert wait_until(lambda: len(spi.sent) == 2)
+    # the slave has nothing to send, so the frame is only written
+    assert list(spi.sent) == [
+        ("xfer", b"\xAA\xAA" + len(FRAME).to_bytes(2, "big")),
+        ("writebytes2", b"\x55\x55\x00\x00" + FRAME),
+    ]
+
+def test_missed_edge_is_recovered_by_idle_timeout(start_adapter):
+    adapter, gpio, slave, spi = start_adapter(idle_timeout=0.05)
+    slave.frames.append(FRAME)
+
+    # raised without calling the edge callback, as if the edge was missed
+    gpio.levels[TX_PENDING] = 1
+
+    assert adapter.wait_for_frame(time.time() + 1) is not None
+
+def test_missed_edge_is_not_recovered_before_idle_timeout(start_adapter):
+    adapter, gpio, slave, spi = start_adapter()
+    slave.frames.append(FRAME)
+
+    gpio.levels[TX_PENDING] = 1
+
+    assert adapter.wait_for_frame(time.time() + 0.3) is None
+    assert spi.calls == {}
+
+def test_data_transfer_is_skipped_if_rx_ready_times_out(start_adapter, monkeypatch, capsys):
+    monkeypatch.setattr(SpiAdapter, "RX_READY_TIMEOUT", 0.1)
+    adapter, gpio, slave, spi = start_adapter(drop_rx_ready=True)
+    slave.frames.append(FRAME)
+
+    gpio.set_input(TX_PENDING, 1)
+
+    assert wait_until(lambda: "Slave not ready" in capsys.readouterr().out)
+    # only the size header was transferred
+    assert list(spi.sent) == [("xfer", b"\xAA\xAA\x00\x00")]
+    assert adapter.wait_for_frame(time.time() + 0.1) is None
+
+def test_fake_gpio_hal_requires_thread_mode():
+    for mode in ["process", "shm"]:
+        with pytest.raises(AssertionError):
+            SpiAdapter.SpiAdapter(mode, gpio=FakeGpioHal(), spi=FakeSpiDev())
@@ -0,0 +1,115 @@
+import pytest
+
+from GpioHal import FakeGpioHal
+from SpiTransferEngine import SpiTransferEngine, SMALL_TRANSFER_SIZE
+from tests.fake_spidev import FakeSpiDev
+
+HEADER = b"\x55\x55\x00\x00"
+
+def test_small_transfer_is_padded_and_uses_xfer():
+    spi = FakeSpiDev(lambda data: bytes(range(len(data))))
+    engine = SpiTransferEngine(spi)
+
+    reply = engine.transfer(b"\xAA\xAA", b"\x01\x02", 6)
+
+    assert spi.sent[-1] == ("xfer", b"\xAA\xAA\x01\x02\x00\x00\x00\x00")
+    assert reply == bytes(range(8))
+
+def test_large_transfer_is_padded_in_the_buffer():
+    spi = FakeSpiDev(lambda data: data[::-1])
+    engine = SpiTransferEngine(spi)
+    data = bytes(range(100))
+
+    reply = engine.transfer(HEADER, data, 200)
+
+    expected = HEADER + data + bytes(100)
+    assert spi.sent[-1] == ("xfer2", expected)
+    assert bytes(reply) == expected[::-1]
+
+def test_padding_does_not_keep_data_of_a_previous_transfer():
+    spi = FakeSpiDev()
+    engine = SpiTransferEngine(spi)
+
+    engine.transfer(HEADER, b"\xFF" * 300)
+    engine.transfer(HEADER, b"\x01", 300)
+
+    assert spi.sent[-1] == ("xfer2", HEADER + b"\x01" + bytes(299))
+
+@pytest.mark.parametrize("size, method", [(64, "xfer2"), (128, "xfer2"), (129, "xfer3"), (1000, "xfer3")])
+def test_transfer_is_split_by_xfer3_above_bufsiz(size, method):
+    spi = FakeSpiDev(bufsiz=128)
+    engine = SpiTransferEngine(spi)
+    data = bytes(i & 0xFF for i in range(size - len(HEADER)))
+
+    reply = engine.transfer(HEADER, data)
+
+    if size <= SMALL_TRANSFER_SIZE:
+        method = "xfer"
+    assert spi.sent[-1] == (method, HEADER + data)
+    assert len(reply) == size
+
+def test_write_without_reply_uses_writebytes2():
+    spi = FakeSpiDev(bufsiz=128)
+    engine = SpiTransferEngine(spi)
+
+    assert engine.transfer(HEADER, b"\x01\x02", 100, read=False) is None
+    assert spi.sent[-1] == ("writebytes2", HEADER + b"\x01\x02" + bytes(98))
+
+def test_large_write_with_gpio_chip_select_uses_writebytes2():
+    spi = FakeSpiDev(bufsiz=128)
+    gpio = FakeGpioHal()
+    gpio.setup_output(24, True)
+    engine = SpiTransferEngine(spi, gpio=gpio, cs_pin=24, cs_setup_ns=0)
+
+    assert engine.transfer(HEADER, bytes(1000), read=False) is None
+    assert spi.calls == {"writebytes2": 1}
+    # selected for the transfer and released afterwards
+    assert gpio.outputs[24] == [1, 0, 1]
+
+def test_large_write_with_hardware_chip_select_uses_xfer3():
+    spi = FakeSpiDev(bufsiz=128)
+    engine = SpiTransferEngine(spi)
+
+    assert engine.transfer(HEADER, bytes(1000), read=False) is None
+    assert spi.calls == {"xfer3": 1}
+
+def test_oversized_transfer_is_rejected():
+    spi = FakeSpiDev()
+    engine = SpiTransferEngine(spi, max_size=16)
+
+    with pytest.raises(AssertionError):
+        engine.transfer(HEADER, bytes(13))
+    assert spi.calls == {}
+
+def test_counters_count_transfers_and_bytes():
+    spi = FakeSpiDev(bufsiz=128)
+    counters = [0, 0, 0]
+    engine = SpiTransferEngine(spi, counters=counters)
+
+    engine.transfer(b"\xAA\xAA", b"\x00\x10")
+    engine.transfer(HEADER, None, 1000)
+    engine.transfer(HEADER, bytes(60), read=False)
+
+    assert counters[:2] == [3, 4 + 1004 + 64]
+    assert counters[2] > 0
+    statistics = engine.get_statistics()
+    assert statistics["transfers"] == 3
+    assert statistics["bytes"] == 1072
+    assert statistics["bytes_per_second"] == pytest.approx(1072 / counters[2] * 1e9)
+
+def test_throughput_follows_the_clock_of_the_device():
+    spi = FakeSpiDev(clock=True)
+    spi.max_speed_hz = 8000000
+    engine = SpiTransferEngine(spi)
+
+    for i in range(10):
+        engine.transfer(HEADER, None, 4096)
+
+    # the device is busy for the time on the wire, the host only adds to it
+    assert engine.get_statistics()["bytes_per_second"] <= spi.max_speed_hz / 8
+    assert engine.get_statistics()["bytes_per_second"] > spi.max_speed_hz / 8 / 2
+
+def test_statistics_without_transfers():
+    engine = SpiTransferEngine(FakeSpiDev())
+
+    assert engine.get_statistics() == {"transfers": 0, "bytes": 0, "bytes_per_second": None}